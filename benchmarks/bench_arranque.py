@@ -0,0 +1,64 @@
+"""
+Benchmark de arranque en frío de la aplicación.
+
+Mide, en procesos nuevos:
+1. El tiempo de importar proyecto.src.main (no debe contactar a Keycloak)
+2. La fase de arranque (lifespan) sobre una base de datos nueva
+3. La misma fase sobre una base de datos cuyo esquema ya está al día
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_arranque.py [repeticiones]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SCRIPT_IMPORT = """
+import time
+inicio = time.perf_counter()
+import proyecto.src.main
+print(time.perf_counter() - inicio)
+"""
+
+SCRIPT_LIFESPAN = """
+import time
+from fastapi.testclient import TestClient
+from proyecto.src.main import app
+inicio = time.perf_counter()
+with TestClient(app):
+    print(time.perf_counter() - inicio)
+"""
+
+
+def medir(script: str, db_path: str) -> float:
+    entorno = dict(os.environ, THERAPOSE_DB_PATH=db_path)
+    salida = subprocess.run(
+        [sys.executable, "-c", script], env=entorno, capture_output=True, text=True, check=True
+    )
+    return float(salida.stdout.strip().splitlines()[-1])
+
+
+def resumir(nombre: str, tiempos: list):
+    print(f"{nombre:<32} mediana={statistics.median(tiempos) * 1000:8.1f} ms  "
+          f"min={min(tiempos) * 1000:8.1f} ms  max={max(tiempos) * 1000:8.1f} ms")
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as directorio:
+        importacion, frio, caliente = [], [], []
+        for i in range(repeticiones):
+            db_path = os.path.join(directorio, f"arranque_{i}.db")
+            importacion.append(medir(SCRIPT_IMPORT, db_path))
+            frio.append(medir(SCRIPT_LIFESPAN, db_path))
+            caliente.append(medir(SCRIPT_LIFESPAN, db_path))
+
+    resumir("import proyecto.src.main", importacion)
+    resumir("lifespan (esquema nuevo)", frio)
+    resumir("lifespan (esquema al día)", caliente)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark de la clasificación de posturas (proyecto/src/biblioteca.py).
+
+Construye en un directorio temporal una biblioteca sintética (una pose base por
+postura más ruido, muestras espejadas incluidas) y mide, para distintos tamaños
+de lote, el tiempo por frame de Biblioteca.clasificar frente a una búsqueda
+exhaustiva con NumPy, además del acierto sobre frames nuevos (algunos vistos en
+espejo). También comprueba que el árbol usa el mapa compartido de muestras.npy.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_clasificacion.py [posturas] [muestras_por_postura] [repeticiones]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from proyecto.src import biblioteca  # noqa: E402
+from proyecto.src.puntuacion import ARTICULACIONES  # noqa: E402
+
+TAMANOS_LOTE = (1, 30, 300)
+
+
+def generar_bases(n_posturas: int, rng) -> np.ndarray:
+    """Una pose por postura: tronco de proporciones humanas, extremidades al azar y giro global"""
+    bases = rng.uniform(0.1, 0.9, size=(n_posturas, len(ARTICULACIONES), 2))
+    tronco = {"hombro_izq": (0.45, 0.35), "hombro_der": (0.55, 0.35),
+              "cadera_izq": (0.46, 0.65), "cadera_der": (0.54, 0.65)}
+    for nombre, posicion in tronco.items():
+        bases[:, ARTICULACIONES.index(nombre)] = posicion
+    # Posturas de pie, sentadas o tumbadas: se gira la pose completa alrededor del centro
+    angulos = rng.uniform(0, 2 * np.pi, size=n_posturas)
+    giro = np.stack([np.stack([np.cos(angulos), -np.sin(angulos)], -1),
+                     np.stack([np.sin(angulos), np.cos(angulos)], -1)], -2)
+    return np.einsum("pij,pkj->pki", giro, bases - 0.5) + 0.5
+
+
+def generar(bases: np.ndarray, etiquetas: np.ndarray, rng, ruido: float = 0.02) -> tuple:
+    """Frames del esqueleto común para las posturas indicadas"""
+    puntos = bases[etiquetas] + rng.normal(0, ruido, size=(len(etiquetas), len(ARTICULACIONES), 2))
+    confianza = rng.uniform(0.6, 1.0, size=(len(etiquetas), len(ARTICULACIONES)))
+    # Alguna articulación tapada de vez en cuando
+    confianza[rng.random(confianza.shape) < 0.05] = 0.1
+    return puntos.astype(np.float32), confianza.astype(np.float32)
+
+
+def exhaustiva(lib, puntos, confianza):
+    """Los mismos vecinos por fuerza bruta (todas las distancias), sin votación"""
+    vectores, _ = biblioteca.vectores_pose(puntos, confianza, lib.medias)
+    muestras = np.asarray(lib.muestras)
+    distancias = ((vectores ** 2).sum(1)[:, None] - 2 * vectores @ muestras.T + (muestras ** 2).sum(1)[None])
+    vecinos = np.argpartition(distancias, biblioteca.VECINOS, axis=1)[:, :biblioteca.VECINOS]
+    return np.asarray(lib.etiquetas)[vecinos]
+
+
+def medir(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def main():
+    n_posturas = int(sys.argv[1]) if len(sys.argv) > 1 else 18
+    por_postura = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    repeticiones = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    rng = np.random.default_rng(0)
+    bases = generar_bases(n_posturas, rng)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        biblioteca.BIBLIOTECA_DIR = directorio
+        for id_postura in range(n_posturas):
+            puntos, confianza = generar(bases, np.full(por_postura, id_postura), rng)
+            biblioteca.agregar_muestras(id_postura + 1, puntos, confianza)
+        lib = biblioteca.biblioteca_actual()
+        comparte = np.shares_memory(lib.arbol.data, lib.muestras)
+        print(f"Biblioteca: {n_posturas} posturas, {len(lib.etiquetas)} muestras (con espejo), "
+              f"{lib.muestras.nbytes / 1024:.0f} KiB en mmap, árbol sobre el mapa compartido: {comparte}")
+
+        etiquetas = rng.integers(0, n_posturas, size=1000)
+        puntos, confianza = generar(bases, etiquetas, rng)
+        # Un tercio de los frames, en espejo (el paciente mira hacia el otro lado)
+        puntos[::3, :, 0] = 1 - puntos[::3, :, 0]
+        puntos[::3] = puntos[::3][:, biblioteca._ESPEJO]
+        confianza[::3] = confianza[::3][:, biblioteca._ESPEJO]
+        ids, _ = lib.clasificar(puntos, confianza)
+        clasificados = ids >= 0
+        acierto = (ids[clasificados] == etiquetas[clasificados] + 1).mean()
+        print(f"Acierto: {acierto * 100:.1f} % de {clasificados.sum()} frames clasificados "
+              f"({clasificados.mean() * 100:.1f} % del total)")
+
+        for n in TAMANOS_LOTE:
+            p, c = puntos[:n], confianza[:n]
+            t_arbol = medir(lambda: lib.clasificar(p, c), repeticiones)
+            t_exhaustiva = medir(lambda: exhaustiva(lib, p, c), max(repeticiones // 5, 5))
+            print(f"  lote {n:4d}: árbol {t_arbol / n * 1e6:8.1f} µs/frame   "
+                  f"exhaustiva {t_exhaustiva / n * 1e6:8.1f} µs/frame")
+
+
+if __name__ == "__main__":
+    main()
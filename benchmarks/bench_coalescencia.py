@@ -0,0 +1,147 @@
+"""
+Simulación de avalanchas de peticiones idénticas (proyecto/src/coalescencia.py).
+
+Lanza N hilos que esperan en una barrera y piden a la vez lo mismo:
+1. Una función lenta de prueba (50 ms): con coalescencia debe ejecutarse una sola
+   vez por avalancha, todos reciben el mismo valor (en copias independientes) y,
+   si falla, todos reciben el error.
+2. get_series_by_patient sobre una base de datos SQLite temporal, comparando
+   ejecuciones y tiempo total con la función sin coalescencia.
+3. Una escritura entre dos lecturas: la lectura posterior no se une a la anterior.
+
+Termina con código 1 si alguna comprobación falla.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_coalescencia.py [hilos] [avalanchas]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["THERAPOSE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "coalescencia.db")
+
+from proyecto.src import coalescencia, database  # noqa: E402
+from proyecto.src.metricas import registro  # noqa: E402
+
+fallos = []
+
+
+def comprobar(condicion: bool, mensaje: str):
+    print(("  ok    " if condicion else "  FALLO ") + mensaje)
+    if not condicion:
+        fallos.append(mensaje)
+
+
+def avalancha(funcion, hilos: int, *args) -> tuple:
+    """Llama a funcion(*args) desde todos los hilos a la vez; devuelve (resultados, errores, segundos)"""
+    barrera = threading.Barrier(hilos)
+    resultados, errores = [None] * hilos, [None] * hilos
+
+    def peticion(i):
+        barrera.wait()
+        try:
+            resultados[i] = funcion(*args)
+        except Exception as e:
+            errores[i] = e
+
+    trabajadores = [threading.Thread(target=peticion, args=(i,)) for i in range(hilos)]
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return resultados, errores, time.perf_counter() - inicio
+
+
+def ejecuciones(grupo: str) -> float:
+    return registro.contador("therapose_coalescencia_ejecuciones_total", grupo=grupo)
+
+
+def funcion_lenta(hilos: int):
+    print(f"Función lenta (50 ms), {hilos} hilos")
+    llamadas = []
+
+    @coalescencia.coalescer
+    def consulta_lenta(clave):
+        llamadas.append(clave)
+        time.sleep(0.05)
+        if clave == "falla":
+            raise RuntimeError("fallo simulado")
+        return {"clave": clave, "posturas": [1, 2, 3]}
+
+    resultados, errores, segundos = avalancha(consulta_lenta, hilos, "panel")
+    comprobar(len(llamadas) == 1, f"una ejecución para {hilos} llamadas ({len(llamadas)}, {segundos * 1000:.0f} ms)")
+    comprobar(all(r == resultados[0] for r in resultados) and not any(errores), "todas reciben el mismo valor")
+    comprobar(len({id(r) for r in resultados}) == hilos, "cada llamada recibe su propia copia")
+
+    llamadas.clear()
+    _, errores, _ = avalancha(consulta_lenta, hilos, "falla")
+    comprobar(len(llamadas) == 1 and all(isinstance(e, RuntimeError) for e in errores),
+              "un fallo se ejecuta una vez y llega a todas las llamadas")
+    comprobar(coalescencia.grupo("consulta_lenta").en_curso() == 0, "no quedan claves en curso")
+
+
+def lecturas_base_datos(hilos: int, avalanchas: int):
+    print(f"get_series_by_patient, {hilos} hilos x {avalanchas} avalanchas")
+    database.init_db()
+    database.add_patient("pac-bench", "pac", "pac@example.com", "Pa", "Ciente")
+    database.create_serie_terapeutica("Serie", "Ansiedad", 10, "pac-bench", [])
+    sin_coalescer = database.get_series_by_patient.__wrapped__.__wrapped__
+
+    antes = ejecuciones("get_series_by_patient")
+    t_con = t_sin = 0.0
+    for _ in range(avalanchas):
+        resultados, errores, segundos = avalancha(database.get_series_by_patient, hilos, "pac-bench")
+        t_con += segundos
+        comprobar_resultado = all(len(r) == 1 for r in resultados) and not any(errores)
+        if not comprobar_resultado:
+            break
+        t_sin += avalancha(sin_coalescer, hilos, "pac-bench")[2]
+    total = ejecuciones("get_series_by_patient") - antes
+    comprobar(comprobar_resultado, "todas las llamadas ven la serie")
+    comprobar(total < hilos * avalanchas,
+              f"{total:.0f} consultas para {hilos * avalanchas} llamadas "
+              f"(con coalescencia {t_con / avalanchas * 1000:.1f} ms/avalancha, "
+              f"sin {t_sin / avalanchas * 1000:.1f} ms/avalancha)")
+
+
+def escritura_entre_lecturas():
+    print("Escritura durante una lectura en curso")
+    empezada, seguir = threading.Event(), threading.Event()
+
+    @coalescencia.coalescer
+    def lectura_bloqueada(clave):
+        empezada.set()
+        seguir.wait()
+        return "antes de la escritura"
+
+    primera = threading.Thread(target=lectura_bloqueada, args=("serie",))
+    primera.start()
+    empezada.wait()
+    coalescencia.nueva_generacion()
+    empezada.clear()
+    # La nueva lectura no debe esperar a la primera: si se uniera, se quedaría bloqueada
+    segunda = threading.Thread(target=lectura_bloqueada, args=("serie",))
+    segunda.start()
+    comprobar(empezada.wait(timeout=2), "la lectura posterior a la escritura se ejecuta de nuevo")
+    seguir.set()
+    primera.join()
+    segunda.join()
+
+
+def main():
+    hilos = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    avalanchas = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    funcion_lenta(hilos)
+    lecturas_base_datos(hilos, avalanchas)
+    escritura_entre_lecturas()
+    if fallos:
+        print(f"{len(fallos)} comprobaciones fallidas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
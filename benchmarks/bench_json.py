@@ -0,0 +1,93 @@
+"""
+Micro-benchmark de serialización de las respuestas /api.
+
+Compara, para una lista de sesiones del tamaño indicado:
+1. El camino anterior: dict(zip(columnas, fila)) por fila, duración formateada en
+   un bucle de Python y JSONResponse de Starlette (json.dumps)
+2. El camino actual: registros Sesion (msgspec.Struct) construidos desde la fila
+   y RespuestaJSON (msgspec.json)
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_json.py [numero_sesiones] [repeticiones]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from proyecto.src.modelos import RespuestaJSON, Sesion  # noqa: E402
+
+COLUMNAS = ['id_sesion', 'fecha', 'hora_inicio', 'hora_fin',
+            'intensidad_inicio', 'intensidad_final', 'comentario',
+            'tiempo_efectivo', 'puntuacion']
+
+
+def generar_filas(n: int) -> list:
+    return [
+        (i, "2024-03-%02d" % (i % 28 + 1), "10:00:00", "10:25:00", i % 5, (i + 2) % 5,
+         "Sesión tranquila, buena respiración" if i % 3 else None, 12.5 + (i % 7) * 0.25,
+         round(60 + (i % 40) * 0.9, 1) if i % 4 else None)
+        for i in range(n)
+    ]
+
+
+def camino_anterior(filas: list) -> bytes:
+    sesiones = [dict(zip(COLUMNAS, fila)) for fila in filas]
+    for sesion in sesiones:
+        minutos = int(sesion['tiempo_efectivo'])
+        segundos = round((sesion['tiempo_efectivo'] - minutos) * 60)
+        sesion['duracion_formateada'] = f"{minutos} min{' ' + str(segundos) + ' seg' if segundos > 0 else ''}"
+    return JSONResponse(content={"sesiones": sesiones}).body
+
+
+def camino_actual(filas: list) -> bytes:
+    sesiones = [Sesion(*fila) for fila in filas]
+    return RespuestaJSON(content={"sesiones": sesiones}).body
+
+
+def solo_codificacion(filas: list):
+    """Separa el coste de serializar del de construir los objetos"""
+    dicts = [dict(zip(COLUMNAS, fila)) for fila in filas]
+    registros = [Sesion(*fila) for fila in filas]
+    return (
+        lambda: JSONResponse(content={"sesiones": dicts}).body,
+        lambda: RespuestaJSON(content={"sesiones": registros}).body,
+    )
+
+
+def medir(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    filas = generar_filas(n)
+
+    # Ambos caminos deben producir el mismo documento
+    import json
+    assert json.loads(camino_anterior(filas)) == json.loads(camino_actual(filas))
+
+    anterior = medir(lambda: camino_anterior(filas), repeticiones)
+    actual = medir(lambda: camino_actual(filas), repeticiones)
+    json_stdlib, json_msgspec = solo_codificacion(filas)
+    cod_anterior = medir(json_stdlib, repeticiones)
+    cod_actual = medir(json_msgspec, repeticiones)
+
+    print(f"Sesiones: {n}, repeticiones: {repeticiones} (mediana)")
+    print(f"  filas -> JSON, anterior (dict + json.dumps):  {anterior * 1000:8.2f} ms")
+    print(f"  filas -> JSON, actual (Struct + msgspec):     {actual * 1000:8.2f} ms  x{anterior / actual:.1f}")
+    print(f"  solo serialización, json.dumps:               {cod_anterior * 1000:8.2f} ms")
+    print(f"  solo serialización, msgspec:                  {cod_actual * 1000:8.2f} ms  x{cod_anterior / cod_actual:.1f}")
+
+
+if __name__ == "__main__":
+    main()
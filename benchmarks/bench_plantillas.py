@@ -0,0 +1,98 @@
+"""
+Asignación de una plantilla de serie a muchos pacientes (asignar_plantilla_serie)
+frente a crear la misma serie paciente por paciente con create_serie_terapeutica.
+
+Sobre una base de datos SQLite temporal con un instructor y N pacientes:
+1. Una llamada a create_serie_terapeutica por paciente (una transacción cada una)
+2. Una sola llamada a asignar_plantilla_serie con todos los pacientes
+
+Se comprueba que las dos dejan las mismas series y posturas, y que una segunda
+asignación no crea ninguna serie (todos tienen ya una serie activa).
+
+Termina con código 1 si alguna comprobación falla.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_plantillas.py [pacientes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DIRECTORIO = tempfile.mkdtemp()
+os.environ["THERAPOSE_DB_PATH"] = os.path.join(DIRECTORIO, "plantillas.db")
+
+from proyecto.src import database  # noqa: E402
+
+fallos = []
+
+
+def comprobar(condicion: bool, mensaje: str):
+    print(("  ok    " if condicion else "  FALLO ") + mensaje)
+    if not condicion:
+        fallos.append(mensaje)
+
+
+def preparar(pacientes: int) -> tuple:
+    """Crea el instructor y dos grupos de pacientes; devuelve (grupo a, grupo b)"""
+    database.init_db()
+    database.add_instructor("inst-bench", "inst", "inst@example.com", "Ins", "Tructor")
+    grupos = ([f"a{k}" for k in range(pacientes)], [f"b{k}" for k in range(pacientes)])
+    for patient_id in grupos[0] + grupos[1]:
+        database.add_patient(patient_id, patient_id, f"{patient_id}@example.com", "Pa", "Ciente")
+        database.add_patient_to_instructor("inst-bench", patient_id)
+    return grupos
+
+
+def contar(pacientes: list) -> tuple:
+    """(series activas, posturas en esas series) de los pacientes"""
+    conn = database.get_connection()
+    marcadores = ",".join("?" * len(pacientes))
+    fila = conn.execute(f"""
+        SELECT COUNT(DISTINCT st.id_serie), COUNT(pe.id_postura)
+        FROM serie_terapeutica st
+        LEFT JOIN postura_en_serie pe ON pe.id_serie = st.id_serie
+        WHERE st.activa = 1 AND st.patient_id IN ({marcadores})
+    """, pacientes).fetchone()
+    conn.close()
+    return tuple(fila)
+
+
+def main():
+    pacientes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    uno_a_uno, en_bloque = preparar(pacientes)
+    posturas = [(p.id_postura, orden, 2.0)
+                for orden, p in enumerate(database.get_posturas_by_tipo_terapia("Ansiedad")[:6], start=1)]
+    print(f"{pacientes} pacientes, {len(posturas)} posturas por serie")
+
+    inicio = time.perf_counter()
+    for patient_id in uno_a_uno:
+        database.create_serie_terapeutica("Serie", "Ansiedad", 10, patient_id, posturas)
+    segundos_uno_a_uno = time.perf_counter() - inicio
+    print(f"  create_serie_terapeutica por paciente: {segundos_uno_a_uno:.2f} s")
+
+    id_plantilla = database.create_plantilla_serie("inst-bench", "Serie", "Ansiedad", 10, posturas)
+    inicio = time.perf_counter()
+    resultado = database.asignar_plantilla_serie("inst-bench", id_plantilla, en_bloque)
+    segundos_en_bloque = time.perf_counter() - inicio
+    print(f"  asignar_plantilla_serie:               {segundos_en_bloque:.3f} s "
+          f"({segundos_uno_a_uno / segundos_en_bloque:.0f}x)")
+
+    comprobar(len(resultado["creadas"]) == pacientes, "la asignación crea una serie por paciente")
+    comprobar(contar(en_bloque) == contar(uno_a_uno) == (pacientes, pacientes * len(posturas)),
+              "las dos formas dejan las mismas series y posturas")
+    repetida = database.asignar_plantilla_serie("inst-bench", id_plantilla, en_bloque)
+    comprobar(not repetida["creadas"] and len(repetida["con_serie_activa"]) == pacientes,
+              "una segunda asignación respeta la serie activa de cada paciente")
+    comprobar(segundos_en_bloque < segundos_uno_a_uno, "la asignación en bloque es más rápida")
+
+    shutil.rmtree(DIRECTORIO, ignore_errors=True)
+    if fallos:
+        print(f"{len(fallos)} comprobaciones fallidas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
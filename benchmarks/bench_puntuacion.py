@@ -0,0 +1,107 @@
+"""
+Micro-benchmark de la evaluación de posturas (proyecto/src/puntuacion.py).
+
+Mide el tiempo de cálculo por frame (keypoints -> esqueleto común -> ángulos ->
+puntuación frente a una referencia) para distintos tamaños de lote y lo compara
+con PRESUPUESTO_US_POR_FRAME (lotes de 30 frames). Como referencia se incluye el
+mismo cálculo hecho frame a frame y ángulo a ángulo en Python puro.
+
+No usa la base de datos: la referencia se construye con frames sintéticos.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_puntuacion.py [formato] [repeticiones]
+"""
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from proyecto.src import puntuacion  # noqa: E402
+
+TAMANOS_LOTE = (1, 30, 300)
+
+
+def generar_frames(n: int, formato: str, semilla: int = 0) -> np.ndarray:
+    """Frames sintéticos: una pose base con ruido y algunos puntos poco visibles"""
+    esquema = puntuacion.FORMATOS[formato]
+    rng = np.random.default_rng(semilla)
+    base = rng.uniform(0.2, 0.8, size=(esquema.puntos, esquema.valores)).astype(np.float32)
+    frames = np.repeat(base[None], n, axis=0)
+    frames[..., :2] += rng.normal(0, 0.01, size=(n, esquema.puntos, 2))
+    frames[..., esquema.confianza] = rng.uniform(0.3, 1.0, size=(n, esquema.puntos))
+    return frames
+
+
+def evaluar_numpy(frames, formato, referencia):
+    puntos, confianza = puntuacion.a_esqueleto(frames, formato)
+    angulos, pesos = puntuacion.angulos_articulares(puntos, confianza)
+    return puntuacion.puntuar(angulos, pesos, *referencia)[0]
+
+
+def evaluar_python(frames, formato, referencia):
+    """El mismo cálculo sin vectorizar, como lo escribiría un bucle por frame"""
+    esquema = puntuacion.FORMATOS[formato]
+    angulos_ref, pesos_ref = (r.tolist() for r in referencia)
+    triples = [tuple(puntuacion.ARTICULACIONES.index(n) for n in t) for t in puntuacion.ANGULOS.values()]
+    resultados = []
+    for frame in frames.tolist():
+        esqueleto = [frame[i] for i in esquema.indices]
+        suma = total = 0.0
+        for k, (a, b, c) in enumerate(triples):
+            pa, pb, pc = esqueleto[a], esqueleto[b], esqueleto[c]
+            peso = min(pa[esquema.confianza], pb[esquema.confianza], pc[esquema.confianza])
+            bax, bay = pa[0] - pb[0], pa[1] - pb[1]
+            bcx, bcy = pc[0] - pb[0], pc[1] - pb[1]
+            normas = math.hypot(bax, bay) * math.hypot(bcx, bcy)
+            if peso < puntuacion.UMBRAL_CONFIANZA or normas == 0:
+                continue
+            angulo = math.degrees(math.acos(max(-1.0, min(1.0, (bax * bcx + bay * bcy) / normas))))
+            w = peso * pesos_ref[k]
+            desviacion = (angulo - angulos_ref[k]) / puntuacion.TOLERANCIA_GRADOS
+            suma += w * math.exp(-0.5 * desviacion * desviacion)
+            total += w
+        resultados.append(100.0 * suma / total if total > 0 else float("nan"))
+    return np.array(resultados)
+
+
+def medir(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def main():
+    formato = sys.argv[1] if len(sys.argv) > 1 else "mediapipe"
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    puntos, confianza = puntuacion.a_esqueleto(generar_frames(60, formato, semilla=1), formato)
+    plantilla, fiabilidad = puntuacion.crear_referencia(puntos, confianza)
+    angulos, pesos = puntuacion.angulos_articulares(plantilla[None], fiabilidad[None])
+    referencia = (angulos[0], pesos[0])
+
+    print(f"Formato: {formato}, repeticiones: {repeticiones} (mediana)")
+    print(f"Presupuesto: {puntuacion.PRESUPUESTO_US_POR_FRAME} µs/frame en lotes de 30 frames")
+    for n in TAMANOS_LOTE:
+        frames = generar_frames(n, formato)
+        # Ambas implementaciones deben dar las mismas puntuaciones
+        np.testing.assert_allclose(evaluar_numpy(frames, formato, referencia),
+                                   evaluar_python(frames, formato, referencia), rtol=1e-3, atol=1e-2)
+        t_numpy = medir(lambda: evaluar_numpy(frames, formato, referencia), repeticiones)
+        t_python = medir(lambda: evaluar_python(frames, formato, referencia), max(repeticiones // 10, 5))
+        por_frame = t_numpy / n * 1e6
+        marca = ""
+        if n == 30:
+            marca = "  OK" if por_frame <= puntuacion.PRESUPUESTO_US_POR_FRAME else "  FUERA DE PRESUPUESTO"
+        print(f"  lote {n:4d}: numpy {por_frame:8.2f} µs/frame   python {t_python / n * 1e6:8.2f} µs/frame"
+              f"   x{t_python / t_numpy:.1f}{marca}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Impacto de una copia de seguridad en caliente (proyecto/src/respaldo.py) sobre la
+latencia de las escrituras.
+
+Sobre una base de datos SQLite temporal con muchas sesiones, un hilo llama sin
+parar a create_sesion y se mide su latencia (p50, p99 y máxima):
+1. Sin copia en curso (referencia)
+2. Durante copiar_base_datos (copia por pasos, con cambio a copia de una vez si
+   se reinicia demasiado con el diario clásico)
+3. Durante una copia de una sola vez sin transacción de lectura (pages=-1)
+
+Cada escenario se repite con el diario clásico (rollback, el modo por defecto) y
+con WAL (modo del proceso escritor). También se comprueba que la copia termina y
+que verificar_respaldo la acepta.
+
+Termina con código 1 si alguna comprobación falla.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_respaldo.py [sesiones]
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DIRECTORIO = tempfile.mkdtemp()
+os.environ["THERAPOSE_DB_PATH"] = os.path.join(DIRECTORIO, "respaldo.db")
+os.environ["THERAPOSE_RESPALDOS_DIR"] = os.path.join(DIRECTORIO, "respaldos")
+
+from proyecto.src import database, respaldo  # noqa: E402
+
+fallos = []
+
+
+def comprobar(condicion: bool, mensaje: str):
+    print(("  ok    " if condicion else "  FALLO ") + mensaje)
+    if not condicion:
+        fallos.append(mensaje)
+
+
+def preparar(sesiones: int) -> int:
+    """Crea la base de datos con `sesiones` sesiones; devuelve el id de la serie"""
+    database.init_db()
+    database.add_patient("pac-bench", "pac", "pac@example.com", "Pa", "Ciente")
+    database.create_serie_terapeutica("Serie", "Ansiedad", 10, "pac-bench", [])
+    id_serie = database.get_series_by_patient("pac-bench")[0].id_serie
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.executemany(
+        "INSERT INTO sesion (id_serie, fecha, hora_inicio, hora_fin, intensidad_inicio, intensidad_final, "
+        "comentario) VALUES (?, '2024-01-01', '10:00', '11:00', 7, 3, ?)",
+        ((id_serie, "comentario de la sesión " * 8) for _ in range(sesiones)))
+    conn.commit()
+    conn.close()
+    return id_serie
+
+
+def escribir_mientras(id_serie: int, copia) -> tuple:
+    """Ejecuta copia() mientras un hilo escribe sesiones; devuelve (latencias ms, segundos, resultado)"""
+    latencias, parar = [], threading.Event()
+
+    def escritor():
+        while not parar.is_set():
+            inicio = time.perf_counter()
+            database.create_sesion(id_serie, date(2024, 2, 1), "10:00", "11:00", 6, 2, "durante la copia")
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            time.sleep(0.002)
+
+    hilo = threading.Thread(target=escritor)
+    hilo.start()
+    time.sleep(0.2)
+    inicio = time.perf_counter()
+    resultado = copia()
+    segundos = time.perf_counter() - inicio
+    time.sleep(0.2)
+    parar.set()
+    hilo.join()
+    return latencias, segundos, resultado
+
+
+def resumen(latencias: list) -> str:
+    p = statistics.quantiles(latencias, n=100)
+    return f"p50 {p[49]:.1f} ms, p99 {p[98]:.1f} ms, máx {max(latencias):.1f} ms ({len(latencias)} escrituras)"
+
+
+def copia_de_una_vez():
+    origen = sqlite3.connect(database.DB_PATH)
+    destino = sqlite3.connect(os.path.join(DIRECTORIO, "bloque.db"))
+    origen.backup(destino, pages=-1)
+    destino.close()
+    origen.close()
+
+
+def escenarios(id_serie: int, modo: str):
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.execute(f"PRAGMA journal_mode={modo}")
+    conn.close()
+    paginas = os.path.getsize(database.DB_PATH) // 4096
+    print(f"Diario {modo} ({paginas} páginas)")
+
+    latencias, _, _ = escribir_mientras(id_serie, lambda: time.sleep(1.0))
+    print(f"  sin copia:          {resumen(latencias)}")
+
+    destino = os.path.join(DIRECTORIO, "pasos.db")
+    latencias, segundos, detalles = escribir_mientras(id_serie, lambda: respaldo.copiar_base_datos(destino))
+    print(f"  copia por pasos:    {resumen(latencias)}; copia {segundos:.2f} s, "
+          f"estrategia {detalles['estrategia']}, {detalles['reinicios']} reinicios")
+    comprobar(sqlite3.connect(destino).execute("PRAGMA integrity_check").fetchone()[0] == "ok",
+              "la copia por pasos termina y es íntegra")
+
+    latencias, segundos, _ = escribir_mientras(id_serie, copia_de_una_vez)
+    print(f"  copia de una vez:   {resumen(latencias)}; copia {segundos:.2f} s")
+
+    comprimida = os.path.join(DIRECTORIO, "pasos.db.gz")
+    with open(destino, "rb") as entrada, gzip.open(comprimida, "wb") as salida:
+        shutil.copyfileobj(entrada, salida)
+    filas = respaldo.verificar_respaldo(comprimida)["filas"]
+    comprobar(filas["sesion"] > 0, f"verificar_respaldo acepta la copia ({filas['sesion']} sesiones)")
+
+
+def main():
+    sesiones = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    id_serie = preparar(sesiones)
+    escenarios(id_serie, "delete")
+    escenarios(id_serie, "wal")
+
+    with open(os.path.join(DIRECTORIO, "dañada.db.gz"), "wb") as salida:
+        salida.write(gzip.compress(b"SQLite format 3\0" + b"\xff" * 8192))
+    try:
+        respaldo.verificar_respaldo(os.path.join(DIRECTORIO, "dañada.db.gz"))
+        comprobar(False, "verificar_respaldo rechaza una copia dañada")
+    except respaldo.RespaldoInvalido:
+        comprobar(True, "verificar_respaldo rechaza una copia dañada")
+
+    shutil.rmtree(DIRECTORIO, ignore_errors=True)
+    if fallos:
+        print(f"{len(fallos)} comprobaciones fallidas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
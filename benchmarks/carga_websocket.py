@@ -0,0 +1,176 @@
+"""
+Generador de carga para /ws/sesion/{id_serie} (proyecto/src/transmision.py).
+
+Simula pacientes concurrentes que envían keypoints sintéticos de MediaPipe a
+--fps frames por segundo (agrupados de --frames-por-mensaje en cada mensaje
+binario) y mide, para cada nivel de concurrencia:
+- puntuaciones recibidas por segundo y por paciente (objetivo: THERAPOSE_WS_HZ)
+- percentil 95 del intervalo entre puntuaciones
+- fracción de los frames enviados que el servidor llegó a puntuar
+
+Un nivel es sostenible si todos los pacientes reciben al menos el 90 % de las
+puntuaciones esperadas, el p95 del intervalo no supera dos periodos y se puntúa
+al menos el 90 % de los frames. La prueba se detiene en el primer nivel que no
+lo es. Para medir un solo worker, arranque el servidor con uvicorn --workers 1;
+los pacientes simulados se reparten en --procesos procesos para que el propio
+generador no sea el cuello de botella.
+
+Requiere un servidor en marcha, la cookie access_token de un paciente y una
+serie suya. Con --admin-token se sube antes una referencia sintética para la
+postura (si no tiene referencia, el servidor no puntúa).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/carga_websocket.py --token TOKEN --serie 1 --postura 1 \\
+        [--url ws://127.0.0.1:8000] [--niveles 10,50,100,200,400] [--segundos 10]
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import websockets  # noqa: E402
+from proyecto.src.transmision import FRECUENCIA_HZ  # noqa: E402
+
+
+def pose_base(semilla: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(semilla)
+    base = rng.uniform(0.2, 0.8, size=(33, 4)).astype(np.float32)
+    base[:, 3] = 0.95
+    return base
+
+
+def subir_referencia(url_http: str, admin_token: str, id_postura: int):
+    frames = np.repeat(pose_base()[None], 30, axis=0)
+    peticion = urllib.request.Request(
+        f"{url_http}/admin/posturas/{id_postura}/referencia",
+        data=json.dumps({"formato": "mediapipe", "frames": frames.tolist()}).encode(),
+        headers={"X-Admin-Token": admin_token, "Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(peticion) as respuesta:
+        respuesta.read()
+
+
+async def paciente(args, indice: int, fin: float) -> dict:
+    """Un paciente: envía frames hasta fin y registra las puntuaciones recibidas"""
+    rng = np.random.default_rng(indice)
+    base = pose_base()
+    llegadas = []
+    puntuados = 0
+    enviados = 0
+    async with websockets.connect(f"{args.url}/ws/sesion/{args.serie}",
+                                  extra_headers={"Cookie": f"access_token={args.token}"}) as ws:
+        await ws.send(json.dumps({"tipo": "postura", "id_postura": args.postura, "formato": "mediapipe"}))
+
+        async def recibir():
+            nonlocal puntuados
+            async for mensaje in ws:
+                datos = json.loads(mensaje)
+                if datos.get("tipo") == "puntuacion":
+                    llegadas.append(time.perf_counter())
+                    puntuados += datos["frames"]
+
+        receptor = asyncio.create_task(recibir())
+        intervalo = args.frames_por_mensaje / args.fps
+        inicio = time.perf_counter()
+        # Cada paciente empieza en un instante distinto del periodo, como en la realidad
+        await asyncio.sleep(rng.uniform(0, intervalo))
+        siguiente = time.perf_counter()
+        while siguiente < fin:
+            frames = np.empty((args.frames_por_mensaje, 1 + 33 * 4), dtype="<f4")
+            for k in range(args.frames_por_mensaje):
+                frames[k, 0] = (time.perf_counter() - inicio) * 1000
+                pose = base.copy()
+                pose[:, :2] += rng.normal(0, 0.01, size=(33, 2))
+                frames[k, 1:] = pose.ravel()
+            await ws.send(frames.tobytes())
+            enviados += args.frames_por_mensaje
+            siguiente += intervalo
+            await asyncio.sleep(max(0.0, siguiente - time.perf_counter()))
+        # Última puntuación pendiente
+        await asyncio.sleep(2 / FRECUENCIA_HZ)
+        receptor.cancel()
+    duracion = fin - inicio
+    huecos = np.diff(llegadas) if len(llegadas) > 1 else np.array([duracion])
+    return {
+        "tasa": sum(1 for t in llegadas if t <= fin) / duracion,
+        "p95_hueco": float(np.percentile(huecos, 95)),
+        "puntuados": puntuados / max(enviados, 1),
+    }
+
+
+async def _grupo(args, indices, fin: float) -> list:
+    return await asyncio.gather(*(paciente(args, i, fin) for i in indices))
+
+
+def grupo(args, indices, inicio: float) -> list:
+    """Pacientes simulados por un proceso; todos los procesos empiezan en inicio (time.time)"""
+    time.sleep(max(0.0, inicio - time.time()))
+    fin = time.perf_counter() + args.segundos
+    return asyncio.run(_grupo(args, indices, fin))
+
+
+def nivel(args, clientes: int) -> dict:
+    procesos = max(1, min(args.procesos, clientes))
+    # Margen para que los procesos arranquen y empiecen a la vez
+    inicio = time.time() + 1.0
+    with ProcessPoolExecutor(procesos) as pool:
+        partes = pool.map(grupo, [args] * procesos,
+                          [range(p, clientes, procesos) for p in range(procesos)], [inicio] * procesos)
+        resultados = [r for parte in partes for r in parte]
+    tasas = [r["tasa"] for r in resultados]
+    return {
+        "clientes": clientes,
+        "tasa_min": min(tasas),
+        "tasa_media": statistics.mean(tasas),
+        "p95_hueco": max(r["p95_hueco"] for r in resultados),
+        "puntuados": min(r["puntuados"] for r in resultados),
+    }
+
+
+def ejecutar(args):
+    periodo = 1 / FRECUENCIA_HZ
+    print(f"Objetivo: {FRECUENCIA_HZ:g} puntuaciones/s por paciente, {args.fps} fps, "
+          f"{args.frames_por_mensaje} frames por mensaje, {args.segundos} s por nivel")
+    maximo = 0
+    for clientes in (int(n) for n in args.niveles.split(",")):
+        r = nivel(args, clientes)
+        sostenible = (r["tasa_min"] >= 0.9 * FRECUENCIA_HZ and r["p95_hueco"] <= 2 * periodo
+                      and r["puntuados"] >= 0.9)
+        print(f"  {clientes:5d} pacientes: {r['tasa_media']:5.2f} punt/s (mín {r['tasa_min']:5.2f}), "
+              f"p95 intervalo {r['p95_hueco'] * 1000:6.0f} ms, frames puntuados ≥ {r['puntuados'] * 100:5.1f} %"
+              f"  {'OK' if sostenible else 'SATURADO'}")
+        if not sostenible:
+            break
+        maximo = clientes
+    print(f"Pacientes concurrentes sostenibles: {maximo}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--token", required=True, help="Cookie access_token de un paciente")
+    parser.add_argument("--serie", type=int, required=True)
+    parser.add_argument("--postura", type=int, required=True)
+    parser.add_argument("--admin-token", help="Sube una referencia sintética para la postura")
+    parser.add_argument("--niveles", default="10,50,100,200,400")
+    parser.add_argument("--segundos", type=float, default=10)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--frames-por-mensaje", type=int, default=3)
+    parser.add_argument("--procesos", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    args = parser.parse_args()
+    if args.admin_token:
+        subir_referencia(args.url.replace("ws", "http", 1), args.admin_token, args.postura)
+    ejecutar(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,22 +12,35 @@ KEYCLOAK_CLIENT_SECRET = os.getenv("KEYCLOAK_CLIENT_SECRET", "ZwdSdvqdylUikyYMds
 KEYCLOAK_REALM = os.getenv("KEYCLOAK_REALM", "yoga-realm")
 KEYCLOAK_ADMIN_USERNAME = os.getenv("KEYCLOAK_ADMIN_USERNAME", "admin")
 KEYCLOAK_ADMIN_PASSWORD = os.getenv("KEYCLOAK_ADMIN_PASSWORD", "admin")
+# Timeout (segundos) de cada petición a Keycloak; acota cuánto puede bloquear un hilo
+# (python-keycloak espera 60 s por defecto)
+KEYCLOAK_TIMEOUT_S = float(os.getenv("KEYCLOAK_TIMEOUT_S", "5"))
 
 # Inicializar KeycloakOpenID
 keycloak_openid = KeycloakOpenID(
     server_url=KEYCLOAK_SERVER_URL,
     client_id=KEYCLOAK_CLIENT_ID,
     realm_name=KEYCLOAK_REALM,
-    client_secret_key=KEYCLOAK_CLIENT_SECRET
+    client_secret_key=KEYCLOAK_CLIENT_SECRET,
+    timeout=KEYCLOAK_TIMEOUT_S
 )
 
-# Inicializar KeycloakAdmin
-keycloak_admin = KeycloakAdmin(
-    server_url=KEYCLOAK_SERVER_URL,
-    username=KEYCLOAK_ADMIN_USERNAME,
-    password=KEYCLOAK_ADMIN_PASSWORD,
-    realm_name="master",
-    verify=True
-)
-# Cambiar al realm de usuarios después de la autenticación
-keycloak_admin.realm_name = KEYCLOAK_REALM 
\ No newline at end of file
+# KeycloakAdmin se autentica contra Keycloak al instanciarse, por lo que no se crea
+# al importar el módulo: proyecto/src/admin.py lo inicializa en la primera llamada
+def crear_keycloak_admin():
+    """
+    Crea un cliente KeycloakAdmin autenticado en el realm master
+    y configurado para operar sobre el realm de usuarios.
+    """
+    keycloak_admin = KeycloakAdmin(
+        server_url=KEYCLOAK_SERVER_URL,
+        username=KEYCLOAK_ADMIN_USERNAME,
+        password=KEYCLOAK_ADMIN_PASSWORD,
+        realm_name="master",
+        verify=True,
+        timeout=KEYCLOAK_TIMEOUT_S
+    )
+    # Cambiar al realm de usuarios después de la autenticación
+    keycloak_admin.realm_name = KEYCLOAK_REALM
+    return keycloak_admin
+ 
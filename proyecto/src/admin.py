@@ -1,7 +1,8 @@
-import time
-from keycloak_config import keycloak_openid, keycloak_admin, KEYCLOAK_SERVER_URL, KEYCLOAK_ADMIN_USERNAME, KEYCLOAK_ADMIN_PASSWORD, KEYCLOAK_REALM
+import threading
+from keycloak_config import crear_keycloak_admin
 from keycloak.exceptions import KeycloakAuthenticationError
-from keycloak import KeycloakAdmin
+from .circuito import CircuitoAbierto, circuito_keycloak
+from .metricas import span
 
 default_admin_tokens = {
     'access_token': None,
@@ -10,6 +11,23 @@ default_admin_tokens = {
 }
 admin_tokens = default_admin_tokens.copy()
 
+# Cliente de administración; se crea (login en Keycloak) en la primera llamada
+keycloak_admin = None
+_lock_keycloak_admin = threading.Lock()
+
+
+def get_keycloak_admin():
+    """
+    Devuelve el cliente KeycloakAdmin, creándolo de forma perezosa y una sola vez
+    aunque varias peticiones lo soliciten a la vez.
+    """
+    global keycloak_admin
+    if keycloak_admin is None:
+        with _lock_keycloak_admin:
+            if keycloak_admin is None:
+                keycloak_admin = crear_keycloak_admin()
+    return keycloak_admin
+
 
 def refresh_keycloak_admin_token():
     """
@@ -19,33 +37,33 @@ def refresh_keycloak_admin_token():
     """
     global keycloak_admin
     try:
-        # Crear nueva instancia de KeycloakAdmin
-        keycloak_admin = KeycloakAdmin(
-            server_url=KEYCLOAK_SERVER_URL,
-            username=KEYCLOAK_ADMIN_USERNAME,
-            password=KEYCLOAK_ADMIN_PASSWORD,
-            realm_name="master",
-            verify=True
-        )
-        # Cambiar al realm de usuarios
-        keycloak_admin.realm_name = KEYCLOAK_REALM
+        # Crear nueva instancia de KeycloakAdmin (ya configurada con el realm de usuarios)
+        keycloak_admin = circuito_keycloak.llamar(crear_keycloak_admin)
+    except CircuitoAbierto:
+        raise
     except Exception as e:
         raise Exception(f"Error refreshing admin token: {str(e)}")
 
+def _llamar_admin(method_name, *args, **kwargs):
+    # El login perezoso del cliente cuenta como parte de la llamada en el circuito
+    method = getattr(get_keycloak_admin(), method_name)
+    return method(*args, **kwargs)
+
 def keycloak_admin_call(method_name, *args, **kwargs):
     """
     Función auxiliar para llamadas seguras a la API de Keycloak:
-    1. Intenta ejecutar el método solicitado
+    1. Intenta ejecutar el método solicitado a través del circuito de Keycloak
     2. Si falla por autenticación, refresca el token y reintenta una vez
+    3. Con el circuito abierto falla al instante con CircuitoAbierto
     """
-    global keycloak_admin
-    method = getattr(keycloak_admin, method_name)
-    try:
-        return method(*args, **kwargs)
-    except KeycloakAuthenticationError:
-        # Si falla por autenticación, refrescar token y reintentar una vez
-        refresh_keycloak_admin_token()
-        method = getattr(keycloak_admin, method_name)
-        return method(*args, **kwargs)
-    except Exception as e:
-        raise Exception(f"Error in keycloak_admin_call: {str(e)}") 
+    with span(f"keycloak.admin.{method_name}"):
+        try:
+            return circuito_keycloak.llamar(_llamar_admin, method_name, *args, **kwargs)
+        except KeycloakAuthenticationError:
+            # Si falla por autenticación, refrescar token y reintentar una vez
+            refresh_keycloak_admin_token()
+            return circuito_keycloak.llamar(_llamar_admin, method_name, *args, **kwargs)
+        except CircuitoAbierto:
+            raise
+        except Exception as e:
+            raise Exception(f"Error in keycloak_admin_call: {str(e)}")
@@ -0,0 +1,221 @@
+"""
+Control de admisión de las operaciones que llaman a Keycloak de forma síncrona
+(login, registro de instructores y alta de pacientes).
+
+Dos mecanismos, en este orden:
+
+1. Límite por cliente (cubo de tokens): cada clave tiene un cubo con `capacidad`
+   intentos que se recargan a `por_minuto`. Un cubo vacío rechaza con 429 y
+   Retry-After. Los cubos de LIMITES (por IP del cliente) gastan un token en cada
+   intento; los de LIMITES_FALLOS (en el login, por nombre de usuario) solo en los
+   intentos fallidos (registrar_fallo), para frenar el credential stuffing
+   repartido entre muchas IPs sin que cualquiera pueda bloquear a un usuario
+   enviando peticiones con su nombre.
+2. Cupo global: como mucho MAX_OPERACIONES_IDENTIDAD operaciones en curso por
+   proceso. Si no hay hueco en ESPERA_CUPO_S, se rechaza con 503. Así una
+   avalancha de logins no ocupa todos los hilos del threadpool y las páginas de
+   los pacientes siguen respondiendo.
+
+Los cubos se guardan en memoria del proceso, o en un archivo SQLite compartido por
+los workers de la máquina si THERAPOSE_LIMITES_DB lo indica (los límites pasan a
+ser por máquina y no por worker). La IP es request.client.host: detrás de un
+proxy, uvicorn debe arrancarse con --proxy-headers.
+
+Métricas: therapose_admision_rechazos_total (por operación y motivo).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from fastapi import Request
+from .metricas import registro
+
+logger = logging.getLogger(__name__)
+
+
+class Limite(NamedTuple):
+    capacidad: int
+    por_minuto: float
+
+
+# Límites por operación y tipo de clave: cada intento gasta un token
+LIMITES = {
+    "login": {"ip": Limite(20, 20)},
+    "registro": {"ip": Limite(5, 0.1)},
+    "crear_paciente": {"ip": Limite(20, 10)},
+}
+# Límites que solo gastan los intentos fallidos; un cubo vacío rechaza igualmente
+LIMITES_FALLOS = {
+    "login": {"usuario": Limite(5, 1)},
+}
+# Operaciones de identidad simultáneas por proceso y espera máxima por un hueco
+MAX_OPERACIONES_IDENTIDAD = int(os.getenv("THERAPOSE_MAX_OPERACIONES_IDENTIDAD", "8"))
+ESPERA_CUPO_S = 0.2
+# Claves de cubo en memoria (las menos usadas se descartan: vuelven con el cubo lleno)
+MAX_CUBOS_MEMORIA = 100000
+# Archivo SQLite compartido para los cubos (opcional)
+LIMITES_DB = os.getenv("THERAPOSE_LIMITES_DB")
+
+registro.describir("therapose_admision_rechazos_total",
+                   "Operaciones de identidad rechazadas, por operación y motivo (ip, usuario o cupo).")
+
+
+def consumir(tokens: float, instante: float, ahora: float, limite: Limite, coste: int = 1) -> tuple:
+    """
+    Recarga el cubo hasta `ahora` e intenta tomar `coste` tokens (con coste 0 solo
+    comprueba que quede alguno).
+
+    Returns:
+        tuple: (tokens restantes, permitido, segundos hasta el siguiente token)
+    """
+    recarga_s = limite.por_minuto / 60
+    tokens = min(limite.capacidad, tokens + (ahora - instante) * recarga_s)
+    if tokens >= 1:
+        return tokens - coste, True, 0.0
+    return tokens, False, (1 - tokens) / recarga_s
+
+
+class AlmacenMemoria:
+    """Cubos en un diccionario del proceso (LRU acotado)"""
+
+    def __init__(self):
+        self._cubos = OrderedDict()  # clave -> (tokens, instante)
+        self._lock = threading.Lock()
+
+    def tomar(self, clave: str, limite: Limite, coste: int = 1) -> tuple:
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, instante = self._cubos.pop(clave, (limite.capacidad, ahora))
+            tokens, permitido, espera = consumir(tokens, instante, ahora, limite, coste)
+            self._cubos[clave] = (tokens, ahora)
+            if len(self._cubos) > MAX_CUBOS_MEMORIA:
+                self._cubos.popitem(last=False)
+        return permitido, espera
+
+
+class AlmacenSQLite:
+    """
+    Cubos en un archivo SQLite compartido por los procesos de la máquina. Cada
+    consulta es una transacción corta BEGIN IMMEDIATE (lectura y escritura del cubo).
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._local = threading.local()
+        conn = self._conexion()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cubo (clave TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                     "instante REAL NOT NULL)")
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.ruta, isolation_level=None, timeout=1.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def tomar(self, clave: str, limite: Limite, coste: int = 1) -> tuple:
+        # Reloj de pared: los instantes se comparan entre procesos
+        ahora = time.time()
+        conn = self._conexion()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Archivo bloqueado más de un segundo: se admite antes que bloquear el login
+            logger.warning("Almacén de límites ocupado; se admite la operación sin contarla")
+            return True, 0.0
+        try:
+            fila = conn.execute("SELECT tokens, instante FROM cubo WHERE clave = ?", (clave,)).fetchone()
+            tokens, instante = fila if fila else (limite.capacidad, ahora)
+            tokens, permitido, espera = consumir(tokens, instante, ahora, limite, coste)
+            conn.execute("INSERT INTO cubo (clave, tokens, instante) VALUES (?, ?, ?) "
+                         "ON CONFLICT (clave) DO UPDATE SET tokens = excluded.tokens, instante = excluded.instante",
+                         (clave, tokens, ahora))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return permitido, espera
+
+
+almacen = AlmacenSQLite(LIMITES_DB) if LIMITES_DB else AlmacenMemoria()
+_cupo = threading.BoundedSemaphore(MAX_OPERACIONES_IDENTIDAD)
+
+
+class Rechazo(NamedTuple):
+    """Operación no admitida: respuesta que debe devolver el endpoint"""
+    status_code: int
+    mensaje: str
+    reintentar_s: int
+
+    def cabeceras(self) -> dict:
+        return {"retry-after": str(self.reintentar_s)}
+
+
+def _claves(request: Optional[Request], usuario: Optional[str]) -> dict:
+    claves = {}
+    if request is not None:
+        claves["ip"] = request.client.host if request.client else "desconocida"
+    if usuario:
+        claves["usuario"] = usuario.strip().lower()
+    return claves
+
+
+def _comprobar_limites(operacion: str, request: Request, usuario: Optional[str]) -> Optional[Rechazo]:
+    claves = _claves(request, usuario)
+    # Los cubos de fallos solo se consultan: los gasta registrar_fallo()
+    cubos = [(tipo, limite, 1) for tipo, limite in LIMITES[operacion].items()]
+    cubos += [(tipo, limite, 0) for tipo, limite in LIMITES_FALLOS.get(operacion, {}).items()]
+    for tipo, limite, coste in cubos:
+        if tipo not in claves:
+            continue
+        permitido, espera = almacen.tomar(f"{operacion}:{tipo}:{claves[tipo]}", limite, coste)
+        if not permitido:
+            registro.incrementar("therapose_admision_rechazos_total", operacion=operacion, motivo=tipo)
+            return Rechazo(429, "Demasiados intentos. Espera unos minutos antes de volver a intentarlo.",
+                           max(1, int(espera + 0.999)))
+    return None
+
+
+def admitir(operacion: str, request: Request, usuario: Optional[str] = None) -> Optional[Rechazo]:
+    """
+    Admite (o no) una operación de identidad. Si se admite ocupa un hueco del
+    cupo global, que el endpoint debe devolver con liberar() al terminar.
+
+    Args:
+        operacion (str): Clave de LIMITES ("login", "registro", "crear_paciente")
+        request (Request): Petición, para la IP del cliente
+        usuario (str): Nombre de usuario del intento, si aplica
+
+    Returns:
+        Rechazo: Respuesta que debe devolver el endpoint, o None si se admite
+    """
+    rechazo = _comprobar_limites(operacion, request, usuario)
+    if rechazo is None and not _cupo.acquire(timeout=ESPERA_CUPO_S):
+        registro.incrementar("therapose_admision_rechazos_total", operacion=operacion, motivo="cupo")
+        rechazo = Rechazo(503, "El servidor está atendiendo demasiadas solicitudes. Inténtalo de nuevo "
+                               "en unos segundos.", 5)
+    return rechazo
+
+
+def registrar_fallo(operacion: str, usuario: Optional[str] = None):
+    """
+    Gasta un token de los cubos de LIMITES_FALLOS tras un intento fallido (p. ej.
+    credenciales incorrectas en el login).
+
+    Args:
+        operacion (str): Clave de LIMITES_FALLOS ("login")
+        usuario (str): Nombre de usuario del intento
+    """
+    claves = _claves(None, usuario)
+    for tipo, limite in LIMITES_FALLOS.get(operacion, {}).items():
+        if tipo in claves:
+            almacen.tomar(f"{operacion}:{tipo}:{claves[tipo]}", limite)
+
+
+def liberar():
+    """Devuelve el hueco del cupo global ocupado por admitir()"""
+    _cupo.release()
@@ -0,0 +1,288 @@
+"""
+Backends de almacenamiento para la capa de datos (database.py).
+
+Las funciones de database.py escriben SQL con parámetros "?" y trabajan sobre
+conexiones y cursores con la interfaz DB-API. Cada backend encapsula lo que
+depende del motor:
+
+- BackendSQLite: archivo local (por defecto), con trazado de consultas y modo
+  de solo lectura para los workers cuando hay un proceso escritor dedicado.
+- BackendPostgres: pool de conexiones psycopg 3 (sentencias preparadas
+  automáticamente y cursores del lado del servidor para lecturas grandes).
+
+El backend se elige con THERAPOSE_DB_URL; si empieza por postgresql:// se usa
+PostgreSQL, en otro caso SQLite sobre THERAPOSE_DB_PATH.
+Las dependencias de PostgreSQL son opcionales (requirements-postgres.txt).
+"""
+import functools
+import os
+import pathlib
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from .trazas_sql import ConexionTrazada
+
+# Tamaño del pool de PostgreSQL por worker
+POOL_MIN = int(os.getenv("THERAPOSE_DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("THERAPOSE_DB_POOL_MAX", "10"))
+# Ejecuciones de una misma sentencia antes de que psycopg la prepare en el servidor
+UMBRAL_PREPARACION = int(os.getenv("THERAPOSE_DB_PREPARE_THRESHOLD", "2"))
+# Filas por viaje de red al leer con cursores del lado del servidor
+FILAS_POR_LOTE = 500
+
+
+class BackendSQLite:
+    """
+    Backend sobre un archivo SQLite.
+    """
+    nombre = "sqlite"
+
+    def __init__(self, db_path: str, solo_lectura: bool = False):
+        self.db_path = db_path
+        # En modo multiproceso los workers solo leen; las escrituras van al proceso escritor
+        self.solo_lectura = solo_lectura
+
+    def conectar(self, escritura: bool = False):
+        if self.solo_lectura and not escritura:
+            uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            return sqlite3.connect(uri, uri=True, factory=ConexionTrazada)
+        conn = sqlite3.connect(self.db_path, factory=ConexionTrazada)
+        # SQLite no comprueba las claves ajenas salvo que se active en cada conexión
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def cursor_lectura_grande(self, conn):
+        # SQLite ya recorre los resultados paso a paso, sin materializarlos
+        return conn.cursor()
+
+    def con_registro(self, cursor, registro):
+        """
+        Hace que el cursor devuelva instancias de registro (modelos.py) en lugar de tuplas.
+        """
+        cursor.row_factory = lambda _cursor, fila: registro(*fila)
+        return cursor
+
+    @contextmanager
+    def transaccion(self):
+        """
+        Transacción de escritura explícita (BEGIN IMMEDIATE toma el bloqueo al inicio).
+        """
+        conn = self.conectar(escritura=True)
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            yield cursor
+            cursor.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def version_esquema(self, cursor) -> int:
+        return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    def bloquear_esquema(self, cursor):
+        cursor.execute("BEGIN IMMEDIATE")
+
+    def fijar_version_esquema(self, cursor, version: int):
+        cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+
+@functools.lru_cache(maxsize=512)
+def traducir_parametros(sql: str) -> str:
+    """
+    Convierte los parámetros "?" (estilo qmark de sqlite3) a "%s" (psycopg),
+    respetando los literales entre comillas.
+    """
+    partes = []
+    en_cadena = False
+    for caracter in sql:
+        if caracter == "'":
+            en_cadena = not en_cadena
+        if caracter == "?" and not en_cadena:
+            partes.append("%s")
+        elif caracter == "%" and not en_cadena:
+            partes.append("%%")
+        else:
+            partes.append(caracter)
+    return "".join(partes)
+
+
+class CursorPostgres:
+    """
+    Adaptador de un cursor psycopg con la interfaz que usa database.py.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, parameters=()):
+        self._cursor.execute(traducir_parametros(sql), parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._cursor.executemany(traducir_parametros(sql), list(seq_of_parameters))
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def con_registro(self, registro):
+        from psycopg.rows import args_row
+        self._cursor.row_factory = args_row(registro)
+        return self
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        # PostgreSQL no expone lastrowid: las inserciones usan RETURNING
+        return None
+
+
+class ConexionPostgres:
+    """
+    Conexión tomada del pool; close() la devuelve al pool en lugar de cerrarla.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = pool.getconn()
+
+    def cursor(self):
+        return CursorPostgres(self._conn.cursor())
+
+    def cursor_servidor(self):
+        # Cursor con nombre: las filas se leen del servidor en lotes de FILAS_POR_LOTE
+        cursor = self._conn.cursor(name=f"therapose_{uuid.uuid4().hex}")
+        cursor.itersize = FILAS_POR_LOTE
+        return CursorPostgres(cursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    @property
+    def in_transaction(self):
+        from psycopg.pq import TransactionStatus
+        return self._conn.info.transaction_status != TransactionStatus.IDLE
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self.in_transaction:
+            self._conn.rollback()
+        self._pool.putconn(self._conn)
+        self._conn = None
+
+
+class BackendPostgres:
+    """
+    Backend sobre PostgreSQL con un pool de conexiones psycopg 3 por proceso.
+    """
+    nombre = "postgres"
+
+    def __init__(self, dsn: str):
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise RuntimeError(
+                "THERAPOSE_DB_URL apunta a PostgreSQL pero psycopg/psycopg_pool no están instalados "
+                "(pip install -r requirements-postgres.txt)"
+            ) from e
+        self.dsn = dsn
+        self._pool = None
+        self._lock = threading.Lock()
+        self._ConnectionPool = ConnectionPool
+
+    @property
+    def pool(self):
+        # El pool se abre en el primer uso para no conectar al importar el módulo
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = self._ConnectionPool(
+                        self.dsn, min_size=POOL_MIN, max_size=POOL_MAX,
+                        kwargs={"prepare_threshold": UMBRAL_PREPARACION}, open=True
+                    )
+        return self._pool
+
+    def conectar(self, escritura: bool = False):
+        return ConexionPostgres(self.pool)
+
+    def cursor_lectura_grande(self, conn):
+        return conn.cursor_servidor()
+
+    def con_registro(self, cursor, registro):
+        # psycopg construye el registro directamente con los valores de la fila
+        return cursor.con_registro(registro)
+
+    @contextmanager
+    def transaccion(self):
+        conn = self.conectar(escritura=True)
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def version_esquema(self, cursor) -> int:
+        existe = cursor.execute("SELECT to_regclass('therapose_schema')").fetchone()[0]
+        if existe is None:
+            return 0
+        fila = cursor.execute("SELECT version FROM therapose_schema").fetchone()
+        return fila[0] if fila else 0
+
+    def bloquear_esquema(self, cursor):
+        # Equivalente a BEGIN IMMEDIATE: serializa las migraciones entre workers
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('therapose_schema'))")
+
+    def fijar_version_esquema(self, cursor, version: int):
+        cursor.execute("CREATE TABLE IF NOT EXISTS therapose_schema (version INTEGER NOT NULL)")
+        cursor.execute("DELETE FROM therapose_schema")
+        cursor.execute("INSERT INTO therapose_schema (version) VALUES (?)", (version,))
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.close()
+
+
+def crear_backend(db_path: str, solo_lectura: bool = False):
+    """
+    Crea el backend configurado por THERAPOSE_DB_URL (PostgreSQL) o SQLite por defecto.
+    """
+    url = os.getenv("THERAPOSE_DB_URL", "")
+    if url.startswith(("postgresql://", "postgres://")):
+        return BackendPostgres(url)
+    return BackendSQLite(db_path, solo_lectura=solo_lectura)
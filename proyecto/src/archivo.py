@@ -0,0 +1,209 @@
+"""
+Archivo de sesiones antiguas y compactación del archivo de base de datos.
+
+Las tablas sesion y sesion_postura crecen sin límite y las consultas de progreso
+las recorren. El trabajo de archivo mueve las sesiones de las series inactivas
+(activa = 0) cuya última sesión tiene más de ARCHIVAR_TRAS_DIAS días a
+sesion_archivada y sesion_postura_archivada, con el comentario comprimido:
+
+- En lotes de SESIONES_POR_LOTE sesiones (series completas), cada uno en su propia
+  transacción corta, con una pausa de PAUSA_S entre lotes para no acaparar el
+  bloqueo de escritura.
+- Después, en SQLite, devuelve las páginas liberadas con PRAGMA incremental_vacuum
+  en lotes de PAGINAS_POR_LOTE. Las bases de datos creadas antes de este cambio
+  (incluida la que trae el repositorio) no tienen auto_vacuum = INCREMENTAL y en
+  ellas el trabajo no compacta (lo avisa en el log): hay que convertirlas una vez,
+  con la aplicación parada, con `python -m proyecto.src.archivo convertir`
+  (VACUUM completo, que reescribe el archivo y bloquea las escrituras).
+
+Las tablas de trabajo quedan con el historial reciente, que cabe en la caché de
+páginas. Las lecturas incluyen lo archivado cuando se pide (parámetro archivo=true
+de /api/sesiones-serie y de las APIs de adherencia); las recomendaciones lo
+incluyen siempre.
+
+Si THERAPOSE_ARCHIVO_CADA_S está definido, cada worker arranca un hilo que ejecuta
+el trabajo con ese intervalo (las transacciones se serializan en la base de datos,
+así que varios workers a la vez no se estorban).
+
+Uso desde la línea de comandos (desde la raíz del repositorio):
+    python -m proyecto.src.archivo ejecutar
+    python -m proyecto.src.archivo convertir
+
+Métricas: therapose_archivo_sesiones_total y therapose_archivo_paginas_total.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from .database import DB_PATH, archivar_sesiones, backend, compactar, get_estado_archivo, init_db
+from .metricas import RutaInstrumentada, registro
+from .utils import verificar_token_admin
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(route_class=RutaInstrumentada)
+
+# Antigüedad de la última sesión de una serie inactiva a partir de la cual se archiva
+ARCHIVAR_TRAS_DIAS = int(os.getenv("THERAPOSE_ARCHIVAR_TRAS_DIAS", "90"))
+# Intervalo del trabajo programado (sin definir: no se programa)
+CADA_S = float(os.getenv("THERAPOSE_ARCHIVO_CADA_S", "0"))
+# Tamaño de cada transacción y pausa entre transacciones
+SESIONES_POR_LOTE = 500
+PAGINAS_POR_LOTE = 256
+PAUSA_S = 0.05
+
+registro.describir("therapose_archivo_sesiones_total", "Sesiones movidas a las tablas de archivo.")
+registro.describir("therapose_archivo_paginas_total", "Páginas devueltas al sistema con incremental_vacuum.")
+
+_en_curso = threading.Lock()
+
+
+def _archivar(fecha_limite: str) -> int:
+    total = 0
+    while True:
+        sesiones = archivar_sesiones(fecha_limite, SESIONES_POR_LOTE)
+        if not sesiones:
+            return total
+        total += sesiones
+        registro.incrementar("therapose_archivo_sesiones_total", sesiones)
+        time.sleep(PAUSA_S)
+
+
+def _compactar() -> int:
+    estado = get_estado_archivo()
+    if estado.get("auto_vacuum") != 2:
+        # La conversión (VACUUM completo) no se hace nunca con la aplicación en marcha
+        logger.warning("Compactación omitida (%d páginas libres): la base de datos no tiene auto_vacuum = "
+                       "INCREMENTAL; conviértala con la aplicación parada con "
+                       "`python -m proyecto.src.archivo convertir`", estado.get("freelist_count", 0))
+        return 0
+    devueltas, libres = 0, estado["freelist_count"]
+    while libres:
+        quedan = compactar(PAGINAS_POR_LOTE)
+        devueltas += libres - quedan
+        registro.incrementar("therapose_archivo_paginas_total", libres - quedan)
+        if quedan >= libres:
+            break
+        libres = quedan
+        time.sleep(PAUSA_S)
+    return devueltas
+
+
+def ejecutar_archivo(dias: int = None) -> dict:
+    """
+    Archiva las sesiones de las series inactivas antiguas y compacta el archivo.
+
+    Args:
+        dias (int): Antigüedad mínima de la última sesión (por defecto ARCHIVAR_TRAS_DIAS)
+
+    Returns:
+        dict: Sesiones archivadas y páginas devueltas, o None si ya había un trabajo en curso
+    """
+    if not _en_curso.acquire(blocking=False):
+        return None
+    try:
+        fecha_limite = (date.today() - timedelta(days=ARCHIVAR_TRAS_DIAS if dias is None else dias)).isoformat()
+        inicio = time.perf_counter()
+        sesiones = _archivar(fecha_limite)
+        paginas = _compactar() if backend.nombre == "sqlite" else 0
+        if sesiones or paginas:
+            logger.info("Archivo: %d sesiones archivadas, %d páginas devueltas en %.1f s",
+                        sesiones, paginas, time.perf_counter() - inicio)
+        return {"sesiones_archivadas": sesiones, "paginas_devueltas": paginas}
+    finally:
+        _en_curso.release()
+
+
+def _programado():
+    while True:
+        try:
+            ejecutar_archivo()
+        except Exception:
+            logger.exception("Error en el trabajo de archivo de sesiones")
+        time.sleep(CADA_S)
+
+
+def programar_archivo():
+    """Arranca el hilo del trabajo de archivo si THERAPOSE_ARCHIVO_CADA_S está definido"""
+    if CADA_S > 0:
+        threading.Thread(target=_programado, name="archivo", daemon=True).start()
+
+
+def convertir_a_incremental():
+    """
+    Activa auto_vacuum = INCREMENTAL en una base de datos SQLite existente. Reescribe
+    el archivo entero (VACUUM) con un bloqueo exclusivo: la aplicación debe estar parada.
+    """
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Endpoints de administración
+@router.get("/admin/archivo")
+def get_archivo(request: Request):
+    """
+    Tamaño de las tablas de sesiones y de archivo y, en SQLite, páginas del archivo.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+
+    Returns:
+        JSONResponse: Filas por tabla, páginas totales y libres y modo de auto_vacuum
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    return JSONResponse(content=get_estado_archivo())
+
+
+@router.post("/admin/archivo")
+def post_archivo(request: Request, dias: int = None):
+    """
+    Ejecuta ahora el trabajo de archivo y compactación.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        dias (int): Antigüedad mínima de la última sesión (por defecto ARCHIVAR_TRAS_DIAS)
+
+    Returns:
+        JSONResponse: Sesiones archivadas y páginas devueltas, o 409 si ya está en curso
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    if dias is not None and dias < 0:
+        return JSONResponse(content={"error": "dias no puede ser negativo"}, status_code=400)
+    resultado = ejecutar_archivo(dias)
+    if resultado is None:
+        return JSONResponse(content={"error": "El trabajo de archivo ya está en curso"}, status_code=409)
+    return JSONResponse(content=resultado)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo de sesiones antiguas y compactación")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+    ejecutar = ordenes.add_parser("ejecutar", help="Archiva las sesiones antiguas y compacta")
+    ejecutar.add_argument("--dias", type=int, default=None)
+    ordenes.add_parser("convertir", help="Activa auto_vacuum = INCREMENTAL (con la aplicación parada)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.orden == "ejecutar":
+        init_db()
+        print(ejecutar_archivo(args.dias))
+    elif backend.nombre != "sqlite":
+        print("Solo aplica a SQLite")
+    else:
+        print(f"auto_vacuum = {convertir_a_incremental()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,268 @@
 # Importaciones necesarias para el módulo de autenticación
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 from fastapi import APIRouter, Request, Form, status
-from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from keycloak_config import keycloak_openid  # Configuración de conexión con Keycloak
 from keycloak.exceptions import KeycloakAuthenticationError
-from .admin import  keycloak_admin_call, keycloak_admin  # Funciones de administración de Keycloak
+from .admin import  keycloak_admin_call  # Funciones de administración de Keycloak
+from .admision import admitir, liberar, registrar_fallo  # Límites de intentos y cupo de operaciones de identidad
+from .circuito import CircuitoAbierto, circuito_keycloak, es_caida  # Cortacircuitos de Keycloak
+from .circuito import ESPERA_S as ESPERA_CIRCUITO_S
+from .coalescencia import coalescer  # Validaciones simultáneas del mismo token
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada, registro, span  # Instrumentación de tiempos
+
+logger = logging.getLogger(__name__)
 
 # Configuración del router para las rutas de autenticación
-router = APIRouter()
+router = APIRouter(route_class=RutaInstrumentada)
 # Configuración de plantillas Jinja2 para renderizar páginas HTML
-templates = Jinja2Templates(directory="proyecto/templates")
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
+
+# Modo degradado: si Keycloak no responde, las peticiones de solo lectura de una
+# sesión verificada en los últimos SESION_DEGRADADA_S segundos se siguen sirviendo
+SESION_DEGRADADA_S = float(os.getenv("THERAPOSE_SESION_DEGRADADA_S", "900"))
+MAX_SESIONES_VERIFICADAS = 10000
+METODOS_LECTURA = ("GET", "HEAD")
+
+# sha256(token) -> (user_info, instante de la última verificación); orden LRU
+_sesiones_verificadas = OrderedDict()
+_sesiones_lock = threading.Lock()
+
+MENSAJE_NO_DISPONIBLE = "El servicio de identidad no está disponible. Inténtalo de nuevo en unos minutos."
+
+
+def _huella(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _recordar_sesion(token: str, user_info: dict):
+    with _sesiones_lock:
+        _sesiones_verificadas[_huella(token)] = (user_info, time.monotonic())
+        _sesiones_verificadas.move_to_end(_huella(token))
+        while len(_sesiones_verificadas) > MAX_SESIONES_VERIFICADAS:
+            _sesiones_verificadas.popitem(last=False)
+
+
+def _olvidar_sesion(token: str):
+    with _sesiones_lock:
+        _sesiones_verificadas.pop(_huella(token), None)
+
+
+def _sesion_degradada(request, token: str):
+    """
+    Información del usuario para una petición durante una caída de Keycloak: la
+    última verificada del token si es reciente y la petición es de lectura (o una
+    conexión WebSocket); None en otro caso.
+    """
+    if request.scope["type"] != "websocket" and request.method not in METODOS_LECTURA:
+        return None
+    with _sesiones_lock:
+        guardada = _sesiones_verificadas.get(_huella(token))
+    if guardada and time.monotonic() - guardada[1] < SESION_DEGRADADA_S:
+        return guardada[0]
+    return None
+
+
+def respuesta_no_disponible(request: Request):
+    """Respuesta 503 de las peticiones que no pueden servirse sin Keycloak"""
+    cabeceras = {"retry-after": str(int(ESPERA_CIRCUITO_S))}
+    # Las páginas muestran el aviso en la de login; las llamadas desde JavaScript reciben JSON
+    if request.method == "GET" and "text/html" in request.headers.get("accept", ""):
+        return templates.TemplateResponse("index.html", {"request": request, "error": MENSAJE_NO_DISPONIBLE},
+                                          status_code=503, headers=cabeceras)
+    return JSONResponse(content={"error": MENSAJE_NO_DISPONIBLE}, status_code=503, headers=cabeceras)
+
+
+class MiddlewareModoDegradado:
+    """
+    Middleware ASGI del modo degradado: con el circuito de Keycloak abierto, las
+    peticiones con sesión que no pueden servirse sin Keycloak (escrituras, o
+    sesiones no verificadas en los últimos SESION_DEGRADADA_S) reciben un 503 con
+    Retry-After en lugar de llegar a los endpoints, que las tratarían como no
+    autenticadas. Las demás pasan y get_user_info_from_token usa la sesión guardada.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or circuito_keycloak.disponible():
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        token = request.cookies.get("access_token")
+        if token and not request.url.path.startswith("/static") and _sesion_degradada(request, token) is None:
+            await respuesta_no_disponible(request)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Renovación silenciosa: el access token se renueva con el refresh token cuando le
+# quedan menos de MARGEN_RENOVACION_S segundos, sin volver a pedir la contraseña
+MARGEN_RENOVACION_S = 30
+# Duración de la cookie del access token (la del refresh token la fija Keycloak)
+DURACION_COOKIE_S = 7600
+# Cuánto se recuerda una renovación hecha: las peticiones que salieron antes con
+# las cookies viejas reciben el mismo token (Keycloak puede invalidar el refresh
+# token usado si tiene activada la rotación)
+RENOVACION_RECIENTE_S = 60
+MAX_RENOVACIONES_RECIENTES = 10000
+
+registro.describir("therapose_token_renovaciones_total",
+                   "Peticiones que renovaron el access token, por resultado (varias pueden compartir "
+                   "una llamada a Keycloak).")
+
+# sha256(refresh token) -> (token renovado, instante); orden de inserción
+_renovaciones = OrderedDict()
+_renovaciones_lock = threading.Lock()
+
+
+def guardar_cookies_sesion(response: Response, token: dict):
+    """
+    Guarda en cookies httponly el access token y el refresh token de una respuesta
+    de Keycloak (login o renovación).
+    """
+    response.set_cookie(key="access_token", value=token["access_token"], httponly=True,
+                        max_age=DURACION_COOKIE_S)
+    if token.get("refresh_token"):
+        response.set_cookie(key="refresh_token", value=token["refresh_token"], httponly=True,
+                            max_age=int(token.get("refresh_expires_in") or DURACION_COOKIE_S))
+
+
+def _expiracion(access_token: str) -> Optional[float]:
+    """
+    Instante de expiración (exp) del JWT, sin verificar la firma: solo decide
+    cuándo renovar; la validez del token la sigue comprobando Keycloak.
+    """
+    try:
+        carga = access_token.split(".")[1]
+        return float(json.loads(base64.urlsafe_b64decode(carga + "=" * (-len(carga) % 4)))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _necesita_renovacion(access_token: Optional[str]) -> bool:
+    if not access_token:
+        # La cookie del access token caducó antes que la sesión de Keycloak
+        return True
+    expiracion = _expiracion(access_token)
+    return expiracion is not None and expiracion - time.time() < MARGEN_RENOVACION_S
+
+
+@coalescer
+def _pedir_renovacion(refresh_token: str) -> dict:
+    with span("keycloak.refresh_token"):
+        return circuito_keycloak.llamar(keycloak_openid.refresh_token, refresh_token)
+
+
+def renovar_token(refresh_token: str) -> Optional[dict]:
+    """
+    Renueva la sesión con el refresh token: una sola llamada a Keycloak aunque
+    lleguen varias peticiones a la vez, y el mismo resultado para las que lleguen
+    durante RENOVACION_RECIENTE_S con el refresh token ya usado.
+
+    Returns:
+        dict: Respuesta de Keycloak (access_token, refresh_token, ...), o None si el
+        refresh token no es válido o Keycloak no responde
+    """
+    huella = _huella(refresh_token)
+    ahora = time.monotonic()
+    with _renovaciones_lock:
+        reciente = _renovaciones.get(huella)
+    if reciente and ahora - reciente[1] < RENOVACION_RECIENTE_S:
+        registro.incrementar("therapose_token_renovaciones_total", resultado="reutilizada")
+        return reciente[0]
+    try:
+        token = _pedir_renovacion(refresh_token)
+    except Exception as e:
+        resultado = "no_disponible" if isinstance(e, CircuitoAbierto) or es_caida(e) else "rechazada"
+        registro.incrementar("therapose_token_renovaciones_total", resultado=resultado)
+        return None
+    registro.incrementar("therapose_token_renovaciones_total", resultado="ok")
+    with _renovaciones_lock:
+        _renovaciones[huella] = (token, ahora)
+        while _renovaciones and (len(_renovaciones) > MAX_RENOVACIONES_RECIENTES
+                                 or ahora - next(iter(_renovaciones.values()))[1] >= RENOVACION_RECIENTE_S):
+            _renovaciones.popitem(last=False)
+    return token
+
+
+def _nombre_cookie(set_cookie: bytes) -> bytes:
+    return set_cookie.split(b"=", 1)[0].strip()
+
+
+class MiddlewareRenovacionToken:
+    """
+    Middleware ASGI de renovación silenciosa del access token:
+    1. Si el access token está a punto de caducar (o ya no está) y hay refresh token,
+       lo renueva con Keycloak (renovar_token)
+    2. La petición continúa con las cookies nuevas, como si el navegador ya las enviara
+    3. La respuesta rota las cookies (access_token y refresh_token), salvo las que
+       la propia respuesta ya fija o borra
+    Si la renovación falla, la petición sigue con las cookies que traía.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cookies = Request(scope).cookies
+        refresh_token = cookies.get("refresh_token")
+        if (not refresh_token or not _necesita_renovacion(cookies.get("access_token"))
+                or not circuito_keycloak.disponible()):
+            await self.app(scope, receive, send)
+            return
+
+        token = await run_in_threadpool(renovar_token, refresh_token)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        cookies.update(access_token=token["access_token"], refresh_token=token.get("refresh_token", refresh_token))
+        cabecera_cookie = "; ".join(f"{nombre}={valor}" for nombre, valor in cookies.items()).encode("latin-1")
+        scope = dict(scope, headers=[(clave, valor) for clave, valor in scope["headers"] if clave != b"cookie"]
+                     + [(b"cookie", cabecera_cookie)])
+        nuevas = Response()
+        guardar_cookies_sesion(nuevas, token)
+        set_cookies = [cabecera for cabecera in nuevas.raw_headers if cabecera[0] == b"set-cookie"]
+
+        async def enviar(message):
+            if message["type"] == "http.response.start":
+                cabeceras = list(message.get("headers", []))
+                # Las cookies que la respuesta ya fija o borra (p. ej. /logout) mandan
+                propias = {_nombre_cookie(valor) for clave, valor in cabeceras if clave.lower() == b"set-cookie"}
+                message["headers"] = cabeceras + [cabecera for cabecera in set_cookies
+                                                  if _nombre_cookie(cabecera[1]) not in propias]
+            await send(message)
+
+        await self.app(scope, receive, enviar)
+
+
+# Validación del token en Keycloak: las peticiones simultáneas con el mismo token
+# (un panel que carga varias APIs a la vez) comparten una sola llamada
+@coalescer
+def validar_token(token: str):
+    with span("keycloak.userinfo"):
+        return circuito_keycloak.llamar(keycloak_openid.userinfo, token)
 
 # Función para obtener información del usuario desde el token
 def get_user_info_from_token(request: Request):
     """
     Extrae y valida el token de acceso desde las cookies de la petición HTTP.
+    Si Keycloak está caído (o su circuito abierto), las peticiones de lectura de
+    una sesión verificada recientemente usan la información guardada (modo degradado).
     
     Args:
         request (Request): Objeto de petición HTTP de FastAPI
@@ -28,10 +276,16 @@ def get_user_info_from_token(request: Request):
         return None
     try:
         # Utilizar el token para obtener información del usuario desde Keycloak
-        return keycloak_openid.userinfo(token)
-    except Exception:
-        # Si hay cualquier error al validar el token, retornar None
+        user_info = validar_token(token)
+    except CircuitoAbierto:
+        return _sesion_degradada(request, token)
+    except Exception as e:
+        if es_caida(e):
+            return _sesion_degradada(request, token)
+        # Token inválido o caducado
         return None
+    _recordar_sesion(token, user_info)
+    return user_info
 
 # Ruta de login - Maneja la autenticación de usuarios mediante POST
 @router.post("/login")
@@ -47,14 +301,22 @@ def login(request: Request, username: str = Form(...), password: str = Form(...)
         
     Returns:
         RedirectResponse: Redirección al dashboard correspondiente
-        TemplateResponse: Página de login con error si las credenciales son inválidas
+        TemplateResponse: Página de login con error si las credenciales son inválidas,
+        o con aviso (429/503) si se superó el límite de intentos o el servidor está saturado
     """
+    # Límite de intentos por IP y de fallos por usuario, y cupo global de operaciones de identidad
+    rechazo = admitir("login", request, usuario=username)
+    if rechazo:
+        return templates.TemplateResponse("index.html", {"request": request, "error": rechazo.mensaje},
+                                          status_code=rechazo.status_code, headers=rechazo.cabeceras())
     try:
         # Autenticar usuario con Keycloak usando credenciales
-        token = keycloak_openid.token(username=username, password=password, grant_type="password")
+        token = circuito_keycloak.llamar(keycloak_openid.token, username=username, password=password,
+                                         grant_type="password")
         
         # Obtener información del usuario autenticado
-        user_info = keycloak_openid.userinfo(token["access_token"])
+        user_info = circuito_keycloak.llamar(keycloak_openid.userinfo, token["access_token"])
+        _recordar_sesion(token["access_token"], user_info)
         
         # Extraer roles del usuario desde la información de Keycloak
         roles = user_info.get("realm_access", {}).get("roles", [])
@@ -71,13 +333,19 @@ def login(request: Request, username: str = Form(...), password: str = Form(...)
         # Crear respuesta de redirección al dashboard apropiado
         response = RedirectResponse(url=dashboard_url, status_code=status.HTTP_302_FOUND)
         
-        # Guardar token de acceso en cookie segura (httponly=True)
-        # max_age=7600 significa que la cookie expira en ~2 horas
-        response.set_cookie(key="access_token", value=token["access_token"], httponly=True, max_age=7600)
+        # Guardar access token y refresh token en cookies seguras (httponly=True);
+        # el access token se renueva después sin contraseña (MiddlewareRenovacionToken)
+        guardar_cookies_sesion(response, token)
         return response
-    except Exception:
-        # Si hay error en autenticación, mostrar mensaje de error en login
+    except Exception as e:
+        if isinstance(e, CircuitoAbierto) or es_caida(e):
+            return templates.TemplateResponse("index.html", {"request": request, "error": MENSAJE_NO_DISPONIBLE},
+                                              status_code=503)
+        # Si hay error en autenticación, contar el fallo para el usuario y mostrar mensaje de error
+        registrar_fallo("login", username)
         return templates.TemplateResponse("index.html", {"request": request, "error": "Usuario o contraseña incorrectos"})
+    finally:
+        liberar()
 
 # Ruta GET para mostrar el formulario de login
 @router.get("/login")   
@@ -106,6 +374,21 @@ def logout(request: Request):
     Returns:
         RedirectResponse: Redirección a la página de login
     """
+    # La sesión deja de servir también en modo degradado
+    token = request.cookies.get("access_token")
+    if token:
+        _olvidar_sesion(token)
+    # Cerrar la sesión en Keycloak para que el refresh token no pueda volver a usarse
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        with _renovaciones_lock:
+            _renovaciones.pop(_huella(refresh_token), None)
+    if refresh_token and circuito_keycloak.disponible():
+        try:
+            circuito_keycloak.llamar(keycloak_openid.logout, refresh_token)
+        except Exception:
+            logger.warning("No se pudo cerrar la sesión en Keycloak", exc_info=True)
+
     # Crear respuesta de redirección a login
     response = RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
@@ -0,0 +1,342 @@
+"""
+Biblioteca de referencia de posturas y clasificación por vecinos más cercanos.
+
+La biblioteca guarda muchas muestras de keypoints por postura (id_postura) como
+vectores de pose normalizados (esqueleto común de puntuacion.py, centrado en las
+caderas y escalado por el tronco: 12 articulaciones x 2 = 24 valores).
+
+Almacenamiento: cada versión es un directorio BIBLIOTECA_DIR/vNNNNNN con
+muestras.npy (N x 24, float64), etiquetas.npy (N, id_postura) y medias.npy
+(vector medio). El enlace simbólico BIBLIOTECA_DIR/actual apunta a la versión
+vigente y se sustituye de forma atómica al añadir muestras. Los workers abren
+los .npy con mmap en solo lectura: el sistema operativo comparte las mismas
+páginas entre todos los procesos, ninguno carga su propia copia. Cada worker
+construye sobre ese mapa un cKDTree (copy_data=False, solo guarda índices y
+nodos) y comprueba cada COMPROBAR_VERSION_S segundos si hay una versión nueva.
+
+Clasificación: el árbol propone CANDIDATOS muestras por frame; se reordenan por
+la distancia medida solo sobre las articulaciones fiables del frame (las tapadas
+no penalizan) y las VECINOS más cercanas votan con peso 1/distancia. La confianza
+es la fracción del voto de la postura ganadora. Los frames sin suficientes
+articulaciones fiables o sin vecinos a menos de DISTANCIA_MAXIMA quedan sin
+clasificar. Cada muestra se guarda también en
+espejo (izquierda <-> derecha), para reconocer la postura mire el paciente
+hacia donde mire. benchmarks/bench_clasificacion.py mide el tiempo por frame.
+"""
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+import warnings
+from typing import Optional
+import numpy as np
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from scipy.spatial import cKDTree
+from starlette.concurrency import run_in_threadpool
+from .auth import get_user_info_from_token
+from .database import existe_postura
+from .metricas import RutaInstrumentada, span
+from .modelos import RespuestaJSON
+from .puntuacion import ARTICULACIONES, UMBRAL_CONFIANZA, a_esqueleto, leer_lote, normalizar_pose
+from .utils import verificar_token_admin
+
+# Directorio de la biblioteca (versiones y enlace "actual")
+BIBLIOTECA_DIR = os.getenv("THERAPOSE_BIBLIOTECA_DIR", "proyecto/biblioteca_posturas")
+# Vecinos que votan la postura de cada frame, elegidos entre CANDIDATOS propuestos por el árbol
+VECINOS = 7
+CANDIDATOS = 32
+# Distancia (en longitudes de tronco) a partir de la cual una muestra no vota
+DISTANCIA_MAXIMA = float(os.getenv("THERAPOSE_DISTANCIA_MAXIMA", "1.5"))
+# Articulaciones fiables necesarias para clasificar un frame (además de hombros y caderas)
+MIN_ARTICULACIONES_FIABLES = 8
+# Cada cuánto comprueba un worker si hay una versión nueva de la biblioteca
+COMPROBAR_VERSION_S = 2.0
+# Versiones antiguas que se conservan (un worker puede tenerlas aún abiertas)
+VERSIONES_CONSERVADAS = 2
+
+DIMENSIONES = len(ARTICULACIONES) * 2
+_RE_VERSION = re.compile(r"^v(\d{6})$")
+# Articulación simétrica de cada una (hombro_izq <-> hombro_der, ...)
+_ESPEJO = [ARTICULACIONES.index(nombre.replace("_izq", "_tmp").replace("_der", "_izq").replace("_tmp", "_der"))
+           for nombre in ARTICULACIONES]
+_TRONCO = [ARTICULACIONES.index(nombre) for nombre in ("hombro_izq", "hombro_der", "cadera_izq", "cadera_der")]
+
+# Configuración del router para la biblioteca de posturas
+router = APIRouter(route_class=RutaInstrumentada)
+
+
+def vectores_pose(puntos: np.ndarray, confianza: np.ndarray, relleno: np.ndarray) -> tuple:
+    """
+    Convierte frames del esqueleto común en vectores de pose comparables.
+
+    Args:
+        puntos (np.ndarray): (F, 12, 2) coordenadas
+        confianza (np.ndarray): (F, 12) confianza de cada articulación
+        relleno (np.ndarray): (24,) valores para las articulaciones no fiables
+
+    Returns:
+        tuple: (vectores (F, 24) float64, clasificables (F,) bool)
+    """
+    fiables = confianza >= UMBRAL_CONFIANZA
+    clasificables = fiables[:, _TRONCO].all(axis=1) & (fiables.sum(axis=1) >= MIN_ARTICULACIONES_FIABLES)
+    normalizados = normalizar_pose(puntos).astype(np.float64)
+    vectores = np.where(fiables[..., None], normalizados, relleno.reshape(-1, 2))
+    return vectores.reshape(len(puntos), DIMENSIONES), clasificables
+
+
+def espejar(vectores: np.ndarray) -> np.ndarray:
+    """Refleja las poses en horizontal e intercambia las articulaciones izquierdas y derechas"""
+    poses = vectores.reshape(len(vectores), -1, 2)[:, _ESPEJO].copy()
+    poses[..., 0] *= -1
+    return poses.reshape(len(vectores), DIMENSIONES)
+
+
+class Biblioteca:
+    """Versión de la biblioteca abierta en este proceso"""
+    __slots__ = ("version", "muestras", "etiquetas", "medias", "arbol", "comprobada")
+
+    def __init__(self, version: str):
+        directorio = os.path.join(BIBLIOTECA_DIR, version)
+        self.version = version
+        self.muestras = np.load(os.path.join(directorio, "muestras.npy"), mmap_mode="r")
+        self.etiquetas = np.load(os.path.join(directorio, "etiquetas.npy"), mmap_mode="r")
+        self.medias = np.load(os.path.join(directorio, "medias.npy"))
+        # copy_data=False: el árbol indexa el mapa compartido sin copiar las muestras
+        self.arbol = cKDTree(self.muestras, copy_data=False)
+        self.comprobada = time.monotonic()
+
+    def clasificar(self, puntos: np.ndarray, confianza: np.ndarray) -> tuple:
+        """
+        Clasifica un lote de frames.
+
+        Returns:
+            tuple: (id_postura (F,) int, -1 si el frame no se pudo clasificar;
+            confianza (F,) de 0 a 1)
+        """
+        vectores, clasificables = vectores_pose(puntos, confianza, self.medias)
+        ids = np.full(len(puntos), -1, dtype=np.int64)
+        confianzas = np.zeros(len(puntos))
+        if not clasificables.any():
+            return ids, confianzas
+        filas = np.flatnonzero(clasificables)
+        vectores = vectores[filas]
+        # 1. El árbol propone candidatos con el vector completo (articulaciones tapadas rellenas)
+        k = min(CANDIDATOS, len(self.etiquetas))
+        indices = self.arbol.query(vectores, k=k)[1].reshape(len(filas), k)
+        # 2. Se reordenan por la distancia solo sobre las articulaciones fiables, reescalada
+        # a las 24 dimensiones para que DISTANCIA_MAXIMA valga igual en todos los frames
+        fiables = np.repeat(confianza[filas] >= UMBRAL_CONFIANZA, 2, axis=1)
+        diferencias = (self.muestras[indices] - vectores[:, None]) * fiables[:, None]
+        distancias = np.sqrt(np.square(diferencias).sum(axis=2) * (DIMENSIONES / fiables.sum(axis=1))[:, None])
+        vecinos = np.argsort(distancias, axis=1)[:, :VECINOS]
+        distancias = np.take_along_axis(distancias, vecinos, axis=1)
+        etiquetas = np.asarray(self.etiquetas)[np.take_along_axis(indices, vecinos, axis=1)]
+        # 3. Votan los vecinos dentro de DISTANCIA_MAXIMA, con peso 1/distancia
+        pesos = np.where(distancias <= DISTANCIA_MAXIMA, 1.0 / (distancias + 1e-6), 0.0)
+        posturas, columnas = np.unique(etiquetas, return_inverse=True)
+        votos = np.zeros((len(filas), len(posturas)))
+        np.add.at(votos, (np.arange(len(filas))[:, None], columnas.reshape(etiquetas.shape)), pesos)
+        total = votos.sum(axis=1)
+        ganadora = votos.argmax(axis=1)
+        con_votos = total > 0
+        ids[filas[con_votos]] = posturas[ganadora[con_votos]]
+        confianzas[filas[con_votos]] = votos[con_votos, ganadora[con_votos]] / total[con_votos]
+        return ids, confianzas
+
+
+def postura_mayoritaria(ids: np.ndarray) -> Optional[int]:
+    """Postura reconocida en más frames (sin contar los no clasificados), o None"""
+    ids = ids[ids >= 0]
+    if len(ids) == 0:
+        return None
+    valores, cuentas = np.unique(ids, return_counts=True)
+    return int(valores[cuentas.argmax()])
+
+
+_biblioteca: Optional[Biblioteca] = None
+_cerrojo = threading.Lock()
+
+
+def _version_en_disco() -> Optional[str]:
+    try:
+        return os.readlink(os.path.join(BIBLIOTECA_DIR, "actual"))
+    except OSError:
+        return None
+
+
+def biblioteca_actual() -> Optional[Biblioteca]:
+    """Biblioteca vigente (se vuelve a abrir si otro proceso publicó una versión nueva)"""
+    global _biblioteca
+    actual = _biblioteca
+    if actual is not None and time.monotonic() - actual.comprobada < COMPROBAR_VERSION_S:
+        return actual
+    with _cerrojo:
+        version = _version_en_disco()
+        if version is None:
+            _biblioteca = None
+        elif _biblioteca is not None and _biblioteca.version == version:
+            _biblioteca.comprobada = time.monotonic()
+        else:
+            with span("biblioteca.abrir"):
+                _biblioteca = Biblioteca(version)
+        return _biblioteca
+
+
+def agregar_muestras(id_postura: int, puntos: np.ndarray, confianza: np.ndarray,
+                     reemplazar: bool = False) -> dict:
+    """
+    Añade a la biblioteca las muestras de una postura y publica una versión nueva.
+
+    Args:
+        id_postura (int): ID de la postura
+        puntos (np.ndarray): (F, 12, 2) coordenadas del esqueleto común
+        confianza (np.ndarray): (F, 12) confianza de cada articulación
+        reemplazar (bool): Si es True, descarta antes las muestras anteriores de la postura
+
+    Returns:
+        dict: Versión publicada y número de muestras por postura (incluidas las espejadas)
+
+    Raises:
+        ValueError: Si ningún frame tiene suficientes articulaciones fiables
+    """
+    # Las articulaciones no fiables de una muestra se rellenan con la mediana de la postura
+    normalizados = np.where((confianza >= UMBRAL_CONFIANZA)[..., None], normalizar_pose(puntos), np.nan)
+    with warnings.catch_warnings():
+        # Articulaciones nunca fiables en el lote: mediana de un vector vacío (NaN -> 0)
+        warnings.simplefilter("ignore", RuntimeWarning)
+        relleno = np.nan_to_num(np.nanmedian(normalizados, axis=0)).ravel()
+    vectores, validos = vectores_pose(puntos, confianza, relleno)
+    if not validos.any():
+        raise ValueError("Ningún frame tiene suficientes articulaciones fiables")
+    nuevas = np.concatenate([vectores[validos], espejar(vectores[validos])])
+
+    os.makedirs(BIBLIOTECA_DIR, exist_ok=True)
+    # Un solo escritor a la vez entre todos los procesos
+    with open(os.path.join(BIBLIOTECA_DIR, ".cerrojo"), "w") as cerrojo:
+        fcntl.flock(cerrojo, fcntl.LOCK_EX)
+        version = _version_en_disco()
+        if version:
+            directorio = os.path.join(BIBLIOTECA_DIR, version)
+            muestras = np.load(os.path.join(directorio, "muestras.npy"))
+            etiquetas = np.load(os.path.join(directorio, "etiquetas.npy"))
+        else:
+            muestras, etiquetas = np.empty((0, DIMENSIONES)), np.empty(0, dtype=np.int64)
+        if reemplazar:
+            conservar = etiquetas != id_postura
+            muestras, etiquetas = muestras[conservar], etiquetas[conservar]
+        muestras = np.ascontiguousarray(np.concatenate([muestras, nuevas]), dtype=np.float64)
+        etiquetas = np.concatenate([etiquetas, np.full(len(nuevas), id_postura, dtype=np.int64)])
+        version = _publicar(muestras, etiquetas)
+    ids, cuentas = np.unique(etiquetas, return_counts=True)
+    return {"version": version, "muestras": {int(i): int(n) for i, n in zip(ids, cuentas)}}
+
+
+def _publicar(muestras: np.ndarray, etiquetas: np.ndarray) -> str:
+    """Escribe una versión nueva, mueve el enlace "actual" y borra las versiones antiguas"""
+    existentes = sorted(n for n in os.listdir(BIBLIOTECA_DIR) if _RE_VERSION.match(n))
+    numero = int(_RE_VERSION.match(existentes[-1]).group(1)) + 1 if existentes else 1
+    version = f"v{numero:06d}"
+    directorio = os.path.join(BIBLIOTECA_DIR, version)
+    os.makedirs(directorio)
+    np.save(os.path.join(directorio, "muestras.npy"), muestras)
+    np.save(os.path.join(directorio, "etiquetas.npy"), etiquetas)
+    np.save(os.path.join(directorio, "medias.npy"), muestras.mean(axis=0))
+
+    temporal = os.path.join(BIBLIOTECA_DIR, f".actual-{version}")
+    os.symlink(version, temporal)
+    os.replace(temporal, os.path.join(BIBLIOTECA_DIR, "actual"))
+    # Los procesos que aún tengan abierta una versión borrada siguen leyéndola (mmap)
+    for antigua in existentes[:-VERSIONES_CONSERVADAS or None]:
+        shutil.rmtree(os.path.join(BIBLIOTECA_DIR, antigua), ignore_errors=True)
+    return version
+
+
+def clasificar_lote(lote) -> Optional[dict]:
+    """
+    Clasifica los frames de un lote (LoteKeypoints).
+
+    Returns:
+        dict: Postura y confianza por frame y postura mayoritaria del lote, o None
+        si la biblioteca está vacía
+
+    Raises:
+        ValueError: Si los frames no corresponden al formato
+    """
+    biblioteca = biblioteca_actual()
+    if biblioteca is None:
+        return None
+    puntos, confianza = a_esqueleto(lote.frames, lote.formato)
+    with span("biblioteca.clasificar"):
+        ids, confianzas = biblioteca.clasificar(puntos, confianza)
+    return {
+        "posturas": [int(i) if i >= 0 else None for i in ids],
+        "confianzas": [round(float(c), 2) for c in confianzas],
+        "postura": postura_mayoritaria(ids),
+        "frames_clasificados": int((ids >= 0).sum()),
+    }
+
+
+def _agregar_lote(id_postura: int, lote, reemplazar: bool) -> dict:
+    if not existe_postura(id_postura):
+        raise ValueError(f"La postura {id_postura} no existe.")
+    puntos, confianza = a_esqueleto(lote.frames, lote.formato)
+    return agregar_muestras(id_postura, puntos, confianza, reemplazar)
+
+
+# Reconocimiento de la postura que realiza el paciente
+@router.post("/api/clasificar-postura")
+async def clasificar_postura(request: Request):
+    """
+    Reconoce la postura de un lote de frames de keypoints.
+
+    Args:
+        request (Request): Petición con cuerpo JSON {"formato": "mediapipe"|"coco", "frames": [...]}
+
+    Returns:
+        JSONResponse: Postura (id_postura) y confianza por frame y postura del lote,
+        o error 400/401/413, o 503 si la biblioteca está vacía
+    """
+    user_info = await run_in_threadpool(get_user_info_from_token, request)
+    if not user_info or "patient" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    lote, error = await leer_lote(request)
+    if error:
+        return error
+    try:
+        resultado = await run_in_threadpool(clasificar_lote, lote)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    if resultado is None:
+        return JSONResponse(content={"error": "La biblioteca de posturas está vacía"}, status_code=503)
+    return RespuestaJSON(content=resultado)
+
+
+# Alta de muestras de referencia de una postura
+@router.post("/admin/biblioteca/posturas/{id_postura}/muestras")
+async def agregar_muestras_postura(request: Request, id_postura: int, reemplazar: bool = False):
+    """
+    Añade a la biblioteca los frames de una ejecución de la postura.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token); mismo
+            cuerpo que /api/clasificar-postura
+        id_postura (int): ID de la postura
+        reemplazar (bool): Sustituir las muestras anteriores de la postura
+
+    Returns:
+        JSONResponse: Versión publicada y muestras por postura, o error 400/401/404/413
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    lote, error = await leer_lote(request)
+    if error:
+        return error
+    try:
+        resultado = await run_in_threadpool(_agregar_lote, id_postura, lote, reemplazar)
+    except ValueError as e:
+        codigo = 404 if "no existe" in str(e) else 400
+        return JSONResponse(content={"error": str(e)}, status_code=codigo)
+    return RespuestaJSON(content=resultado, status_code=201)
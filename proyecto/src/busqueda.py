@@ -0,0 +1,114 @@
+"""
+Búsqueda de posturas mientras se escribe (typeahead) para el formulario de series.
+
+El texto se reduce a términos en minúsculas y sin acentos; cada término se busca
+como prefijo en el índice de texto completo del catálogo (FTS5 en SQLite, tsvector
+con índice GIN en PostgreSQL; ver database.buscar_posturas), por lo que el coste
+depende de las coincidencias y no del tamaño del catálogo.
+
+Una misma búsqueda se repite mucho (cada instructor teclea los mismos prefijos),
+así que los resultados se guardan por proceso en una caché LRU de
+MAX_BUSQUEDAS_CACHE entradas durante BUSQUEDA_TTL_S segundos, y la respuesta
+lleva Cache-Control para que el navegador reutilice la suya. Un cambio en el
+catálogo vacía la caché de todos los workers (bus de invalidación, tema
+"postura"); en el navegador tarda como mucho BUSQUEDA_TTL_S en aparecer.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from .auth import get_user_info_from_token
+from .database import buscar_posturas, invalidaciones
+from .metricas import RutaInstrumentada
+from .modelos import RespuestaJSON
+
+# Longitud mínima del texto buscado (los prefijos de 1 letra coinciden con casi todo)
+MIN_CARACTERES = 2
+# Términos por búsqueda y resultados por respuesta
+MAX_TERMINOS = 6
+LIMITE_RESULTADOS = 10
+MAX_LIMITE_RESULTADOS = 50
+# Caché de resultados por proceso
+MAX_BUSQUEDAS_CACHE = 1024
+BUSQUEDA_TTL_S = 60
+
+router = APIRouter(route_class=RutaInstrumentada)
+
+# (términos, límite) -> (posturas, instante); el orden es el de uso (LRU)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _vaciar_cache(_id_postura):
+    with _cache_lock:
+        _cache.clear()
+
+
+invalidaciones.suscribir("postura", _vaciar_cache)
+
+
+def terminos_busqueda(texto: str) -> list:
+    """
+    Palabras del texto en minúsculas y sin acentos, como las indexa el catálogo.
+
+    Args:
+        texto (str): Texto escrito por el usuario
+
+    Returns:
+        list: Hasta MAX_TERMINOS palabras (solo letras y dígitos), sin repetir
+    """
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return list(dict.fromkeys(re.findall(r"\w+", sin_acentos)))[:MAX_TERMINOS]
+
+
+def buscar(texto: str, limite: int = LIMITE_RESULTADOS) -> list:
+    """Posturas que coinciden con el texto, de más a menos relevante (con caché)"""
+    terminos = terminos_busqueda(texto)
+    if not terminos:
+        return []
+    clave = (tuple(terminos), limite)
+    invalidaciones.sincronizar()
+    ahora = time.monotonic()
+    with _cache_lock:
+        guardada = _cache.get(clave)
+        if guardada and ahora - guardada[1] < BUSQUEDA_TTL_S:
+            _cache.move_to_end(clave)
+            return guardada[0]
+    posturas = buscar_posturas(terminos, limite)
+    with _cache_lock:
+        _cache[clave] = (posturas, ahora)
+        _cache.move_to_end(clave)
+        while len(_cache) > MAX_BUSQUEDAS_CACHE:
+            _cache.popitem(last=False)
+    return posturas
+
+
+# Typeahead del catálogo de posturas
+@router.get("/api/buscar-posturas")
+def buscar_posturas_api(request: Request, q: str = "", limite: int = LIMITE_RESULTADOS):
+    """
+    Busca posturas por nombre (español o sánscrito), instrucciones, beneficios o
+    precauciones. Cada palabra se trata como prefijo: "cob" encuentra "Cobra Pose".
+
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        q (str): Texto buscado (al menos MIN_CARACTERES caracteres)
+        limite (int): Máximo de resultados (1-MAX_LIMITE_RESULTADOS)
+
+    Returns:
+        JSONResponse: Posturas ordenadas por relevancia (vacía si q es demasiado corto),
+        o error 401 si no es un instructor
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+
+    texto = q.strip()
+    limite = min(max(limite, 1), MAX_LIMITE_RESULTADOS)
+    posturas = buscar(texto, limite) if len(texto) >= MIN_CARACTERES else []
+    return RespuestaJSON(content={"posturas": posturas},
+                         headers={"cache-control": f"private, max-age={BUSQUEDA_TTL_S}"})
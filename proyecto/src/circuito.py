@@ -0,0 +1,162 @@
+"""
+Cortacircuitos (circuit breaker) para las llamadas a Keycloak.
+
+Todas las rutas autenticadas dependen de Keycloak. Si responde lento, cada
+petición ocupa un hilo del threadpool hasta el timeout y la aplicación entera se
+queda sin hilos. El circuito corta esas llamadas mientras Keycloak está caído:
+
+- cerrado: las llamadas pasan. Se abre con FALLOS_CONSECUTIVOS caídas seguidas,
+  o si en las últimas VENTANA llamadas (al menos MIN_LLAMADAS) la mitad o más
+  fueron caídas o tardaron más de LATENCIA_LENTA_S.
+- abierto: las llamadas fallan al instante con CircuitoAbierto durante ESPERA_S.
+- semiabierto: pasado ESPERA_S, una sola llamada hace de sonda (las demás siguen
+  rechazadas). Si va bien y es rápida el circuito se cierra; si no, vuelve a abrirse.
+  Solo la sonda cambia el estado: una llamada admitida antes (con el circuito
+  cerrado) que termina en semiabierto no cuenta.
+
+Cuenta como caída un error de conexión o timeout, o una respuesta 5xx. Los
+errores 4xx (token inválido, usuario ya existente...) indican que Keycloak
+responde y no abren el circuito.
+
+Métricas: therapose_circuito_rechazos_total y therapose_circuito_transiciones_total
+(por circuito y estado de destino).
+"""
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from keycloak.exceptions import KeycloakConnectionError, KeycloakError
+from .metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# Configuración del circuito de Keycloak
+FALLOS_CONSECUTIVOS = int(os.getenv("THERAPOSE_CIRCUITO_FALLOS", "5"))
+LATENCIA_LENTA_S = float(os.getenv("THERAPOSE_CIRCUITO_LATENCIA_S", "1.0"))
+VENTANA = 20
+MIN_LLAMADAS = 10
+ESPERA_S = float(os.getenv("THERAPOSE_CIRCUITO_ESPERA_S", "30"))
+
+CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+registro.describir("therapose_circuito_rechazos_total", "Llamadas rechazadas con el circuito abierto.")
+registro.describir("therapose_circuito_transiciones_total", "Cambios de estado del circuito, por estado de destino.")
+
+
+class CircuitoAbierto(Exception):
+    """La llamada no se hace porque el servicio se considera caído"""
+
+
+def es_caida(error: BaseException) -> bool:
+    """True si el error indica que Keycloak no responde (y no un rechazo de la petición)"""
+    if isinstance(error, KeycloakConnectionError):
+        return True
+    if isinstance(error, KeycloakError):
+        return (error.response_code or 0) >= 500
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class Circuito:
+    """
+    Estado del circuito de un servicio externo, compartido por todos los hilos del proceso.
+    """
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.estado = CERRADO
+        self._lock = threading.Lock()
+        self._abierto_desde = 0.0
+        self._sonda_en_curso = False
+        # Aumenta con cada cambio de estado; cada llamada admitida lleva la de su admisión
+        self._generacion = 0
+        self._fallos_seguidos = 0
+        # True para las llamadas malas (caída o lenta) de la ventana
+        self._ventana = collections.deque(maxlen=VENTANA)
+
+    def disponible(self) -> bool:
+        """False si las llamadas se rechazarían ahora mismo"""
+        with self._lock:
+            return self.estado == CERRADO or (
+                self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= ESPERA_S)
+
+    def _cambiar(self, estado: str):
+        if estado == self.estado:
+            return
+        self.estado = estado
+        self._generacion += 1
+        registro.incrementar("therapose_circuito_transiciones_total", circuito=self.nombre, estado=estado)
+        if estado == ABIERTO:
+            self._abierto_desde = time.monotonic()
+            logger.warning("Circuito %s abierto: se rechazan las llamadas durante %.0f s", self.nombre, ESPERA_S)
+        else:
+            logger.warning("Circuito %s %s", self.nombre, estado)
+
+    def _permitir(self) -> Optional[tuple]:
+        """
+        Decide si la llamada pasa; en semiabierto solo pasa la sonda.
+
+        Returns:
+            Optional[tuple]: None si se rechaza; si pasa, (generación, es_sonda), que
+                se entrega a _registrar al terminar la llamada
+        """
+        with self._lock:
+            if self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= ESPERA_S:
+                self._cambiar(SEMIABIERTO)
+            if self.estado == CERRADO:
+                return self._generacion, False
+            if self.estado == SEMIABIERTO and not self._sonda_en_curso:
+                self._sonda_en_curso = True
+                return self._generacion, True
+            return None
+
+    def _registrar(self, admision: tuple, caida: bool, segundos: float):
+        generacion, sonda = admision
+        mala = caida or segundos > LATENCIA_LENTA_S
+        with self._lock:
+            if sonda:
+                # Mientras la sonda está en curso nadie más cambia el estado: sigue semiabierto
+                self._sonda_en_curso = False
+                if mala:
+                    self._cambiar(ABIERTO)
+                else:
+                    self._ventana.clear()
+                    self._fallos_seguidos = 0
+                    self._cambiar(CERRADO)
+                return
+            if generacion != self._generacion:
+                # Llamada admitida antes del último cambio de estado (el circuito se abrió mientras tanto)
+                return
+            self._fallos_seguidos = self._fallos_seguidos + 1 if caida else 0
+            self._ventana.append(mala)
+            lentas = sum(self._ventana)
+            if self._fallos_seguidos >= FALLOS_CONSECUTIVOS or (
+                    len(self._ventana) >= MIN_LLAMADAS and 2 * lentas >= len(self._ventana)):
+                self._ventana.clear()
+                self._fallos_seguidos = 0
+                self._cambiar(ABIERTO)
+
+    def llamar(self, funcion, *args, **kwargs):
+        """
+        Ejecuta funcion(*args, **kwargs) a través del circuito.
+
+        Raises:
+            CircuitoAbierto: Si el circuito está abierto (o semiabierto con la sonda en curso)
+        """
+        admision = self._permitir()
+        if admision is None:
+            registro.incrementar("therapose_circuito_rechazos_total", circuito=self.nombre)
+            raise CircuitoAbierto(f"{self.nombre} no disponible")
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion(*args, **kwargs)
+        except BaseException as e:
+            self._registrar(admision, es_caida(e), time.perf_counter() - inicio)
+            raise
+        self._registrar(admision, False, time.perf_counter() - inicio)
+        return resultado
+
+
+# Circuito único para Keycloak: OpenID (login y validación de tokens) y API de administración
+circuito_keycloak = Circuito("keycloak")
@@ -0,0 +1,146 @@
+"""
+Coalescencia de lecturas idénticas concurrentes (single-flight).
+
+Cuando muchas peticiones iguales llegan a la vez (los instructores de una clínica
+abriendo el panel a primera hora), cada una repetiría la misma consulta o la
+misma validación del token en Keycloak. Con @coalescer la primera llamada de una
+clave (función + argumentos) la ejecuta y las que llegan mientras sigue en curso
+esperan su resultado en lugar de repetirla. No es una caché: en cuanto termina,
+la siguiente llamada vuelve a ejecutarse.
+
+- Las que esperan reciben una copia superficial del resultado (y de cada registro
+  si es una lista), porque algunos endpoints completan los registros que reciben
+  (p. ej. serie.posturas en el panel del paciente).
+- Si la ejecución falla, todas las llamadas de la clave reciben la misma excepción.
+- Cada escritura del proceso (database.ejecutar_escritura) abre una generación
+  nueva: una lectura que empieza después de una escritura no se une a otra
+  iniciada antes, y así se ven siempre las escrituras propias.
+- Métricas por grupo (nombre de la función): therapose_coalescencia_llamadas_total,
+  _ejecuciones_total y _compartidas_total, y el tiempo de espera de las llamadas
+  compartidas en therapose_coalescencia_espera_seconds.
+
+Las claves solo viven mientras la llamada está en curso; las métricas no las
+incluyen (pueden contener tokens o identificadores de pacientes).
+benchmarks/bench_coalescencia.py simula avalanchas de peticiones idénticas.
+"""
+import copy
+import functools
+import itertools
+import threading
+import time
+from .metricas import registro
+
+registro.describir("therapose_coalescencia_llamadas_total", "Llamadas a funciones con coalescencia, por grupo.")
+registro.describir("therapose_coalescencia_ejecuciones_total",
+                   "Ejecuciones reales (una por grupo de llamadas idénticas concurrentes).")
+registro.describir("therapose_coalescencia_compartidas_total",
+                   "Llamadas que recibieron el resultado de otra ya en curso.")
+registro.describir("therapose_coalescencia_espera_seconds", "Espera de las llamadas compartidas, por grupo.")
+
+# Generación de escrituras del proceso (forma parte de la clave)
+_generacion = itertools.count()
+_generacion_actual = next(_generacion)
+
+
+def nueva_generacion():
+    """Marca una escritura: las lecturas que empiecen a partir de ahora no se unen a las anteriores"""
+    global _generacion_actual
+    _generacion_actual = next(_generacion)
+
+
+class _Vuelo:
+    """Ejecución en curso de una clave"""
+    __slots__ = ("terminado", "resultado", "error", "compartidas")
+
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.compartidas = 0
+
+
+def copiar_resultado(resultado):
+    """Copia superficial del resultado; en las listas también de cada elemento"""
+    if isinstance(resultado, list):
+        return [copy.copy(elemento) for elemento in resultado]
+    return copy.copy(resultado)
+
+
+class GrupoCoalescencia:
+    """
+    Llamadas en curso de un grupo (una función), indexadas por clave.
+    """
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._vuelos = {}
+        self._lock = threading.Lock()
+
+    def en_curso(self) -> int:
+        with self._lock:
+            return len(self._vuelos)
+
+    def ejecutar(self, clave, funcion, *args, **kwargs):
+        """
+        Ejecuta funcion(*args, **kwargs) salvo que ya haya una ejecución en curso
+        con la misma clave; en ese caso espera y devuelve (una copia de) su resultado.
+        """
+        registro.incrementar("therapose_coalescencia_llamadas_total", grupo=self.nombre)
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+            else:
+                vuelo.compartidas += 1
+
+        if not lider:
+            inicio = time.perf_counter()
+            vuelo.terminado.wait()
+            registro.incrementar("therapose_coalescencia_compartidas_total", grupo=self.nombre)
+            registro.observar("therapose_coalescencia_espera_seconds", time.perf_counter() - inicio,
+                              grupo=self.nombre)
+            if vuelo.error is not None:
+                raise vuelo.error
+            return copiar_resultado(vuelo.resultado)
+
+        registro.incrementar("therapose_coalescencia_ejecuciones_total", grupo=self.nombre)
+        try:
+            vuelo.resultado = funcion(*args, **kwargs)
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            # Se retira antes de avisar: quien llegue después ejecuta de nuevo
+            with self._lock:
+                del self._vuelos[clave]
+                compartidas = vuelo.compartidas
+            vuelo.terminado.set()
+        # Si hubo llamadas compartidas, cada una copia del original: también este llamador
+        # recibe su propia copia para que sus cambios no se vean en las demás
+        return copiar_resultado(vuelo.resultado) if compartidas else vuelo.resultado
+
+
+# Grupos registrados, por nombre
+GRUPOS = {}
+
+
+def grupo(nombre: str) -> GrupoCoalescencia:
+    """Grupo de coalescencia con ese nombre (se crea la primera vez)"""
+    if nombre not in GRUPOS:
+        GRUPOS[nombre] = GrupoCoalescencia(nombre)
+    return GRUPOS[nombre]
+
+
+def coalescer(func):
+    """
+    Decorador: las llamadas concurrentes con los mismos argumentos (hashables)
+    comparten una sola ejecución. El grupo de métricas es el nombre de la función.
+    """
+    vuelos = grupo(func.__name__)
+
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        clave = (_generacion_actual, args, tuple(sorted(kwargs.items())))
+        return vuelos.ejecutar(clave, func, *args, **kwargs)
+    return envoltura
@@ -1,18 +1,120 @@
-import sqlite3
-from typing import List, Dict
+import logging
+import os
+import time
+import zlib
+from typing import List, Optional
+from . import coalescencia
+from .coalescencia import coalescer
+from .metricas import instrumentar
+from .modelos import (AdherenciaPostura, Instructor, MedioPostura, Patient, PlantillaSerie, Postura, ReferenciaPostura,
+                      ResumenPaciente, ResumenSerie, Serie, SeriePostura, Sesion)
+from .almacenamiento import crear_backend
+from .escritor import ClienteEscritor
+from .invalidacion import BusInvalidacion
 
+logger = logging.getLogger(__name__)
+
+# Ruta del archivo de base de datos SQLite
+DB_PATH = os.getenv("THERAPOSE_DB_PATH", 'proyecto/instructor_patients.db')
+
+# Modo multiproceso: si está definido, todas las escrituras se envían al proceso
+# escritor (python -m proyecto.src.escritor) por este socket Unix y los workers
+# solo abren conexiones de lectura
+WRITER_SOCKET = os.getenv("THERAPOSE_DB_WRITER_SOCKET")
+
+# Backend de almacenamiento: SQLite por defecto o PostgreSQL si THERAPOSE_DB_URL lo indica
+backend = crear_backend(DB_PATH, solo_lectura=bool(WRITER_SOCKET))
+
+# El proceso escritor solo tiene sentido con SQLite (PostgreSQL ya admite escrituras concurrentes)
+_cliente_escritor = ClienteEscritor(WRITER_SOCKET) if WRITER_SOCKET and backend.nombre == "sqlite" else None
+
+# Eventos de invalidación de las cachés en memoria (entre workers, a través de la base de datos)
+invalidaciones = BusInvalidacion(backend)
+publicar_invalidacion = BusInvalidacion.publicar
+
+# Operaciones de escritura registradas: nombre -> función(cursor, ...)
+OPERACIONES_ESCRITURA = {}
+
+def get_connection(escritura: bool = False):
+    """
+    Abre una conexión del backend configurado. Con SQLite las sentencias quedan
+    trazadas y, en modo multiproceso, las conexiones de los workers son de solo
+    lectura (WAL); con PostgreSQL la conexión se toma del pool y close() la devuelve.
+    """
+    return backend.conectar(escritura)
+
+def operacion_escritura(func):
+    """
+    Registra una operación de escritura que recibe un cursor como primer argumento.
+    Las operaciones no hacen commit: se ejecutan dentro de la transacción de quien las invoca.
+    """
+    OPERACIONES_ESCRITURA[func.__name__] = func
+    return func
+
+def ejecutar_escritura(nombre: str, *args, **kwargs):
+    """
+    Ejecuta una operación de escritura registrada:
+    1. En modo multiproceso, la envía al proceso escritor (group commit)
+    2. En otro caso, la ejecuta en su propia transacción de escritura del backend
+    """
+    try:
+        if _cliente_escritor is not None:
+            return _cliente_escritor.ejecutar(nombre, args, kwargs)
+
+        with backend.transaccion() as cursor:
+            return OPERACIONES_ESCRITURA[nombre](cursor, *args, **kwargs)
+    finally:
+        # Las lecturas posteriores no se unen a las que empezaron antes de la escritura
+        coalescencia.nueva_generacion()
+        # Las cachés de este worker ven la escritura al momento (las de los demás, en INTERVALO_S)
+        invalidaciones.sincronizar(forzar=True)
+
+@instrumentar("db")
 def init_db():
+    """
+    Inicializa o actualiza el esquema de la base de datos en una sola conexión.
+    La versión aplicada se guarda en el backend (PRAGMA user_version en SQLite),
+    de modo que si el esquema ya está al día el arranque se limita a una lectura.
+    Las migraciones pendientes se aplican en una única transacción, bajo un
+    bloqueo que las serializa entre workers.
+    """
+    # El esquema se prepara siempre con una conexión de escritura (también en modo multiproceso)
+    conn = get_connection(escritura=True)
+    cursor = conn.cursor()
+    try:
+        version = backend.version_esquema(cursor)
+        if version >= SCHEMA_VERSION:
+            return
+        if version == 0 and backend.nombre == "sqlite":
+            # Base de datos nueva: el espacio que libera el archivo de sesiones se
+            # devuelve al sistema poco a poco con PRAGMA incremental_vacuum (archivo.py).
+            # Solo tiene efecto antes de crear la primera tabla; las bases de datos que
+            # ya tienen tablas se convierten sin conexión (python -m proyecto.src.archivo convertir)
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        backend.bloquear_esquema(cursor)
+        # Otro proceso pudo completar la migración mientras se esperaba el bloqueo
+        version = backend.version_esquema(cursor)
+        for numero, migracion in enumerate(MIGRACIONES, start=1):
+            if numero > version:
+                migracion(cursor)
+        backend.fijar_version_esquema(cursor, SCHEMA_VERSION)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def create_user_tables(cursor):
     """
     Crea las tablas necesarias si no existen:
     1. instructor_patients: Relación entre instructores y pacientes
     2. instructors: Información de los instructores
     3. patients: Información de los pacientes
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    
     # Tabla de instructores
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS instructors (
             id TEXT PRIMARY KEY,
             username TEXT NOT NULL UNIQUE,
@@ -27,7 +129,7 @@ def init_db():
     ''')
     
     # Tabla de pacientes
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS patients (
             id TEXT PRIMARY KEY,
             username TEXT NOT NULL UNIQUE,
@@ -42,7 +144,7 @@ def init_db():
     ''')
     
     # Tabla de relación instructor-paciente
-    c.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS instructor_patients (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             instructor_id TEXT NOT NULL,
@@ -53,119 +155,119 @@ def init_db():
             FOREIGN KEY (patient_id) REFERENCES patients(id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
 
-    # Asegurar que las tablas estén actualizadas
-    create_therapy_tables()
-    update_serie_table()
+@operacion_escritura
+def _add_instructor(cursor, instructor_id, username, email, first_name, last_name, fecha_nac, genero, celular):
+    cursor.execute('''
+        INSERT INTO instructors 
+        (id, username, email, first_name, last_name, fecha_nac, genero, celular) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (instructor_id, username, email, first_name, last_name, fecha_nac, genero, celular))
+    publicar_invalidacion(cursor, "instructor", instructor_id)
 
+@instrumentar("db")
 def add_instructor(instructor_id: str, username: str, email: str, first_name: str, last_name: str, 
                   fecha_nac: str = None, genero: str = None, celular: str = None):
     """
     Añade un instructor a la base de datos
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO instructors 
+    ejecutar_escritura("_add_instructor", instructor_id, username, email, first_name, last_name,
+                       fecha_nac, genero, celular)
+
+@operacion_escritura
+def _add_patient(cursor, patient_id, username, email, first_name, last_name, fecha_nac, genero, celular):
+    cursor.execute('''
+        INSERT INTO patients 
         (id, username, email, first_name, last_name, fecha_nac, genero, celular) 
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (instructor_id, username, email, first_name, last_name, fecha_nac, genero, celular))
-    conn.commit()
-    conn.close()
+    ''', (patient_id, username, email, first_name, last_name, fecha_nac, genero, celular))
+    publicar_invalidacion(cursor, "paciente", patient_id)
 
+@instrumentar("db")
 def add_patient(patient_id: str, username: str, email: str, first_name: str, last_name: str,
                 fecha_nac: str = None, genero: str = None, celular: str = None):
     """
     Añade un paciente a la base de datos
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO patients 
-        (id, username, email, first_name, last_name, fecha_nac, genero, celular) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (patient_id, username, email, first_name, last_name, fecha_nac, genero, celular))
-    conn.commit()
-    conn.close()
+    ejecutar_escritura("_add_patient", patient_id, username, email, first_name, last_name,
+                       fecha_nac, genero, celular)
 
-def add_patient_to_instructor(instructor_id: str, patient_id: str):
-    """
-    Añade una relación instructor-paciente a la base de datos
-    """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('''
+@operacion_escritura
+def _add_patient_to_instructor(cursor, instructor_id, patient_id):
+    cursor.execute('''
         INSERT INTO instructor_patients 
         (instructor_id, patient_id) 
         VALUES (?, ?)
     ''', (instructor_id, patient_id))
-    conn.commit()
-    conn.close()
+    publicar_invalidacion(cursor, "instructor", instructor_id)
 
-def get_instructor_patients(instructor_id: str) -> List[Dict]:
+@instrumentar("db")
+def add_patient_to_instructor(instructor_id: str, patient_id: str):
     """
-    Obtiene la lista de pacientes asociados a un instructor
+    Añade una relación instructor-paciente a la base de datos
+    """
+    ejecutar_escritura("_add_patient_to_instructor", instructor_id, patient_id)
+
+@instrumentar("db")
+@coalescer
+def get_instructor_patients(instructor_id: str) -> List[Patient]:
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('''
-        SELECT p.* 
+    Obtiene la lista de pacientes asociados a un instructor, en el orden en que se le asignaron
+    """
+    conn = get_connection()
+    c = backend.con_registro(conn.cursor(), Patient)
+    c.execute(f'''
+        SELECT {Patient.columnas("p")}
         FROM patients p
         JOIN instructor_patients ip ON p.id = ip.patient_id
         WHERE ip.instructor_id = ?
+        ORDER BY ip.id
     ''', (instructor_id,))
-    
-    columns = [description[0] for description in c.description]
-    patients = []
-    for row in c.fetchall():
-        patient = dict(zip(columns, row))
-        patients.append(patient)
+    patients = c.fetchall()
     
     conn.close()
     return patients
 
-def get_instructor(instructor_id: str) -> Dict:
+@instrumentar("db")
+@coalescer
+def get_instructor(instructor_id: str) -> Optional[Instructor]:
     """
     Obtiene la información de un instructor
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM instructors WHERE id = ?', (instructor_id,))
-    
-    columns = [description[0] for description in c.description]
-    row = c.fetchone()
-    instructor = dict(zip(columns, row)) if row else None
+    conn = get_connection()
+    c = backend.con_registro(conn.cursor(), Instructor)
+    c.execute(f'SELECT {Instructor.columnas()} FROM instructors WHERE id = ?', (instructor_id,))
+    instructor = c.fetchone()
     
     conn.close()
     return instructor
 
-def get_patient(patient_id: str) -> Dict:
+@instrumentar("db")
+@coalescer
+def get_patient(patient_id: str) -> Optional[Patient]:
     """
     Obtiene la información de un paciente
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM patients WHERE id = ?', (patient_id,))
-    
-    columns = [description[0] for description in c.description]
-    row = c.fetchone()
-    patient = dict(zip(columns, row)) if row else None
+    conn = get_connection()
+    c = backend.con_registro(conn.cursor(), Patient)
+    c.execute(f'SELECT {Patient.columnas()} FROM patients WHERE id = ?', (patient_id,))
+    patient = c.fetchone()
     
     conn.close()
     return patient
 
+@operacion_escritura
+def _update_patient(cursor, patient_id, query, params):
+    cursor.execute(query, params)
+    publicar_invalidacion(cursor, "paciente", patient_id)
+
+@instrumentar("db")
 def update_patient(patient_id: str, username: str = None, email: str = None, 
                   first_name: str = None, last_name: str = None,
                   fecha_nac: str = None, genero: str = None, celular: str = None):
     """
     Actualiza la información de un paciente en la base de datos
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    c = conn.cursor()
-    
     # Construir la consulta  basada en los campos proporcionados
     update_fields = []
     params = []
@@ -198,13 +300,95 @@ def update_patient(patient_id: str, username: str = None, email: str = None,
     query = f"UPDATE patients SET {', '.join(update_fields)} WHERE id = ?"
     params.append(patient_id)
     
-    c.execute(query, params)
-    conn.commit()
-    conn.close()
+    ejecutar_escritura("_update_patient", patient_id, query, params)
 
+# Borrado en cascada por lotes: cada lote es una transacción corta, de modo que
+# borrar un paciente con años de historial no retiene el bloqueo de escritura
+SESIONES_POR_LOTE_PURGA = 200
+PAUSA_PURGA_S = 0.01
+
+# Series que se purgan: las de un paciente o las de pacientes que ya no existen
+_SERIES_A_PURGAR = {
+    "paciente": "SELECT id_serie FROM serie_terapeutica WHERE patient_id = ?",
+    "huerfanas": ("SELECT id_serie FROM serie_terapeutica st "
+                  "WHERE NOT EXISTS (SELECT 1 FROM patients p WHERE p.id = st.patient_id)"),
+}
+
+@operacion_escritura
+def _purgar_series_lote(cursor, seleccion: str, parametros: tuple, max_sesiones: int) -> tuple:
+    series = _SERIES_A_PURGAR[seleccion]
+    # Primero las sesiones (y sus tiempos por postura), luego las series vacías
+    for sesiones, tiempos in (("sesion", "sesion_postura"), ("sesion_archivada", "sesion_postura_archivada")):
+        ids = [fila[0] for fila in cursor.execute(
+            f'SELECT id_sesion FROM {sesiones} WHERE id_serie IN ({series}) LIMIT ?',
+            (*parametros, max_sesiones)).fetchall()]
+        if ids:
+            marcadores = ",".join("?" * len(ids))
+            cursor.execute(f'DELETE FROM {tiempos} WHERE id_sesion IN ({marcadores})', ids)
+            cursor.execute(f'DELETE FROM {sesiones} WHERE id_sesion IN ({marcadores})', ids)
+            return sesiones, len(ids)
+    
+    ids = [fila[0] for fila in cursor.execute(f'{series} LIMIT ?', (*parametros, max_sesiones)).fetchall()]
+    if not ids:
+        return None, 0
+    marcadores = ",".join("?" * len(ids))
+    cursor.execute(f'DELETE FROM postura_en_serie WHERE id_serie IN ({marcadores})', ids)
+    cursor.execute(f'DELETE FROM serie_terapeutica WHERE id_serie IN ({marcadores})', ids)
+    for id_serie in ids:
+        publicar_invalidacion(cursor, "serie", id_serie)
+    return "serie_terapeutica", len(ids)
+
+def _purgar_series(seleccion: str, parametros: tuple = ()) -> dict:
+    """Ejecuta lotes de _purgar_series_lote hasta vaciar la selección; devuelve filas borradas por tabla"""
+    borradas = {}
+    while True:
+        tabla, filas = ejecutar_escritura("_purgar_series_lote", seleccion, parametros, SESIONES_POR_LOTE_PURGA)
+        if not filas:
+            return borradas
+        borradas[tabla] = borradas.get(tabla, 0) + filas
+        # Hueco para las escrituras que esperan el bloqueo
+        time.sleep(PAUSA_PURGA_S)
+
+@operacion_escritura
+def _desvincular_paciente(cursor, patient_id) -> bool:
+    existe = cursor.execute("SELECT 1 FROM patients WHERE id = ?", (patient_id,)).fetchone()
+    if not existe:
+        return False
+    cursor.execute("DELETE FROM instructor_patients WHERE patient_id = ?", (patient_id,))
+    publicar_invalidacion(cursor, "paciente", patient_id)
+    publicar_invalidacion(cursor, "instructor")
+    return True
+
+@operacion_escritura
+def _delete_patient(cursor, patient_id):
+    # Obtener el keycloak_id antes de eliminar
+    cursor.execute("SELECT id FROM patients WHERE id = ?", (patient_id,))
+    patient = cursor.fetchone()
+    
+    if not patient:
+        return None, False
+    
+    # Lo que se haya creado mientras se purgaba (normalmente nada) se borra en esta misma transacción
+    while _purgar_series_lote(cursor, "paciente", (patient_id,), SESIONES_POR_LOTE_PURGA)[1]:
+        pass
+        
+    # Primero eliminar la relación instructor-paciente
+    cursor.execute("DELETE FROM instructor_patients WHERE patient_id = ?", (patient_id,))
+    
+    # Luego eliminar el paciente
+    cursor.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+    publicar_invalidacion(cursor, "paciente", patient_id)
+    publicar_invalidacion(cursor, "instructor")
+    
+    return patient[0], True
+
+@instrumentar("db")
 def delete_patient(patient_id: str):
     """
-    Elimina un paciente de la base de datos SQLite.
+    Elimina un paciente y todos sus datos (series, posturas de las series y
+    sesiones, también las archivadas). El paciente deja de verse en la primera
+    transacción; sus datos se borran después en lotes de SESIONES_POR_LOTE_PURGA
+    sesiones y la última transacción borra el paciente.
     
     Args:
         patient_id (str): ID del paciente a eliminar
@@ -212,35 +396,72 @@ def delete_patient(patient_id: str):
     Returns:
         tuple: (keycloak_id, success) - ID de Keycloak del paciente y si se eliminó correctamente
     """
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
-    try:
-        # Obtener el keycloak_id antes de eliminar
-        cursor.execute("SELECT id FROM patients WHERE id = ?", (patient_id,))
-        patient = cursor.fetchone()
-        
-        if not patient:
-            return None, False
-            
-        # Primero eliminar la relación instructor-paciente
-        cursor.execute("DELETE FROM instructor_patients WHERE patient_id = ?", (patient_id,))
-        
-        # Luego eliminar el paciente
-        cursor.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
-        
-        conn.commit()
-        return patient[0], True
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    if not ejecutar_escritura("_desvincular_paciente", patient_id):
+        return None, False
+    _purgar_series("paciente", (patient_id,))
+    return ejecutar_escritura("_delete_patient", patient_id)
 
-# Definición de tablas para Series Terapéuticas y Posturas
-def create_therapy_tables():
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+# Filas huérfanas (su fila padre ya no existe): tabla, clave por la que se borra y
+# condición, en el orden en que hay que borrarlas
+_HUERFANAS = (
+    ("sesion", "id_sesion",
+     "NOT EXISTS (SELECT 1 FROM serie_terapeutica st WHERE st.id_serie = t.id_serie)"),
+    ("sesion_archivada", "id_sesion",
+     "NOT EXISTS (SELECT 1 FROM serie_terapeutica st WHERE st.id_serie = t.id_serie)"),
+    ("sesion_postura", "id_sesion",
+     "NOT EXISTS (SELECT 1 FROM sesion s WHERE s.id_sesion = t.id_sesion)"),
+    ("sesion_postura_archivada", "id_sesion",
+     "NOT EXISTS (SELECT 1 FROM sesion_archivada s WHERE s.id_sesion = t.id_sesion)"),
+    ("postura_en_serie", "id_serie",
+     "NOT EXISTS (SELECT 1 FROM serie_terapeutica st WHERE st.id_serie = t.id_serie)"),
+    ("instructor_patients", "id",
+     "NOT EXISTS (SELECT 1 FROM patients p WHERE p.id = t.patient_id) "
+     "OR NOT EXISTS (SELECT 1 FROM instructors i WHERE i.id = t.instructor_id)"),
+)
+
+@operacion_escritura
+def _purgar_huerfanas_lote(cursor, indice: int, max_filas: int) -> int:
+    tabla, clave, condicion = _HUERFANAS[indice]
+    return cursor.execute(f'''
+        DELETE FROM {tabla}
+        WHERE {clave} IN (SELECT {clave} FROM {tabla} t WHERE {condicion} LIMIT ?)
+    ''', (max_filas,)).rowcount
+
+@instrumentar("db")
+def purgar_huerfanas() -> dict:
+    """
+    Borra, por lotes, los datos que quedaron sin su fila padre (p. ej. las series
+    y sesiones de los pacientes eliminados antes del borrado en cascada).
     
+    Returns:
+        dict: Filas borradas por tabla
+    """
+    borradas = _purgar_series("huerfanas")
+    for indice, (tabla, _, _) in enumerate(_HUERFANAS):
+        while True:
+            filas = ejecutar_escritura("_purgar_huerfanas_lote", indice, SESIONES_POR_LOTE_PURGA)
+            if not filas:
+                break
+            borradas[tabla] = borradas.get(tabla, 0) + filas
+            time.sleep(PAUSA_PURGA_S)
+    return borradas
+
+# Posturas predefinidas (nombre en español, nombre en sánscrito)
+POSTURAS_BASE = [
+    ("Cat Pose", "Marjaryasana"),
+    ("Chair Pose", "Utkatasana"),
+    ("Cobra Pose", "Bhujangasana"),
+    ("Bound Angle Pose", "Baddha Konasana"),
+    ("Dolphin Plank Pose", "Makara Adho Mukha Svanasana"),
+    ("Downward Facing Dog", "Adho Mukha Svanasana"),
+    ("Boat Pose", "Navasana"),
+    ("Corpse Pose", "Savasana"),
+    ("Easy Pose", "Sukhasana")
+]
+
+# Definición de tablas para Series Terapéuticas y Posturas
+def create_therapy_tables(cursor):
+    """Crea las tablas de series terapéuticas, posturas y sesiones si no existen"""
     # Tabla Serie Terapéutica
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS serie_terapeutica (
@@ -298,37 +519,10 @@ def create_therapy_tables():
     ''')
     
     # Insertar posturas predefinidas si no existen
-    posturas = [
-        ("Cat Pose", "Marjaryasana"),
-        ("Chair Pose", "Utkatasana"),
-        ("Cobra Pose", "Bhujangasana"),
-        ("Bound Angle Pose", "Baddha Konasana"),
-        ("Dolphin Plank Pose", "Makara Adho Mukha Svanasana"),
-        ("Downward Facing Dog", "Adho Mukha Svanasana"),
-        ("Boat Pose", "Navasana"),
-        ("Corpse Pose", "Savasana"),
-        ("Easy Pose", "Sukhasana")
-    ]
-    
-    cursor.execute("SELECT COUNT(*) FROM postura")
-    if cursor.fetchone()[0] == 0:
-        for nombre_es, nombre_sans in posturas:
-            cursor.execute('''
-                INSERT INTO postura (nombre_es, nombre_sans)
-                VALUES (?, ?)
-            ''', (nombre_es, nombre_sans))
-    
-    conn.commit()
-    conn.close()
-    
-    # Insertar posturas adicionales para los nuevos tipos de terapia
-    insert_additional_posturas()
+    insert_posturas(cursor, POSTURAS_BASE)
 
-def update_serie_table():
+def update_serie_table(cursor):
     """Actualiza la estructura de la tabla serie_terapeutica si es necesario"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
-    
     # Verificar si la columna activa existe
     cursor.execute("PRAGMA table_info(serie_terapeutica)")
     columns = [column[1] for column in cursor.fetchall()]
@@ -338,39 +532,123 @@ def update_serie_table():
             ALTER TABLE serie_terapeutica
             ADD COLUMN activa BOOLEAN DEFAULT 1
         ''')
+
+# Columnas de postura que faltan en las bases de datos creadas con el esquema original
+# (solo id_postura, nombre_es y nombre_sans)
+COLUMNAS_POSTURA = (
+    ("instrucciones", "TEXT"),
+    ("beneficios", "TEXT"),
+    ("precauciones", "TEXT"),
+    ("video", "TEXT"),
+    ("fotografia", "TEXT"),
+)
+
+def update_postura_table(cursor):
+    """Añade a la tabla postura las columnas que falten en bases de datos antiguas"""
+    cursor.execute("PRAGMA table_info(postura)")
+    columns = [column[1] for column in cursor.fetchall()]
     
-    conn.commit()
-    conn.close()
+    for columna, tipo in COLUMNAS_POSTURA:
+        if columna not in columns:
+            cursor.execute(f'ALTER TABLE postura ADD COLUMN {columna} {tipo}')
+
+# Posturas sugeridas de partida para cada tipo de terapia (recomendacion.py las
+# reordena según los resultados de las sesiones)
+POSTURAS_POR_TIPO_TERAPIA = {
+    "Ansiedad": ["Bound Angle Pose", "Boat Pose", "Cobra Pose", "Cat Pose", "Corpse Pose", "Easy Pose", "Child's Pose", "Legs Up the Wall", "Seated Forward Bend", "Bridge Pose", "Camel Pose", "Lotus Pose"],
+    "Depresión": ["Cat Pose", "Cobra Pose", "Boat Pose", "Bound Angle Pose", "Corpse Pose", "Easy Pose", "Child's Pose", "Legs Up the Wall", "Seated Forward Bend", "Bridge Pose", "Camel Pose", "Lotus Pose"],
+    "Dolor de Espalda": ["Cat Pose", "Chair Pose", "Cobra Pose", "Bound Angle Pose", "Dolphin Plank Pose", "Downward Facing Dog", "Child's Pose", "Bridge Pose", "Locust Pose", "Camel Pose", "Seated Twist", "Supine Twist"],
+    "Artritis": ["Easy Pose", "Child's Pose", "Cat Pose", "Cobra Pose", "Bound Angle Pose", "Seated Forward Bend", "Bridge Pose", "Legs Up the Wall", "Corpse Pose", "Seated Twist", "Supine Twist", "Lotus Pose"],
+    "Dolor de Cabeza": ["Child's Pose", "Cat Pose", "Cobra Pose", "Easy Pose", "Seated Forward Bend", "Legs Up the Wall", "Corpse Pose", "Seated Twist", "Supine Twist", "Bridge Pose", "Camel Pose", "Lotus Pose"],
+    "Insomnio": ["Child's Pose", "Legs Up the Wall", "Corpse Pose", "Easy Pose", "Seated Forward Bend", "Bound Angle Pose", "Bridge Pose", "Camel Pose", "Lotus Pose", "Seated Twist", "Supine Twist", "Cat Pose"],
+    "Mala Postura": ["Cat Pose", "Cobra Pose", "Chair Pose", "Downward Facing Dog", "Child's Pose", "Bridge Pose", "Locust Pose", "Camel Pose", "Seated Twist", "Supine Twist", "Bound Angle Pose", "Seated Forward Bend"]
+}
 
 # Funciones para manejar series terapéuticas
+@instrumentar("db")
 def get_posturas_by_tipo_terapia(tipo_terapia):
-    posturas_por_tipo = {
-        "Ansiedad": ["Bound Angle Pose", "Boat Pose", "Cobra Pose", "Cat Pose", "Corpse Pose", "Easy Pose", "Child's Pose", "Legs Up the Wall", "Seated Forward Bend", "Bridge Pose", "Camel Pose", "Lotus Pose"],
-        "Depresión": ["Cat Pose", "Cobra Pose", "Boat Pose", "Bound Angle Pose", "Corpse Pose", "Easy Pose", "Child's Pose", "Legs Up the Wall", "Seated Forward Bend", "Bridge Pose", "Camel Pose", "Lotus Pose"],
-        "Dolor de Espalda": ["Cat Pose", "Chair Pose", "Cobra Pose", "Bound Angle Pose", "Dolphin Plank Pose", "Downward Facing Dog", "Child's Pose", "Bridge Pose", "Locust Pose", "Camel Pose", "Seated Twist", "Supine Twist"],
-        "Artritis": ["Easy Pose", "Child's Pose", "Cat Pose", "Cobra Pose", "Bound Angle Pose", "Seated Forward Bend", "Bridge Pose", "Legs Up the Wall", "Corpse Pose", "Seated Twist", "Supine Twist", "Lotus Pose"],
-        "Dolor de Cabeza": ["Child's Pose", "Cat Pose", "Cobra Pose", "Easy Pose", "Seated Forward Bend", "Legs Up the Wall", "Corpse Pose", "Seated Twist", "Supine Twist", "Bridge Pose", "Camel Pose", "Lotus Pose"],
-        "Insomnio": ["Child's Pose", "Legs Up the Wall", "Corpse Pose", "Easy Pose", "Seated Forward Bend", "Bound Angle Pose", "Bridge Pose", "Camel Pose", "Lotus Pose", "Seated Twist", "Supine Twist", "Cat Pose"],
-        "Mala Postura": ["Cat Pose", "Cobra Pose", "Chair Pose", "Downward Facing Dog", "Child's Pose", "Bridge Pose", "Locust Pose", "Camel Pose", "Seated Twist", "Supine Twist", "Bound Angle Pose", "Seated Forward Bend"]
-    }
+    nombres = POSTURAS_POR_TIPO_TERAPIA[tipo_terapia]
     
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), Postura)
     posturas = cursor.execute('''
         SELECT id_postura, nombre_es, nombre_sans
         FROM postura
         WHERE nombre_es IN ({})
-    '''.format(','.join('?' * len(posturas_por_tipo[tipo_terapia]))), 
-    posturas_por_tipo[tipo_terapia]).fetchall()
+    '''.format(','.join('?' * len(nombres))), 
+    nombres).fetchall()
     
     conn.close()
     return posturas
 
-def insert_additional_posturas():
-    """Inserta las posturas adicionales para los nuevos tipos de terapia"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+@instrumentar("db")
+def get_catalogo_posturas() -> List[Postura]:
+    """Todas las posturas del catálogo"""
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), Postura)
+    posturas = cursor.execute('''
+        SELECT id_postura, nombre_es, nombre_sans
+        FROM postura
+        ORDER BY id_postura
+    ''').fetchall()
+    
+    conn.close()
+    return posturas
+
+@instrumentar("db")
+def buscar_posturas(terminos: List[str], limite: int) -> List[Postura]:
+    """
+    Búsqueda de texto completo en el catálogo de posturas: nombres en español y
+    sánscrito, instrucciones, beneficios y precauciones. Cada término se busca
+    como prefijo y deben aparecer todos; las coincidencias en los nombres puntúan más.
+    
+    Args:
+        terminos (list): Palabras en minúsculas, sin acentos y solo con letras o dígitos
+        limite (int): Máximo de resultados
+        
+    Returns:
+        list: Posturas ordenadas de más a menos relevante
+    """
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), Postura)
+    
+    if backend.nombre == "postgres":
+        consulta = " & ".join(f"{termino}:*" for termino in terminos)
+        posturas = cursor.execute('''
+            SELECT id_postura, nombre_es, nombre_sans
+            FROM postura
+            WHERE busqueda @@ to_tsquery('simple', ?)
+            ORDER BY ts_rank(busqueda, to_tsquery('simple', ?)) DESC, id_postura
+            LIMIT ?
+        ''', (consulta, consulta, limite)).fetchall()
+    else:
+        consulta = " ".join(f'"{termino}"*' for termino in terminos)
+        # bm25 con más peso para los nombres que para los textos de ayuda
+        posturas = cursor.execute('''
+            SELECT p.id_postura, p.nombre_es, p.nombre_sans
+            FROM postura_fts
+            JOIN postura p ON p.id_postura = postura_fts.rowid
+            WHERE postura_fts MATCH ?
+            ORDER BY bm25(postura_fts, 10.0, 10.0, 1.0, 1.0, 0.5), p.id_postura
+            LIMIT ?
+        ''', (consulta, limite)).fetchall()
     
+    conn.close()
+    return posturas
+
+def insert_posturas(cursor, posturas):
+    """
+    Inserta las posturas (nombre_es, nombre_sans) que aún no existan,
+    en una sola sentencia preparada ejecutada con executemany.
+    """
+    cursor.executemany('''
+        INSERT INTO postura (nombre_es, nombre_sans)
+        SELECT ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM postura WHERE nombre_es = ?)
+    ''', [(nombre_es, nombre_sans, nombre_es) for nombre_es, nombre_sans in posturas])
+
+def insert_additional_posturas(cursor):
+    """Inserta las posturas adicionales para los nuevos tipos de terapia"""
     # Lista de posturas adicionales con sus nombres en sánscrito
     posturas_adicionales = [
         ("Child's Pose", "Balasana"),
@@ -384,105 +662,653 @@ def insert_additional_posturas():
         ("Supine Twist", "Supta Matsyendrasana")
     ]
     
-    # Verificar si las posturas ya existen
-    for nombre_es, nombre_sans in posturas_adicionales:
-        cursor.execute("SELECT COUNT(*) FROM postura WHERE nombre_es = ?", (nombre_es,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('''
-                INSERT INTO postura (nombre_es, nombre_sans)
-                VALUES (?, ?)
-            ''', (nombre_es, nombre_sans))
-    
-    conn.commit()
-    conn.close()
+    insert_posturas(cursor, posturas_adicionales)
 
+def create_postgres_tables(cursor):
+    """
+    Esquema inicial portado a PostgreSQL. Se conservan los tipos que ve la
+    aplicación con SQLite (fechas y horas como texto, activa como 0/1).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instructors (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            fecha_nac TEXT,
+            genero TEXT,
+            celular TEXT,
+            created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            fecha_nac TEXT,
+            genero TEXT,
+            celular TEXT,
+            created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instructor_patients (
+            id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            instructor_id TEXT NOT NULL REFERENCES instructors(id),
+            patient_id TEXT NOT NULL REFERENCES patients(id),
+            created_at TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+            UNIQUE(instructor_id, patient_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS serie_terapeutica (
+            id_serie INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            tipo_terapia TEXT NOT NULL,
+            sesiones_recomendadas INTEGER NOT NULL,
+            patient_id TEXT NOT NULL REFERENCES patients(id),
+            activa SMALLINT DEFAULT 1
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS postura (
+            id_postura INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            nombre_es TEXT NOT NULL,
+            nombre_sans TEXT,
+            instrucciones TEXT,
+            beneficios TEXT,
+            precauciones TEXT,
+            video TEXT,
+            fotografia TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS postura_en_serie (
+            id_serie INTEGER REFERENCES serie_terapeutica(id_serie),
+            id_postura INTEGER REFERENCES postura(id_postura),
+            orden INTEGER NOT NULL,
+            duracion_min INTEGER NOT NULL,
+            PRIMARY KEY (id_serie, id_postura)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sesion (
+            id_sesion INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            id_serie INTEGER REFERENCES serie_terapeutica(id_serie),
+            fecha TEXT NOT NULL,
+            hora_inicio TEXT,
+            hora_fin TEXT,
+            intensidad_inicio INTEGER,
+            intensidad_final INTEGER,
+            comentario TEXT,
+            tiempo_efectivo DOUBLE PRECISION DEFAULT 0.0
+        )
+    ''')
+
+def _migracion_1(cursor):
+    """Esquema inicial: usuarios, series terapéuticas, posturas y sesiones"""
+    if backend.nombre == "postgres":
+        create_postgres_tables(cursor)
+        insert_posturas(cursor, POSTURAS_BASE)
+        insert_additional_posturas(cursor)
+        return
+    create_user_tables(cursor)
+    create_therapy_tables(cursor)
+    update_serie_table(cursor)
+    update_postura_table(cursor)
+    # Insertar posturas adicionales para los nuevos tipos de terapia
+    insert_additional_posturas(cursor)
+
+def _migracion_2(cursor):
+    """Medios de las posturas: original y variantes redimensionadas, direccionadas por contenido"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS medio_postura (
+            id_postura INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            formato TEXT NOT NULL,
+            ancho INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (id_postura, tipo, formato, ancho),
+            FOREIGN KEY (id_postura) REFERENCES postura(id_postura)
+        )
+    ''')
+
+def _migracion_3(cursor):
+    """Identificador generado por el cliente para registrar sesiones enviadas sin conexión una sola vez"""
+    cursor.execute('ALTER TABLE sesion ADD COLUMN id_cliente TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sesion_id_cliente ON sesion (id_cliente)')
+
+def _migracion_4(cursor):
+    """Plantillas de referencia para puntuar posturas y puntuación media de cada sesión"""
+    tipo_real = "DOUBLE PRECISION" if backend.nombre == "postgres" else "REAL"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referencia_postura (
+            id_postura INTEGER PRIMARY KEY REFERENCES postura(id_postura),
+            puntos TEXT NOT NULL,
+            confianza TEXT NOT NULL,
+            muestras INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(f'ALTER TABLE sesion ADD COLUMN puntuacion {tipo_real}')
+
+def _migracion_5(cursor):
+    """Tiempos medidos de cada postura en cada sesión (tiempo activo y pausas, en segundos)"""
+    if backend.nombre == "postgres":
+        # duracion_min admite fracciones (p. ej. 0.5 min) como en SQLite; el esquema portado las truncaba
+        cursor.execute('ALTER TABLE postura_en_serie ALTER COLUMN duracion_min TYPE DOUBLE PRECISION')
+        tipo_real, sin_rowid = "DOUBLE PRECISION", ""
+    else:
+        # Tabla estrecha agrupada por su clave primaria: las filas de una sesión quedan contiguas
+        tipo_real, sin_rowid = "REAL", " WITHOUT ROWID"
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sesion_postura (
+            id_sesion INTEGER NOT NULL REFERENCES sesion(id_sesion),
+            orden INTEGER NOT NULL,
+            id_postura INTEGER NOT NULL REFERENCES postura(id_postura),
+            segundos_plan {tipo_real} NOT NULL,
+            segundos_reales {tipo_real} NOT NULL,
+            segundos_pausa {tipo_real} NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_sesion, orden)
+        ){sin_rowid}
+    ''')
+    # Índice que cubre la agregación por postura: se resuelve sin leer la tabla
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sesion_postura_postura
+        ON sesion_postura (id_postura, segundos_plan, segundos_reales, segundos_pausa)
+    ''')
+    # La adherencia de una serie parte de sus sesiones
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sesion_serie ON sesion (id_serie)')
+
+# Letras acentuadas que el índice de búsqueda de PostgreSQL reduce a su forma simple
+# (en SQLite lo hace el tokenizador de FTS5 con remove_diacritics)
+_ACENTUADAS = "áàäâéèëêíìïîóòöôúùüûñçāīūṛṣṇṭḍṁḥś"
+_SIN_ACENTO = "aaaaeeeeiiiioooouuuuncaiursntdmhs"
+
+def _texto_busqueda_postgres(columna: str) -> str:
+    return f"translate(lower(coalesce({columna}, '')), '{_ACENTUADAS}', '{_SIN_ACENTO}')"
+
+def _migracion_6(cursor):
+    """Índice de búsqueda de texto completo sobre los nombres y textos de ayuda de las posturas"""
+    if backend.nombre == "postgres":
+        # Columna tsvector generada (se mantiene sola al insertar o modificar) con índice GIN;
+        # los nombres pesan más que los textos en el orden de los resultados
+        vector = " || ".join(
+            f"setweight(to_tsvector('simple', {_texto_busqueda_postgres(columna)}), '{peso}')"
+            for columna, peso in (("nombre_es", "A"), ("nombre_sans", "A"), ("instrucciones", "C"),
+                                  ("beneficios", "C"), ("precauciones", "D"))
+        )
+        cursor.execute(f'ALTER TABLE postura ADD COLUMN busqueda tsvector GENERATED ALWAYS AS ({vector}) STORED')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_postura_busqueda ON postura USING GIN (busqueda)')
+        return
+    # Las bases de datos que pasaron la migración 1 antes de que añadiera las columnas
+    # de textos no las tienen, y la tabla FTS5 las lee de postura
+    update_postura_table(cursor)
+    # Tabla FTS5 de contenido externo (no duplica los textos) con índices de prefijos
+    # de 2 y 3 letras para la búsqueda mientras se escribe
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS postura_fts USING fts5(
+            nombre_es, nombre_sans, instrucciones, beneficios, precauciones,
+            content='postura', content_rowid='id_postura',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    # Triggers que mantienen el índice sincronizado con la tabla postura
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS postura_fts_insert AFTER INSERT ON postura BEGIN
+            INSERT INTO postura_fts (rowid, nombre_es, nombre_sans, instrucciones, beneficios, precauciones)
+            VALUES (new.id_postura, new.nombre_es, new.nombre_sans, new.instrucciones, new.beneficios,
+                    new.precauciones);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS postura_fts_delete AFTER DELETE ON postura BEGIN
+            INSERT INTO postura_fts (postura_fts, rowid, nombre_es, nombre_sans, instrucciones, beneficios,
+                                     precauciones)
+            VALUES ('delete', old.id_postura, old.nombre_es, old.nombre_sans, old.instrucciones, old.beneficios,
+                    old.precauciones);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS postura_fts_update AFTER UPDATE ON postura BEGIN
+            INSERT INTO postura_fts (postura_fts, rowid, nombre_es, nombre_sans, instrucciones, beneficios,
+                                     precauciones)
+            VALUES ('delete', old.id_postura, old.nombre_es, old.nombre_sans, old.instrucciones, old.beneficios,
+                    old.precauciones);
+            INSERT INTO postura_fts (rowid, nombre_es, nombre_sans, instrucciones, beneficios, precauciones)
+            VALUES (new.id_postura, new.nombre_es, new.nombre_sans, new.instrucciones, new.beneficios,
+                    new.precauciones);
+        END
+    ''')
+    # Posturas ya existentes
+    cursor.execute("INSERT INTO postura_fts (postura_fts) VALUES ('rebuild')")
+
+def _migracion_7(cursor):
+    """Registro de eventos de invalidación de cachés entre workers (ver invalidacion.py)"""
+    id_autoincremental = ("BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY" if backend.nombre == "postgres"
+                          else "INTEGER PRIMARY KEY AUTOINCREMENT")
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS invalidacion (
+            version {id_autoincremental},
+            tema TEXT NOT NULL,
+            clave TEXT
+        )
+    ''')
+
+def _migracion_8(cursor):
+    """
+    Archivo de sesiones (ver archivo.py): las sesiones de series inactivas se mueven a
+    tablas aparte con el comentario comprimido, para que sesion y sesion_postura solo
+    contengan el historial reciente
+    """
+    if backend.nombre == "postgres":
+        tipo_real, tipo_binario, sin_rowid = "DOUBLE PRECISION", "BYTEA", ""
+    else:
+        tipo_real, tipo_binario, sin_rowid = "REAL", "BLOB", " WITHOUT ROWID"
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sesion_archivada (
+            id_sesion INTEGER PRIMARY KEY,
+            id_serie INTEGER NOT NULL REFERENCES serie_terapeutica(id_serie),
+            fecha TEXT NOT NULL,
+            hora_inicio TEXT,
+            hora_fin TEXT,
+            intensidad_inicio INTEGER,
+            intensidad_final INTEGER,
+            comentario_comprimido {tipo_binario},
+            tiempo_efectivo {tipo_real},
+            id_cliente TEXT,
+            puntuacion {tipo_real}
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sesion_archivada_serie ON sesion_archivada (id_serie)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sesion_archivada_id_cliente ON sesion_archivada (id_cliente)')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sesion_postura_archivada (
+            id_sesion INTEGER NOT NULL REFERENCES sesion_archivada(id_sesion),
+            orden INTEGER NOT NULL,
+            id_postura INTEGER NOT NULL,
+            segundos_plan {tipo_real} NOT NULL,
+            segundos_reales {tipo_real} NOT NULL,
+            segundos_pausa {tipo_real} NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_sesion, orden)
+        ){sin_rowid}
+    ''')
+
+def _migracion_9(cursor):
+    """
+    Índices en las claves ajenas que no los tenían: el borrado en cascada y la
+    comprobación de claves ajenas (PRAGMA foreign_keys) buscan por ellas
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_instructor_patients_patient ON instructor_patients (patient_id)')
+    # También sirve a la consulta de la serie activa de un paciente
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_serie_terapeutica_patient ON serie_terapeutica (patient_id, activa)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_postura_en_serie_postura ON postura_en_serie (id_postura)')
+
+def _migracion_10(cursor):
+    """Plantillas de series de cada instructor para asignar la misma secuencia a varios pacientes"""
+    if backend.nombre == "postgres":
+        id_autoincremental, tipo_real = "INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY", "DOUBLE PRECISION"
+    else:
+        id_autoincremental, tipo_real = "INTEGER PRIMARY KEY AUTOINCREMENT", "REAL"
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS plantilla_serie (
+            id_plantilla {id_autoincremental},
+            instructor_id TEXT NOT NULL REFERENCES instructors(id),
+            nombre TEXT NOT NULL,
+            tipo_terapia TEXT NOT NULL,
+            sesiones_recomendadas INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plantilla_serie_instructor ON plantilla_serie (instructor_id)')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS postura_en_plantilla (
+            id_plantilla INTEGER NOT NULL REFERENCES plantilla_serie(id_plantilla),
+            id_postura INTEGER NOT NULL REFERENCES postura(id_postura),
+            orden INTEGER NOT NULL,
+            duracion_min {tipo_real} NOT NULL,
+            PRIMARY KEY (id_plantilla, id_postura)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_postura_en_plantilla_postura ON postura_en_plantilla (id_postura)')
+
+# Migraciones del esquema en orden; la posición (empezando en 1) es la versión que alcanzan
+MIGRACIONES = [
+    _migracion_1,
+    _migracion_2,
+    _migracion_3,
+    _migracion_4,
+    _migracion_5,
+    _migracion_6,
+    _migracion_7,
+    _migracion_8,
+    _migracion_9,
+    _migracion_10,
+]
+SCHEMA_VERSION = len(MIGRACIONES)
+
+# Series activas de un paciente con su progreso (columnas en el orden de Serie)
+_SELECT_SERIES_ACTIVAS = '''
+    SELECT 
+        st.id_serie, 
+        st.nombre, 
+        st.tipo_terapia, 
+        st.sesiones_recomendadas,
+        (SELECT COUNT(*) FROM sesion s WHERE s.id_serie = st.id_serie) as sesiones_completadas,
+        CASE 
+            WHEN (SELECT COUNT(*) FROM sesion s WHERE s.id_serie = st.id_serie) >= st.sesiones_recomendadas 
+            THEN 1 
+            ELSE 0 
+        END as serie_completa
+    FROM serie_terapeutica st
+    WHERE st.patient_id = ? AND st.activa = 1
+'''
+
+@instrumentar("db")
 def get_serie_activa(patient_id):
     """Obtiene la serie terapéutica activa de un paciente"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), Serie)
     
-    serie = cursor.execute('''
-        SELECT id_serie, nombre, tipo_terapia, sesiones_recomendadas
-        FROM serie_terapeutica
-        WHERE patient_id = ? AND activa = 1
-    ''', (patient_id,)).fetchone()
+    serie = cursor.execute(_SELECT_SERIES_ACTIVAS, (patient_id,)).fetchone()
     
     conn.close()
     return serie
 
-def desactivar_series_anteriores(patient_id):
-    """Desactiva todas las series anteriores de un paciente"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
-    
+@operacion_escritura
+def _desactivar_series_anteriores(cursor, patient_id):
     cursor.execute('''
         UPDATE serie_terapeutica
         SET activa = 0
         WHERE patient_id = ?
     ''', (patient_id,))
+    publicar_invalidacion(cursor, "paciente", patient_id)
+
+@instrumentar("db")
+def desactivar_series_anteriores(patient_id):
+    """Desactiva todas las series anteriores de un paciente"""
+    ejecutar_escritura("_desactivar_series_anteriores", patient_id)
+
+@operacion_escritura
+def _create_serie_terapeutica(cursor, nombre, tipo_terapia, sesiones_recomendadas, patient_id, posturas_orden):
+    # La verificación se hace dentro de la misma transacción que la inserción
+    serie_activa = cursor.execute('''
+        SELECT 1 FROM serie_terapeutica WHERE patient_id = ? AND activa = 1
+    ''', (patient_id,)).fetchone()
+    if serie_activa:
+        raise ValueError("El paciente ya tiene una serie terapéutica activa.")
     
-    conn.commit()
-    conn.close()
+    _desactivar_series_anteriores(cursor, patient_id)
+    
+    id_serie = cursor.execute('''
+        INSERT INTO serie_terapeutica (nombre, tipo_terapia, sesiones_recomendadas, patient_id, activa)
+        VALUES (?, ?, ?, ?, 1)
+        RETURNING id_serie
+    ''', (nombre, tipo_terapia, sesiones_recomendadas, patient_id)).fetchone()[0]
+    
+    cursor.executemany('''
+        INSERT INTO postura_en_serie (id_serie, id_postura, orden, duracion_min)
+        VALUES (?, ?, ?, ?)
+    ''', [(id_serie, postura_id, orden, duracion) for postura_id, orden, duracion in posturas_orden])
+    publicar_invalidacion(cursor, "serie", id_serie)
+    
+    return id_serie
 
+@instrumentar("db")
 def create_serie_terapeutica(nombre, tipo_terapia, sesiones_recomendadas, patient_id, posturas_orden):
     """Crea una nueva serie terapéutica"""
-    serie_activa = get_serie_activa(patient_id)
-    if serie_activa:
-        raise ValueError("El paciente ya tiene una serie terapéutica activa.")
+    return ejecutar_escritura("_create_serie_terapeutica", nombre, tipo_terapia,
+                              sesiones_recomendadas, patient_id, posturas_orden)
+
+# Plantillas de series y asignación en bloque
+@operacion_escritura
+def _create_plantilla_serie(cursor, instructor_id, nombre, tipo_terapia, sesiones_recomendadas, posturas_orden):
+    ids_postura = {postura_id for postura_id, _, _ in posturas_orden}
+    if len(ids_postura) != len(posturas_orden):
+        raise ValueError("Una postura aparece más de una vez en la plantilla")
+    if ids_postura:
+        marcadores = ",".join("?" * len(ids_postura))
+        existentes = cursor.execute(f'''
+            SELECT COUNT(*) FROM postura WHERE id_postura IN ({marcadores})
+        ''', list(ids_postura)).fetchone()[0]
+        if existentes != len(ids_postura):
+            raise ValueError("Alguna postura de la plantilla no existe")
+    id_plantilla = cursor.execute('''
+        INSERT INTO plantilla_serie (instructor_id, nombre, tipo_terapia, sesiones_recomendadas)
+        VALUES (?, ?, ?, ?)
+        RETURNING id_plantilla
+    ''', (instructor_id, nombre, tipo_terapia, sesiones_recomendadas)).fetchone()[0]
+    cursor.executemany('''
+        INSERT INTO postura_en_plantilla (id_plantilla, id_postura, orden, duracion_min)
+        VALUES (?, ?, ?, ?)
+    ''', [(id_plantilla, postura_id, orden, duracion) for postura_id, orden, duracion in posturas_orden])
+    return id_plantilla
+
+@instrumentar("db")
+def create_plantilla_serie(instructor_id, nombre, tipo_terapia, sesiones_recomendadas, posturas_orden):
+    """
+    Crea una plantilla de serie del instructor.
     
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
+    Args:
+        instructor_id (str): ID del instructor dueño de la plantilla
+        nombre (str): Nombre que tendrán las series creadas con ella
+        tipo_terapia (str): Tipo de terapia
+        sesiones_recomendadas (int): Número de sesiones recomendadas
+        posturas_orden (list): Lista de (id_postura, orden, duracion)
+        
+    Returns:
+        int: ID de la plantilla creada
+        
+    Raises:
+        ValueError: Si una postura no existe o se repite
+    """
+    return ejecutar_escritura("_create_plantilla_serie", instructor_id, nombre, tipo_terapia,
+                              sesiones_recomendadas, posturas_orden)
+
+@instrumentar("db")
+def get_plantillas_instructor(instructor_id: str) -> List[PlantillaSerie]:
+    """Obtiene las plantillas de un instructor con sus posturas, en una sola consulta"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    desactivar_series_anteriores(patient_id)
+    filas = cursor.execute('''
+        SELECT ps.id_plantilla, ps.nombre, ps.tipo_terapia, ps.sesiones_recomendadas,
+               pp.id_postura, pp.orden, pp.duracion_min
+        FROM plantilla_serie ps
+        LEFT JOIN postura_en_plantilla pp ON pp.id_plantilla = ps.id_plantilla
+        WHERE ps.instructor_id = ?
+        ORDER BY ps.nombre, ps.id_plantilla, pp.orden
+    ''', (instructor_id,)).fetchall()
+    conn.close()
     
-    cursor.execute('''
-        INSERT INTO serie_terapeutica (nombre, tipo_terapia, sesiones_recomendadas, patient_id, activa)
-        VALUES (?, ?, ?, ?, 1)
-    ''', (nombre, tipo_terapia, sesiones_recomendadas, patient_id))
+    plantillas = []
+    for fila in filas:
+        if not plantillas or plantillas[-1].id_plantilla != fila[0]:
+            plantillas.append(PlantillaSerie(*fila[:4], posturas=[]))
+        if fila[4] is not None:
+            plantillas[-1].posturas.append(list(fila[4:]))
+    return plantillas
+
+@operacion_escritura
+def _delete_plantilla_serie(cursor, instructor_id, id_plantilla) -> bool:
+    propia = cursor.execute('''
+        SELECT 1 FROM plantilla_serie WHERE id_plantilla = ? AND instructor_id = ?
+    ''', (id_plantilla, instructor_id)).fetchone()
+    if not propia:
+        return False
+    cursor.execute('DELETE FROM postura_en_plantilla WHERE id_plantilla = ?', (id_plantilla,))
+    cursor.execute('DELETE FROM plantilla_serie WHERE id_plantilla = ?', (id_plantilla,))
+    return True
+
+@instrumentar("db")
+def delete_plantilla_serie(instructor_id: str, id_plantilla: int) -> bool:
+    """Elimina una plantilla del instructor (las series ya creadas con ella no cambian)"""
+    return ejecutar_escritura("_delete_plantilla_serie", instructor_id, id_plantilla)
+
+@operacion_escritura
+def _asignar_plantilla_serie(cursor, instructor_id, id_plantilla, patient_ids):
+    plantilla = cursor.execute('''
+        SELECT nombre, tipo_terapia, sesiones_recomendadas
+        FROM plantilla_serie WHERE id_plantilla = ? AND instructor_id = ?
+    ''', (id_plantilla, instructor_id)).fetchone()
+    if not plantilla:
+        return None
     
-    id_serie = cursor.lastrowid
+    # Comprobaciones en bloque dentro de la transacción: pacientes del instructor y
+    # pacientes que ya tienen una serie activa (una sola serie activa por paciente)
+    pacientes = list(dict.fromkeys(patient_ids))
+    marcadores = ",".join("?" * len(pacientes))
+    propios = {fila[0] for fila in cursor.execute(f'''
+        SELECT patient_id FROM instructor_patients
+        WHERE instructor_id = ? AND patient_id IN ({marcadores})
+    ''', (instructor_id, *pacientes)).fetchall()}
+    con_serie_activa = {fila[0] for fila in cursor.execute(f'''
+        SELECT DISTINCT patient_id FROM serie_terapeutica
+        WHERE activa = 1 AND patient_id IN ({marcadores})
+    ''', pacientes).fetchall()}
+    elegibles = [p for p in pacientes if p in propios and p not in con_serie_activa]
     
-    for postura_id, orden, duracion in posturas_orden:
-        cursor.execute('''
+    creadas = {}
+    if elegibles:
+        cursor.executemany('''
+            INSERT INTO serie_terapeutica (nombre, tipo_terapia, sesiones_recomendadas, patient_id, activa)
+            VALUES (?, ?, ?, ?, 1)
+        ''', [(*plantilla, patient_id) for patient_id in elegibles])
+        # Las series activas de los pacientes elegibles son justo las recién creadas
+        marcadores = ",".join("?" * len(elegibles))
+        creadas = dict(cursor.execute(f'''
+            SELECT patient_id, id_serie FROM serie_terapeutica
+            WHERE activa = 1 AND patient_id IN ({marcadores})
+        ''', elegibles).fetchall())
+        cursor.execute(f'''
             INSERT INTO postura_en_serie (id_serie, id_postura, orden, duracion_min)
-            VALUES (?, ?, ?, ?)
-        ''', (id_serie, postura_id, orden, duracion))
+            SELECT st.id_serie, pp.id_postura, pp.orden, pp.duracion_min
+            FROM serie_terapeutica st
+            CROSS JOIN postura_en_plantilla pp
+            WHERE pp.id_plantilla = ? AND st.activa = 1 AND st.patient_id IN ({marcadores})
+        ''', (id_plantilla, *elegibles))
+        publicar_invalidacion(cursor, "serie")
     
-    conn.commit()
-    conn.close()
-    return id_serie
+    return {
+        "creadas": creadas,
+        "con_serie_activa": [p for p in pacientes if p in propios and p in con_serie_activa],
+        "no_asignados": [p for p in pacientes if p not in propios],
+    }
+
+@instrumentar("db")
+def asignar_plantilla_serie(instructor_id: str, id_plantilla: int, patient_ids: List[str]) -> Optional[dict]:
+    """
+    Crea, en una sola transacción, una serie a partir de la plantilla para cada
+    paciente de la lista que sea del instructor y no tenga ya una serie activa.
+    
+    Args:
+        instructor_id (str): ID del instructor (dueño de la plantilla y de los pacientes)
+        id_plantilla (int): ID de la plantilla
+        patient_ids (list): IDs de los pacientes
+        
+    Returns:
+        dict: creadas (patient_id -> id_serie), con_serie_activa y no_asignados
+            (pacientes omitidos), o None si la plantilla no es del instructor
+    """
+    if not patient_ids:
+        return {"creadas": {}, "con_serie_activa": [], "no_asignados": []}
+    return ejecutar_escritura("_asignar_plantilla_serie", instructor_id, id_plantilla, patient_ids)
 
+@instrumentar("db")
+@coalescer
 def get_series_by_patient(patient_id):
     """Obtiene las series de un paciente"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), Serie)
     
-    series = cursor.execute('''
-        SELECT 
-            st.id_serie, 
-            st.nombre, 
-            st.tipo_terapia, 
-            st.sesiones_recomendadas,
-            (SELECT COUNT(*) FROM sesion s WHERE s.id_serie = st.id_serie) as sesiones_completadas,
-            CASE 
-                WHEN (SELECT COUNT(*) FROM sesion s WHERE s.id_serie = st.id_serie) >= st.sesiones_recomendadas 
-                THEN 1 
-                ELSE 0 
-            END as serie_completa
-        FROM serie_terapeutica st
-        WHERE st.patient_id = ? AND st.activa = 1
-    ''', (patient_id,)).fetchall()
+    series = cursor.execute(_SELECT_SERIES_ACTIVAS, (patient_id,)).fetchall()
     
     conn.close()
     return series
 
+@instrumentar("db")
+def get_resumen_series_instructor(instructor_id: str,
+                                  patient_ids: Optional[List[str]] = None) -> List[ResumenPaciente]:
+    """
+    Vista general de los pacientes de un instructor en una sola consulta: sus series
+    activas con el progreso y un resumen de la última sesión de cada una.
+    
+    Args:
+        instructor_id (str): ID del instructor
+        patient_ids (list, optional): Limitar a estos pacientes (los que no sean del
+            instructor se ignoran); None para todos sus pacientes
+        
+    Returns:
+        list: Pacientes (ResumenPaciente) ordenados por apellido y nombre, cada uno con sus series
+    """
+    filtro, parametros = "", [instructor_id]
+    if patient_ids is not None:
+        if not patient_ids:
+            return []
+        filtro = f"AND ip.patient_id IN ({','.join('?' * len(patient_ids))})"
+        parametros += patient_ids
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Las sesiones de cada serie se numeran de la más reciente a la más antigua: la
+    # número 1 aporta el resumen y el conteo por partición el progreso. sesiones se
+    # materializa para que la ventana se calcule una sola vez aunque el planificador
+    # subestime el número de series
+    filas = cursor.execute(f'''
+        WITH pacientes AS (
+            SELECT ip.patient_id
+            FROM instructor_patients ip
+            WHERE ip.instructor_id = ? {filtro}
+        ),
+        series AS (
+            SELECT st.id_serie, st.patient_id, st.nombre, st.tipo_terapia, st.sesiones_recomendadas
+            FROM serie_terapeutica st
+            JOIN pacientes pa ON pa.patient_id = st.patient_id
+            WHERE st.activa = 1
+        ),
+        sesiones AS MATERIALIZED (
+            SELECT s.id_serie, s.fecha, s.intensidad_inicio, s.intensidad_final, s.puntuacion,
+                   COUNT(*) OVER (PARTITION BY s.id_serie) AS completadas,
+                   ROW_NUMBER() OVER (PARTITION BY s.id_serie
+                                      ORDER BY s.fecha DESC, s.hora_inicio DESC, s.id_sesion DESC) AS reciente
+            FROM sesion s
+            JOIN series se ON se.id_serie = s.id_serie
+        )
+        SELECT p.id, p.first_name, p.last_name,
+               se.id_serie, se.nombre, se.tipo_terapia, se.sesiones_recomendadas,
+               COALESCE(ss.completadas, 0),
+               CASE WHEN COALESCE(ss.completadas, 0) >= se.sesiones_recomendadas THEN 1 ELSE 0 END,
+               ss.fecha, ss.intensidad_inicio, ss.intensidad_final, ss.puntuacion
+        FROM pacientes pa
+        JOIN patients p ON p.id = pa.patient_id
+        LEFT JOIN series se ON se.patient_id = p.id
+        LEFT JOIN sesiones ss ON ss.id_serie = se.id_serie AND ss.reciente = 1
+        ORDER BY p.last_name, p.first_name, p.id, se.id_serie
+    ''', parametros).fetchall()
+    conn.close()
+    
+    resumen = []
+    for fila in filas:
+        if not resumen or resumen[-1].id != fila[0]:
+            resumen.append(ResumenPaciente(*fila[:3]))
+        if fila[3] is not None:
+            resumen[-1].series.append(ResumenSerie(*fila[3:]))
+    return resumen
+
+@instrumentar("db")
+@coalescer
 def get_posturas_by_serie(id_serie):
     """Obtiene las posturas de una serie"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), SeriePostura)
     
     posturas = cursor.execute('''
-        SELECT p.id_postura, p.nombre_es, p.nombre_sans, pes.orden, pes.duracion_min
+        SELECT p.id_postura, p.nombre_es, p.nombre_sans, pes.orden, pes.duracion_min,
+               p.instrucciones, p.beneficios, p.precauciones
         FROM postura p
         JOIN postura_en_serie pes ON p.id_postura = pes.id_postura
         WHERE pes.id_serie = ?
@@ -492,9 +1318,10 @@ def get_posturas_by_serie(id_serie):
     conn.close()
     return posturas
 
+@instrumentar("db")
 def get_tiempo_efectivo_serie(id_serie):
     """Calcula el tiempo efectivo de una serie"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     tiempo_total = cursor.execute('''
@@ -506,68 +1333,404 @@ def get_tiempo_efectivo_serie(id_serie):
     conn.close()
     return tiempo_total
 
-def create_sesion(id_serie, fecha, hora_inicio, hora_fin, intensidad_inicio, intensidad_final, comentario):
-    """Crea un registro de sesión"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+@operacion_escritura
+def _create_sesion(cursor, id_serie, fecha, hora_inicio, hora_fin, intensidad_inicio, intensidad_final, comentario,
+                   id_cliente=None, puntuacion=None, tiempos_posturas=None):
+    # Una sesión reenviada desde la cola sin conexión ya registrada no se duplica: las
+    # archivadas se comprueban aquí y las de sesion con ON CONFLICT en el INSERT (dos
+    # reenvíos simultáneos no pasan los dos una comprobación previa en PostgreSQL)
+    if id_cliente is not None:
+        if cursor.execute('SELECT 1 FROM sesion_archivada WHERE id_cliente = ?', (id_cliente,)).fetchone():
+            return False
     
-    try:
-        tiempo_efectivo = get_tiempo_efectivo_serie(id_serie)
-        
-        cursor.execute('''
-            INSERT INTO sesion (
-                id_serie, fecha, hora_inicio, hora_fin,
-                intensidad_inicio, intensidad_final, comentario,
-                tiempo_efectivo
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (id_serie, fecha.strftime('%Y-%m-%d'), hora_inicio, hora_fin, 
-              intensidad_inicio, intensidad_final, comentario, tiempo_efectivo))
-        
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    duraciones = dict(cursor.execute('''
+        SELECT id_postura, duracion_min
+        FROM postura_en_serie
+        WHERE id_serie = ?
+    ''', (id_serie,)).fetchall())
+    
+    if tiempos_posturas:
+        ajenas = {id_postura for id_postura, _, _ in tiempos_posturas} - duraciones.keys()
+        if ajenas:
+            raise ValueError(f"Las posturas {sorted(ajenas)} no pertenecen a la serie {id_serie}.")
+        # Tiempo activo medido (sin pausas), en minutos como el planificado
+        tiempo_efectivo = sum(segundos for _, segundos, _ in tiempos_posturas) / 60
+    else:
+        tiempo_efectivo = sum(duraciones.values())
+    
+    insertada = cursor.execute('''
+        INSERT INTO sesion (
+            id_serie, fecha, hora_inicio, hora_fin,
+            intensidad_inicio, intensidad_final, comentario,
+            tiempo_efectivo, id_cliente, puntuacion
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id_cliente) DO NOTHING
+        RETURNING id_sesion
+    ''', (id_serie, fecha.strftime('%Y-%m-%d'), hora_inicio, hora_fin, 
+          intensidad_inicio, intensidad_final, comentario, tiempo_efectivo, id_cliente, puntuacion)).fetchone()
+    if insertada is None:
+        return False
+    id_sesion = insertada[0]
+    
+    if tiempos_posturas:
+        cursor.executemany('''
+            INSERT INTO sesion_postura (id_sesion, orden, id_postura, segundos_plan, segundos_reales, segundos_pausa)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(id_sesion, orden, id_postura, duraciones[id_postura] * 60, segundos, pausa)
+              for orden, (id_postura, segundos, pausa) in enumerate(tiempos_posturas, start=1)])
+    publicar_invalidacion(cursor, "sesion", id_serie)
+    return True
 
-def get_sesiones_by_serie(id_serie):
-    """Obtiene las sesiones de una serie"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
+@instrumentar("db")
+def create_sesion(id_serie, fecha, hora_inicio, hora_fin, intensidad_inicio, intensidad_final, comentario,
+                  id_cliente=None, puntuacion=None, tiempos_posturas=None):
+    """
+    Crea un registro de sesión. Devuelve False si ya existía una sesión con el mismo id_cliente.
+    puntuacion es la media (0-100) de las puntuaciones de postura obtenidas en la sesión.
+    tiempos_posturas es la lista, en el orden realizado, de (id_postura, segundos_reales,
+    segundos_pausa) medidos en el navegador; con ella tiempo_efectivo pasa a ser el tiempo
+    activo medido en lugar del planificado. Lanza ValueError si alguna postura no es de la serie.
+    """
+    return ejecutar_escritura("_create_sesion", id_serie, fecha, hora_inicio, hora_fin,
+                              intensidad_inicio, intensidad_final, comentario,
+                              id_cliente=id_cliente, puntuacion=puntuacion,
+                              tiempos_posturas=tiempos_posturas)
+
+@instrumentar("db")
+@coalescer
+def get_sesiones_by_serie(id_serie, incluir_archivo: bool = False):
+    """
+    Obtiene las sesiones de una serie. Con incluir_archivo añade las sesiones
+    archivadas (series inactivas, ver archivo.py) con su comentario descomprimido.
+    """
+    conn = get_connection()
+    # El historial de sesiones puede ser largo: en PostgreSQL se lee con un cursor del servidor
+    cursor = backend.con_registro(backend.cursor_lectura_grande(conn), Sesion)
     
     sesiones = cursor.execute('''
         SELECT id_sesion, fecha, hora_inicio, hora_fin, 
                intensidad_inicio, intensidad_final, comentario,
-               tiempo_efectivo
+               tiempo_efectivo, puntuacion
         FROM sesion
         WHERE id_serie = ?
         ORDER BY fecha, hora_inicio
     ''', (id_serie,)).fetchall()
     
-    columns = ['id_sesion', 'fecha', 'hora_inicio', 'hora_fin', 
-              'intensidad_inicio', 'intensidad_final', 'comentario',
-              'tiempo_efectivo']
-    result = [dict(zip(columns, sesion)) for sesion in sesiones]
+    if incluir_archivo:
+        cursor = backend.con_registro(backend.cursor_lectura_grande(conn), Sesion)
+        archivadas = cursor.execute('''
+            SELECT id_sesion, fecha, hora_inicio, hora_fin,
+                   intensidad_inicio, intensidad_final, comentario_comprimido,
+                   tiempo_efectivo, puntuacion
+            FROM sesion_archivada
+            WHERE id_serie = ?
+            ORDER BY fecha, hora_inicio
+        ''', (id_serie,)).fetchall()
+        for sesion in archivadas:
+            sesion.comentario = descomprimir_texto(sesion.comentario)
+        if archivadas:
+            # Una serie archivada puede recibir después alguna sesión (envíos sin conexión)
+            sesiones = archivadas + sesiones if not sesiones else sorted(
+                archivadas + sesiones, key=lambda s: (str(s.fecha), str(s.hora_inicio or "")))
+    
+    conn.close()
+    return sesiones
+
+def comprimir_texto(texto: Optional[str]) -> Optional[bytes]:
+    """Comprime un texto libre para las tablas de archivo (None se mantiene)"""
+    return None if texto is None else zlib.compress(texto.encode("utf-8"), 9)
+
+def descomprimir_texto(datos) -> Optional[str]:
+    """Inversa de comprimir_texto"""
+    return None if datos is None else zlib.decompress(bytes(datos)).decode("utf-8")
+
+# Tablas de sesiones con o sin las archivadas (columnas comunes de las consultas de resultados)
+_SESIONES_CON_ARCHIVO = '''(
+    SELECT id_sesion, id_serie, intensidad_inicio, intensidad_final FROM sesion
+    UNION ALL
+    SELECT id_sesion, id_serie, intensidad_inicio, intensidad_final FROM sesion_archivada
+)'''
+_SESION_POSTURA_CON_ARCHIVO = '''(
+    SELECT id_sesion, id_postura, segundos_plan, segundos_reales, segundos_pausa FROM sesion_postura
+    UNION ALL
+    SELECT id_sesion, id_postura, segundos_plan, segundos_reales, segundos_pausa FROM sesion_postura_archivada
+)'''
+
+@instrumentar("db")
+def get_adherencia_posturas(id_serie: Optional[int] = None,
+                            incluir_archivo: bool = False) -> List[AdherenciaPostura]:
+    """
+    Tiempo planificado frente a tiempo medido de cada postura, agregado sobre las
+    sesiones de una serie o, sin id_serie, sobre todo el historial. Solo cuentan
+    las sesiones que registraron sus tiempos por postura. Con incluir_archivo
+    cuentan también las sesiones archivadas.
+    """
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), AdherenciaPostura)
+    
+    sesiones, tiempos = (_SESIONES_CON_ARCHIVO, _SESION_POSTURA_CON_ARCHIVO) if incluir_archivo else (
+        "sesion", "sesion_postura")
+    filtro, parametros = "", ()
+    if id_serie is not None:
+        filtro, parametros = f"JOIN {sesiones} s ON s.id_sesion = sp.id_sesion WHERE s.id_serie = ?", (id_serie,)
+    adherencia = cursor.execute(f'''
+        SELECT sp.id_postura, p.nombre_es, COUNT(*),
+               AVG(sp.segundos_plan), AVG(sp.segundos_reales), AVG(sp.segundos_pausa),
+               SUM(sp.segundos_reales) / NULLIF(SUM(sp.segundos_plan), 0)
+        FROM {tiempos} sp
+        JOIN postura p ON p.id_postura = sp.id_postura
+        {filtro}
+        GROUP BY sp.id_postura, p.nombre_es
+        ORDER BY sp.id_postura
+    ''', parametros).fetchall()
+    
+    conn.close()
+    return adherencia
+
+@instrumentar("db")
+def get_resultados_sesiones(desde_id_sesion: int = 0, incluir_archivo: bool = False) -> list:
+    """
+    Resultado de las sesiones posteriores a desde_id_sesion, una fila por postura de
+    su serie: (id_sesion, tipo_terapia, mejora, id_postura, minutos). mejora es la
+    bajada de intensidad entre el inicio y el final de la sesión; minutos es el
+    tiempo medido de la postura si la sesión lo registró y, si no, el planificado.
+    Las filas van ordenadas por id_sesion. Con incluir_archivo cuentan también las
+    sesiones archivadas (sus id_sesion se conservan al archivarlas).
+    """
+    conn = get_connection()
+    cursor = backend.cursor_lectura_grande(conn)
+    
+    sesiones, tiempos = (_SESIONES_CON_ARCHIVO, _SESION_POSTURA_CON_ARCHIVO) if incluir_archivo else (
+        "sesion", "sesion_postura")
+    filas = cursor.execute(f'''
+        SELECT s.id_sesion, st.tipo_terapia, s.intensidad_inicio - s.intensidad_final,
+               pes.id_postura, COALESCE(sp.segundos_reales / 60.0, pes.duracion_min)
+        FROM {sesiones} s
+        JOIN serie_terapeutica st ON st.id_serie = s.id_serie
+        JOIN postura_en_serie pes ON pes.id_serie = s.id_serie
+        LEFT JOIN {tiempos} sp ON sp.id_sesion = s.id_sesion AND sp.id_postura = pes.id_postura
+        WHERE s.id_sesion > ?
+          AND s.intensidad_inicio IS NOT NULL AND s.intensidad_final IS NOT NULL
+        ORDER BY s.id_sesion
+    ''', (desde_id_sesion,)).fetchall()
+    
+    conn.close()
+    return filas
+
+# Archivo de sesiones (el trabajo periódico que las invoca está en archivo.py)
+_COLUMNAS_SESION_ARCHIVO = ("id_sesion, id_serie, fecha, hora_inicio, hora_fin, intensidad_inicio, "
+                            "intensidad_final, {comentario}, tiempo_efectivo, id_cliente, puntuacion")
+_COLUMNAS_SESION_POSTURA = "id_sesion, orden, id_postura, segundos_plan, segundos_reales, segundos_pausa"
+
+@operacion_escritura
+def _archivar_sesiones(cursor, fecha_limite: str, max_sesiones: int) -> int:
+    # Series inactivas cuya última sesión es anterior a fecha_limite; se mueven enteras
+    candidatas = cursor.execute('''
+        SELECT s.id_serie, COUNT(*)
+        FROM sesion s
+        JOIN serie_terapeutica st ON st.id_serie = s.id_serie
+        WHERE st.activa = 0
+        GROUP BY s.id_serie
+        HAVING MAX(s.fecha) < ?
+        ORDER BY s.id_serie
+    ''', (fecha_limite,)).fetchall()
+    series, total = [], 0
+    for id_serie, sesiones in candidatas:
+        if series and total + sesiones > max_sesiones:
+            break
+        series.append(id_serie)
+        total += sesiones
+    if not series:
+        return 0
+    
+    marcadores = ",".join("?" * len(series))
+    filas = cursor.execute(f'''
+        SELECT {_COLUMNAS_SESION_ARCHIVO.format(comentario="comentario")}
+        FROM sesion WHERE id_serie IN ({marcadores})
+    ''', series).fetchall()
+    cursor.executemany(f'''
+        INSERT INTO sesion_archivada ({_COLUMNAS_SESION_ARCHIVO.format(comentario="comentario_comprimido")})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(*fila[:7], comprimir_texto(fila[7]), *fila[8:]) for fila in filas])
+    sesiones_serie = f"SELECT id_sesion FROM sesion WHERE id_serie IN ({marcadores})"
+    cursor.execute(f'''
+        INSERT INTO sesion_postura_archivada ({_COLUMNAS_SESION_POSTURA})
+        SELECT {_COLUMNAS_SESION_POSTURA} FROM sesion_postura WHERE id_sesion IN ({sesiones_serie})
+    ''', series)
+    cursor.execute(f'DELETE FROM sesion_postura WHERE id_sesion IN ({sesiones_serie})', series)
+    cursor.execute(f'DELETE FROM sesion WHERE id_serie IN ({marcadores})', series)
+    return len(filas)
+
+@instrumentar("db")
+def archivar_sesiones(fecha_limite: str, max_sesiones: int) -> int:
+    """
+    Mueve a las tablas de archivo, en una transacción, las sesiones de series
+    inactivas sin sesiones desde fecha_limite (series completas, hasta unas
+    max_sesiones sesiones). Los id_sesion se conservan.
     
+    Args:
+        fecha_limite (str): Fecha (AAAA-MM-DD) de la última sesión a partir de la cual no se archiva
+        max_sesiones (int): Tamaño del lote (se supera solo si una serie sola es mayor)
+        
+    Returns:
+        int: Sesiones archivadas (0 si no queda nada por archivar)
+    """
+    return ejecutar_escritura("_archivar_sesiones", fecha_limite, max_sesiones)
+
+@operacion_escritura
+def _compactar(cursor, max_paginas: int) -> int:
+    libres = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    # Cada paso de la sentencia devuelve una página, y el módulo sqlite3 solo da un paso por execute
+    for _ in range(min(libres, max_paginas)):
+        cursor.execute('PRAGMA incremental_vacuum(1)')
+    return cursor.execute('PRAGMA freelist_count').fetchone()[0]
+
+@instrumentar("db")
+def compactar(max_paginas: int) -> int:
+    """
+    Devuelve al sistema hasta max_paginas páginas libres del archivo SQLite
+    (requiere auto_vacuum = INCREMENTAL). En PostgreSQL no hace nada (autovacuum).
+    
+    Returns:
+        int: Páginas libres que quedan
+    """
+    if backend.nombre != "sqlite":
+        return 0
+    return ejecutar_escritura("_compactar", max_paginas)
+
+@instrumentar("db")
+def get_estado_archivo() -> dict:
+    """Filas en las tablas de sesiones y de archivo y, en SQLite, páginas del archivo"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    estado = {tabla: cursor.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+              for tabla in ("sesion", "sesion_postura", "sesion_archivada", "sesion_postura_archivada")}
+    if backend.nombre == "sqlite":
+        for pragma in ("page_count", "freelist_count", "auto_vacuum"):
+            estado[pragma] = cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
     conn.close()
-    return result
+    return estado
 
+@operacion_escritura
+def _delete_serie(cursor, id_serie):
+    cursor.execute('''
+        DELETE FROM sesion_postura_archivada
+        WHERE id_sesion IN (SELECT id_sesion FROM sesion_archivada WHERE id_serie = ?)
+    ''', (id_serie,))
+    cursor.execute('DELETE FROM sesion_archivada WHERE id_serie = ?', (id_serie,))
+    cursor.execute('''
+        DELETE FROM sesion_postura
+        WHERE id_sesion IN (SELECT id_sesion FROM sesion WHERE id_serie = ?)
+    ''', (id_serie,))
+    cursor.execute('DELETE FROM sesion WHERE id_serie = ?', (id_serie,))
+    cursor.execute('DELETE FROM postura_en_serie WHERE id_serie = ?', (id_serie,))
+    cursor.execute('DELETE FROM serie_terapeutica WHERE id_serie = ?', (id_serie,))
+    publicar_invalidacion(cursor, "serie", id_serie)
+
+@instrumentar("db")
 def delete_serie(id_serie):
     """Elimina una serie y sus registros relacionados"""
-    conn = sqlite3.connect('proyecto/instructor_patients.db')
-    cursor = conn.cursor()
-    success = False
-    
     try:
-        cursor.execute('BEGIN TRANSACTION')
-        cursor.execute('DELETE FROM sesion WHERE id_serie = ?', (id_serie,))
-        cursor.execute('DELETE FROM postura_en_serie WHERE id_serie = ?', (id_serie,))
-        cursor.execute('DELETE FROM serie_terapeutica WHERE id_serie = ?', (id_serie,))
-        conn.commit()
-        success = True
-    except Exception as e:
-        conn.rollback()
-        print("Error al eliminar serie:", str(e))
-    finally:
-        conn.close()
-        return success 
\ No newline at end of file
+        ejecutar_escritura("_delete_serie", id_serie)
+        return True
+    except Exception:
+        logger.exception("Error al eliminar serie %s", id_serie)
+        return False
+
+# Funciones para los medios (fotografías y videos) de las posturas
+@operacion_escritura
+def _reemplazar_medios_postura(cursor, id_postura, tipo, medios):
+    existe = cursor.execute('SELECT 1 FROM postura WHERE id_postura = ?', (id_postura,)).fetchone()
+    if not existe:
+        raise ValueError(f"La postura {id_postura} no existe.")
+    
+    cursor.execute('DELETE FROM medio_postura WHERE id_postura = ? AND tipo = ?', (id_postura, tipo))
+    cursor.executemany('''
+        INSERT INTO medio_postura (id_postura, tipo, formato, ancho, hash, mime, bytes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(id_postura, tipo, m.formato, m.ancho, m.hash, m.mime, m.bytes) for m in medios])
+    
+    # La columna de la postura apunta al archivo original (ancho 0)
+    original = next((m.hash for m in medios if m.ancho == 0), None)
+    columna = "fotografia" if tipo == "foto" else "video"
+    cursor.execute(f'UPDATE postura SET {columna} = ? WHERE id_postura = ?', (original, id_postura))
+    publicar_invalidacion(cursor, "postura", id_postura)
+
+@instrumentar("db")
+def reemplazar_medios_postura(id_postura: int, tipo: str, medios: List[MedioPostura]):
+    """
+    Sustituye los medios de un tipo ("foto" o "video") de una postura.
+    
+    Args:
+        id_postura (int): ID de la postura
+        tipo (str): "foto" o "video"
+        medios (List[MedioPostura]): Original (ancho 0) y variantes generadas
+    """
+    ejecutar_escritura("_reemplazar_medios_postura", id_postura, tipo, medios)
+
+@instrumentar("db")
+def get_medios_posturas(ids_postura) -> List[MedioPostura]:
+    """Obtiene los medios de varias posturas, ordenados por postura, tipo y ancho"""
+    ids_postura = list(ids_postura)
+    if not ids_postura:
+        return []
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), MedioPostura)
+    
+    medios = cursor.execute(f'''
+        SELECT {MedioPostura.columnas()}
+        FROM medio_postura
+        WHERE id_postura IN ({','.join('?' * len(ids_postura))})
+        ORDER BY id_postura, tipo, formato, ancho
+    ''', ids_postura).fetchall()
+    
+    conn.close()
+    return medios
+
+@instrumentar("db")
+def existe_postura(id_postura: int) -> bool:
+    """Indica si la postura está en el catálogo"""
+    conn = get_connection()
+    existe = conn.cursor().execute('SELECT 1 FROM postura WHERE id_postura = ?', (id_postura,)).fetchone()
+    conn.close()
+    return existe is not None
+
+# Funciones para las plantillas de referencia con las que se puntúan las posturas
+@operacion_escritura
+def _guardar_referencia_postura(cursor, id_postura, puntos, confianza, muestras):
+    existe = cursor.execute('SELECT 1 FROM postura WHERE id_postura = ?', (id_postura,)).fetchone()
+    if not existe:
+        raise ValueError(f"La postura {id_postura} no existe.")
+    
+    cursor.execute('DELETE FROM referencia_postura WHERE id_postura = ?', (id_postura,))
+    cursor.execute('''
+        INSERT INTO referencia_postura (id_postura, puntos, confianza, muestras)
+        VALUES (?, ?, ?, ?)
+    ''', (id_postura, puntos, confianza, muestras))
+    publicar_invalidacion(cursor, "postura", id_postura)
+
+@instrumentar("db")
+def guardar_referencia_postura(referencia: ReferenciaPostura):
+    """
+    Guarda (o sustituye) la plantilla de referencia de una postura.
+    
+    Args:
+        referencia (ReferenciaPostura): Plantilla normalizada y fiabilidad de sus articulaciones
+    """
+    ejecutar_escritura("_guardar_referencia_postura", referencia.id_postura, referencia.puntos,
+                       referencia.confianza, referencia.muestras)
+
+@instrumentar("db")
+def get_referencia_postura(id_postura: int) -> Optional[ReferenciaPostura]:
+    """Obtiene la plantilla de referencia de una postura, o None si no tiene"""
+    conn = get_connection()
+    cursor = backend.con_registro(conn.cursor(), ReferenciaPostura)
+    
+    referencia = cursor.execute(f'''
+        SELECT {ReferenciaPostura.columnas()}
+        FROM referencia_postura
+        WHERE id_postura = ?
+    ''', (id_postura,)).fetchone()
+    
+    conn.close()
+    return referencia
@@ -0,0 +1,236 @@
+"""
+Proceso escritor dedicado para el modo de despliegue multiproceso.
+
+Con varios workers de uvicorn, las escrituras concurrentes sobre el mismo archivo
+SQLite compiten por el bloqueo y terminan en errores "database is locked". En este
+modo un único proceso posee la conexión de escritura:
+
+1. Los workers envían cada operación de escritura registrada en database.py
+   (OPERACIONES_ESCRITURA) por un socket Unix local.
+2. El escritor agrupa las operaciones que llegan casi a la vez en una sola
+   transacción (group commit); cada operación va en su propio SAVEPOINT, de modo
+   que un error solo revierte esa operación.
+3. Las lecturas se quedan en los workers, con conexiones de solo lectura sobre WAL.
+
+El escritor ejecuta cualquier operación registrada que le pidan, así que la
+conexión se autentica con una clave secreta de cada despliegue, compartida por
+el escritor y los workers (THERAPOSE_DB_WRITER_AUTHKEY); sin ella no arrancan.
+
+Despliegue:
+    export THERAPOSE_DB_WRITER_SOCKET=/tmp/therapose-escritor.sock
+    export THERAPOSE_DB_WRITER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    python -m proyecto.src.escritor &
+    uvicorn proyecto.src.main:app --workers 4
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+# Clave secreta compartida entre workers y escritor para autenticar la conexión IPC
+AUTHKEY = os.getenv("THERAPOSE_DB_WRITER_AUTHKEY", "").encode()
+# Máximo de operaciones por transacción y ventana de espera para agruparlas
+MAX_LOTE = int(os.getenv("THERAPOSE_DB_WRITER_MAX_BATCH", "64"))
+VENTANA_LOTE_S = float(os.getenv("THERAPOSE_DB_WRITER_WINDOW_MS", "2")) / 1000
+
+
+def _comprobar_clave():
+    if not AUTHKEY:
+        raise RuntimeError("Defina THERAPOSE_DB_WRITER_AUTHKEY con una clave secreta compartida por el "
+                           "escritor y los workers")
+
+
+class ClienteEscritor:
+    """
+    Cliente del proceso escritor usado por los workers. Mantiene una conexión
+    por hilo, ya que los endpoints síncronos se ejecutan en el threadpool.
+    """
+
+    def __init__(self, direccion: str):
+        _comprobar_clave()
+        self.direccion = direccion
+        self._local = threading.local()
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = Client(self.direccion, family="AF_UNIX", authkey=AUTHKEY)
+            self._local.conexion = conexion
+        return conexion
+
+    def _descartar_conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        self._local.conexion = None
+        if conexion is not None:
+            try:
+                conexion.close()
+            except OSError:
+                pass
+
+    def ejecutar(self, operacion: str, args: tuple, kwargs: dict):
+        """
+        Envía la operación al escritor y espera a que su transacción se confirme.
+        Las excepciones de la operación se relanzan en el worker.
+        """
+        try:
+            conexion = self._conexion()
+            conexion.send((operacion, args, kwargs))
+        except (OSError, EOFError):
+            # El escritor pudo reiniciarse: reconectar una vez (la petición aún no se envió)
+            self._descartar_conexion()
+            conexion = self._conexion()
+            conexion.send((operacion, args, kwargs))
+        try:
+            ok, valor = conexion.recv()
+        except (OSError, EOFError):
+            self._descartar_conexion()
+            raise
+        if not ok:
+            raise valor
+        return valor
+
+
+class PeticionEscritura:
+    """
+    Operación pendiente en la cola del escritor, con su resultado.
+    """
+    __slots__ = ("operacion", "args", "kwargs", "ok", "valor", "hecho")
+
+    def __init__(self, operacion, args, kwargs):
+        self.operacion = operacion
+        self.args = args
+        self.kwargs = kwargs
+        self.ok = False
+        self.valor = None
+        self.hecho = threading.Event()
+
+    def resolver(self, ok: bool, valor):
+        self.ok = ok
+        self.valor = valor
+        self.hecho.set()
+
+
+class Escritor:
+    """
+    Hilo único que aplica las operaciones en lotes con group commit.
+    """
+
+    def __init__(self, db_path: str, operaciones: dict):
+        self.operaciones = operaciones
+        self.cola = queue.Queue()
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Con WAL, synchronous=NORMAL sigue siendo seguro ante caídas del proceso
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+
+    def enviar(self, peticion: PeticionEscritura):
+        self.cola.put(peticion)
+
+    def _tomar_lote(self) -> list:
+        lote = [self.cola.get()]
+        limite = time.monotonic() + VENTANA_LOTE_S
+        while len(lote) < MAX_LOTE:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _aplicar_lote(self, lote: list):
+        cursor = self.conn.cursor()
+        resultados = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for peticion in lote:
+                cursor.execute("SAVEPOINT operacion")
+                try:
+                    funcion = self.operaciones[peticion.operacion]
+                    valor = funcion(cursor, *peticion.args, **peticion.kwargs)
+                    cursor.execute("RELEASE operacion")
+                    resultados.append((peticion, True, valor))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO operacion")
+                    cursor.execute("RELEASE operacion")
+                    resultados.append((peticion, False, e))
+            cursor.execute("COMMIT")
+        except Exception as e:
+            # Falló la transacción completa: ninguna operación del lote quedó aplicada
+            logger.exception("Error confirmando un lote de %d escrituras", len(lote))
+            if self.conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            resultados = [(peticion, False, e) for peticion in lote]
+        finally:
+            cursor.close()
+
+        for peticion, ok, valor in resultados:
+            peticion.resolver(ok, valor)
+
+    def bucle(self):
+        while True:
+            self._aplicar_lote(self._tomar_lote())
+
+
+def _atender_cliente(conexion, escritor: Escritor):
+    """
+    Atiende a un worker: recibe operaciones, las encola y devuelve su resultado.
+    """
+    with conexion:
+        while True:
+            try:
+                operacion, args, kwargs = conexion.recv()
+            except (EOFError, OSError):
+                return
+            peticion = PeticionEscritura(operacion, args, kwargs)
+            if operacion not in escritor.operaciones:
+                peticion.resolver(False, ValueError(f"Operación de escritura desconocida: {operacion}"))
+            else:
+                escritor.enviar(peticion)
+            peticion.hecho.wait()
+            try:
+                conexion.send((peticion.ok, peticion.valor))
+            except Exception as e:
+                # El resultado o la excepción no se pudieron serializar
+                conexion.send((False, RuntimeError(str(peticion.valor) if not peticion.ok else str(e))))
+
+
+def servir(direccion: str):
+    """
+    Inicializa el esquema, arranca el hilo de commits y acepta conexiones de los workers.
+    """
+    _comprobar_clave()
+    from . import database
+
+    database.init_db()
+    escritor = Escritor(database.DB_PATH, database.OPERACIONES_ESCRITURA)
+    threading.Thread(target=escritor.bucle, name="escritor-sqlite", daemon=True).start()
+
+    if os.path.exists(direccion):
+        os.unlink(direccion)
+    with Listener(direccion, family="AF_UNIX", authkey=AUTHKEY) as listener:
+        os.chmod(direccion, 0o600)
+        logger.info("Escritor SQLite escuchando en %s (lote máx. %d)", direccion, MAX_LOTE)
+        while True:
+            try:
+                conexion = listener.accept()
+            except Exception:
+                logger.exception("Conexión rechazada")
+                continue
+            threading.Thread(target=_atender_cliente, args=(conexion, escritor), daemon=True).start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    direccion = os.getenv("THERAPOSE_DB_WRITER_SOCKET")
+    if not direccion:
+        raise SystemExit("Defina THERAPOSE_DB_WRITER_SOCKET con la ruta del socket Unix")
+    try:
+        servir(direccion)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
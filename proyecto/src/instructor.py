@@ -1,18 +1,19 @@
 # Importaciones necesarias para el módulo de funcionalidades del instructor
 from fastapi import APIRouter, Request, Form, status, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from .auth import get_user_info_from_token  # Función para validar autenticación
 from .database import add_patient_to_instructor, get_instructor_patients, add_instructor, add_patient, update_patient, get_patient, delete_patient  # Operaciones de base de datos
 from .admin import keycloak_admin_call, refresh_keycloak_admin_token  # Funciones de administración de Keycloak
-from keycloak_config import keycloak_admin  # Configuración de Keycloak
+from .admision import admitir, liberar  # Límites de intentos y cupo de operaciones de identidad
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada  # Instrumentación de tiempos
 import sqlite3
 import datetime
 
 # Configuración del router para las rutas del instructor
-router = APIRouter()
+router = APIRouter(route_class=RutaInstrumentada)
 # Configuración de plantillas para renderizar páginas HTML
-templates = Jinja2Templates(directory="proyecto/templates")
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
 
 # Página de registro para instructores - Vista GET
 @router.get("/register-instructor", response_class=HTMLResponse)
@@ -31,6 +32,7 @@ def register_instructor_page(request: Request):
 # Proceso de registro de instructores - Vista POST
 @router.post("/register-instructor")
 def register_instructor(
+    request: Request,
     username: str = Form(...),
     email: str = Form(...),
     firstName: str = Form(...),
@@ -44,6 +46,7 @@ def register_instructor(
     Procesa el registro de un nuevo instructor en Keycloak y base de datos.
     
     Args:
+        request (Request): Objeto de petición HTTP
         username (str): Nombre de usuario único
         email (str): Correo electrónico del instructor
         firstName (str): Nombre del instructor
@@ -55,8 +58,14 @@ def register_instructor(
         
     Returns:
         RedirectResponse: Redirección al login si es exitoso
-        TemplateResponse: Página de registro con error si falla
+        TemplateResponse: Página de registro con error si falla (429/503 si se superó
+        el límite de registros o el servidor está saturado)
     """
+    # Límite de registros por IP y cupo global de operaciones de identidad
+    rechazo = admitir("registro", request)
+    if rechazo:
+        return templates.TemplateResponse("register_instructor.html", {"request": request, "error": rechazo.mensaje},
+                                          status_code=rechazo.status_code, headers=rechazo.cabeceras())
     try:
         # Configurar payload para crear usuario en Keycloak
         payload = {
@@ -106,6 +115,8 @@ def register_instructor(
         elif "User exists with same username" in error_message:
             error_message = "El nombre de usuario ya está en uso. Por favor, elige otro nombre de usuario."
         return templates.TemplateResponse("register_instructor.html", {"request": {}, "error": error_message})
+    finally:
+        liberar()
 
 # Dashboard principal del instructor
 @router.get("/instructor/dashboard", response_class=HTMLResponse)
@@ -162,12 +173,19 @@ def create_patient(request: Request,
         
     Returns:
         RedirectResponse: Redirección al dashboard si es exitoso
-        TemplateResponse: Dashboard con error si falla
+        TemplateResponse: Dashboard con error si falla (429/503 si se superó el límite
+        de altas o el servidor está saturado)
     """
     # Verificar autenticación del instructor
     user_info = get_user_info_from_token(request)
     if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
+    # Límite de altas por IP y cupo global de operaciones de identidad
+    rechazo = admitir("crear_paciente", request)
+    if rechazo:
+        return templates.TemplateResponse("instructor_dashboard.html", {
+            "request": request, "user": user_info, "patients": [], "error": rechazo.mensaje
+        }, status_code=rechazo.status_code, headers=rechazo.cabeceras())
     try:
         # Configurar payload para crear paciente en Keycloak
         payload = {
@@ -227,6 +245,8 @@ def create_patient(request: Request,
         
         patients = []
         return templates.TemplateResponse("instructor_dashboard.html", {"request": request, "user": user_info, "patients": patients, "error": error_message})
+    finally:
+        liberar()
 
 # Página de registro de paciente por instructor - Vista GET
 @router.get("/instructor/create-patient", response_class=HTMLResponse)
@@ -438,12 +458,13 @@ async def delete_patient_route(patient_id: str, request: Request):
     """
     try:
         # Verificar que el usuario es un instructor autorizado
-        user_info = get_user_info_from_token(request)
+        user_info = await run_in_threadpool(get_user_info_from_token, request)
         if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
             raise HTTPException(status_code=403, detail="No autorizado")
             
-        # Eliminar el paciente de la base de datos local y obtener su keycloak_id
-        keycloak_id, success = delete_patient(patient_id)
+        # Eliminar el paciente y sus datos de la base de datos local y obtener su keycloak_id
+        # (el borrado en cascada va por lotes: se ejecuta fuera del bucle de eventos)
+        keycloak_id, success = await run_in_threadpool(delete_patient, patient_id)
         
         if not success:
             raise HTTPException(status_code=404, detail="Paciente no encontrado")
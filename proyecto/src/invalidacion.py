@@ -0,0 +1,154 @@
+"""
+Bus de invalidación de las cachés en memoria entre workers.
+
+Con varios workers de uvicorn, cada uno guarda sus propias cachés (búsqueda de
+posturas, ángulos de referencia, recomendaciones...). Cuando un worker escribe,
+los demás tienen que enterarse. Para eso se usa la propia base de datos:
+
+- Cada operación de escritura de database.py publica, dentro de su misma
+  transacción, eventos (tema, clave) en la tabla invalidacion. La versión del
+  evento es su id autoincremental: si la escritura se deshace, el evento también.
+- Cada worker recuerda la última versión que ha visto. sincronizar() lee los
+  eventos posteriores y avisa a las funciones suscritas al tema con la clave
+  (None = todo el tema). En SQLite, PRAGMA data_version de una conexión propia
+  dice sin leer la tabla si alguien ha escrito desde la última vez.
+- Las cachés llaman a sincronizar() antes de consultar; como mucho se lee la
+  tabla cada INTERVALO_S, que es el retraso máximo con que un worker ve las
+  escrituras de otro. Las del propio worker se ven al momento
+  (ejecutar_escritura sincroniza al terminar).
+
+En PostgreSQL las transacciones pueden confirmarse en otro orden que el de sus
+versiones: los huecos de la secuencia se vuelven a consultar durante
+ESPERA_HUECOS_S. Solo se guardan los últimos RETENER_EVENTOS eventos; un worker
+que se quede más atrás invalida todas sus cachés.
+
+Temas: "instructor", "paciente", "serie", "sesion" y "postura"; la clave es el id
+de la entidad (texto).
+"""
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Retraso máximo (segundos) con que un worker ve las escrituras de otro
+INTERVALO_S = float(os.getenv("THERAPOSE_INVALIDACION_S", "0.25"))
+# Eventos que se conservan en la tabla
+RETENER_EVENTOS = 10000
+# Tiempo que se sigue esperando una versión saltada (transacción aún sin confirmar)
+ESPERA_HUECOS_S = 30
+
+TEMAS = ("instructor", "paciente", "serie", "sesion", "postura")
+
+
+class BusInvalidacion:
+    """
+    Eventos de invalidación de un worker: publica en la tabla y reparte a los suscriptores.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._suscripciones = {tema: [] for tema in TEMAS}
+        self._lock = threading.Lock()
+        self._ultima = None
+        self._huecos = {}  # versión saltada -> instante en que se detectó
+        self._comprobado = float("-inf")
+        self._conn = None
+        self._data_version = None
+
+    def suscribir(self, tema: str, funcion):
+        """Registra funcion(clave) para los eventos del tema (clave None = todo el tema)"""
+        self._suscripciones[tema].append(funcion)
+
+    @staticmethod
+    def publicar(cursor, tema: str, clave=None):
+        """
+        Publica un evento dentro de la transacción de una operación de escritura.
+
+        Args:
+            cursor: Cursor de la transacción en curso
+            tema (str): Uno de TEMAS
+            clave: Id de la entidad modificada, o None si afecta a todo el tema
+        """
+        version = cursor.execute(
+            'INSERT INTO invalidacion (tema, clave) VALUES (?, ?) RETURNING version',
+            (tema, None if clave is None else str(clave))).fetchone()[0]
+        if version % 100 == 0:
+            cursor.execute('DELETE FROM invalidacion WHERE version <= ?', (version - RETENER_EVENTOS,))
+
+    def _consultar(self, sql: str, params=()):
+        if self.backend.nombre != "sqlite":
+            conn = self.backend.conectar()
+            try:
+                return conn.cursor().execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        return self._conn.execute(sql, params).fetchall()
+
+    def _hay_cambios_sqlite(self) -> bool:
+        # data_version cambia cuando otra conexión confirma una escritura en el archivo
+        if self._conn is None:
+            if self.backend.solo_lectura:
+                uri = pathlib.Path(self.backend.db_path).resolve().as_uri() + "?mode=ro"
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                self._conn = sqlite3.connect(self.backend.db_path, check_same_thread=False)
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        cambios = data_version != self._data_version
+        self._data_version = data_version
+        return cambios
+
+    def _leer_eventos(self) -> list:
+        """Eventos (tema, clave) publicados desde la última lectura; avanza la última versión vista"""
+        if self.backend.nombre == "sqlite" and not self._hay_cambios_sqlite() and not self._huecos:
+            return []
+        minima, maxima = self._consultar('SELECT MIN(version), MAX(version) FROM invalidacion')[0]
+        if self._ultima is None:
+            # Primer arranque: las cachés aún están vacías
+            self._ultima = maxima or 0
+            return []
+        if minima is not None and minima > self._ultima + 1:
+            # Se han descartado eventos que este worker no llegó a ver
+            self._ultima, self._huecos = maxima, {}
+            return [(tema, None) for tema in TEMAS]
+
+        ahora = time.monotonic()
+        self._huecos = {v: t for v, t in self._huecos.items() if ahora - t < ESPERA_HUECOS_S}
+        condicion, params = 'version > ?', [self._ultima]
+        if self._huecos:
+            condicion += f" OR version IN ({','.join('?' * len(self._huecos))})"
+            params += list(self._huecos)
+        filas = self._consultar(f'SELECT version, tema, clave FROM invalidacion WHERE {condicion} '
+                                f'ORDER BY version', params)
+        for version, _, _ in filas:
+            self._huecos.pop(version, None)
+            if version > self._ultima:
+                self._huecos.update((v, ahora) for v in range(max(self._ultima + 1, version - 1000), version))
+                self._ultima = version
+        return [(tema, clave) for _, tema, clave in filas]
+
+    def sincronizar(self, forzar: bool = False):
+        """
+        Aplica los eventos publicados desde la última sincronización (como mucho una
+        lectura cada INTERVALO_S, salvo que se fuerce).
+        """
+        if not forzar and time.monotonic() - self._comprobado < INTERVALO_S:
+            return
+        with self._lock:
+            if not forzar and time.monotonic() - self._comprobado < INTERVALO_S:
+                return
+            self._comprobado = time.monotonic()
+            try:
+                eventos = self._leer_eventos()
+            except Exception:
+                logger.exception("No se pudieron leer los eventos de invalidación")
+                return
+        for tema, clave in dict.fromkeys(eventos):
+            for funcion in self._suscripciones.get(tema, []):
+                try:
+                    funcion(clave)
+                except Exception:
+                    logger.exception("Error al invalidar la caché (%s, %s)", tema, clave)
@@ -1,28 +1,62 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
 import os
+
+# Cargar variables de entorno antes de importar los módulos que leen la configuración
+load_dotenv()
+
 from .database import init_db
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada, MiddlewareMetricas
 # Importar y registrar routers
-from .auth import router as auth_router
+from .auth import router as auth_router, MiddlewareModoDegradado, MiddlewareRenovacionToken
 from .instructor import router as instructor_router
 from .patient import router as patient_router
 from .series import router as series_router
 from .sesiones import router as sesiones_router
+from .metricas import router as metricas_router
+from .trazas_sql import router as trazas_sql_router
+from .medios import router as medios_router, cerrar_pool as cerrar_pool_medios
+from .puntuacion import router as puntuacion_router
+from .transmision import router as transmision_router
+from .biblioteca import router as biblioteca_router
+from .busqueda import router as busqueda_router
+from .recomendacion import router as recomendacion_router, actualizar_en_segundo_plano as calcular_recomendaciones
+from .respaldo import router as respaldo_router, programar_respaldos
+from .archivo import router as archivo_router, programar_archivo
 
-# Cargar variables de entorno
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Fase de arranque de la aplicación: prepara el esquema de la base de datos
+    antes de aceptar peticiones (los clientes de Keycloak se crean bajo demanda)
+    y empieza a calcular en segundo plano las recomendaciones de posturas y, si
+    están configurados, las copias de seguridad y el archivo de sesiones
+    programados. Al apagar, detiene el pool de procesos de medios.
+    """
+    init_db()
+    calcular_recomendaciones()
+    programar_respaldos()
+    programar_archivo()
+    yield
+    cerrar_pool_medios()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = RutaInstrumentada
 
-# Inicializar la base de datos
-init_db()
+# Renovación silenciosa del access token con el refresh token (cookies rotadas en la respuesta)
+app.add_middleware(MiddlewareRenovacionToken)
+# Modo degradado si Keycloak no responde (503 a lo que no puede servirse sin él)
+app.add_middleware(MiddlewareModoDegradado)
+# Middleware de instrumentación: histogramas por ruta y perfilado opcional (cabecera X-Profile)
+# (añadido el último para envolver a los demás y medir también sus respuestas)
+app.add_middleware(MiddlewareMetricas)
 
 # Montar archivos estáticos y plantillas
 app.mount("/static", StaticFiles(directory="proyecto/static"), name="static")
-templates = Jinja2Templates(directory="proyecto/templates")
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
 
 # Incluir todos los routers
 app.include_router(auth_router)
@@ -30,6 +64,16 @@ app.include_router(instructor_router)
 app.include_router(patient_router)
 app.include_router(series_router)
 app.include_router(sesiones_router)
+app.include_router(metricas_router)
+app.include_router(trazas_sql_router)
+app.include_router(medios_router)
+app.include_router(puntuacion_router)
+app.include_router(transmision_router)
+app.include_router(biblioteca_router)
+app.include_router(busqueda_router)
+app.include_router(recomendacion_router)
+app.include_router(respaldo_router)
+app.include_router(archivo_router)
 
 # Ruta principal - Página de inicio
 @app.get("/", response_class=HTMLResponse)
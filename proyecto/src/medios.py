@@ -0,0 +1,466 @@
+"""
+Medios de las posturas: fotografías, variantes responsivas y videos.
+
+1. Ingesta (endpoints /admin/media/...): el archivo original se guarda en un
+   almacén direccionado por contenido (MEDIA_DIR/ab/abcdef....ext, nombre =
+   SHA-256), por lo que subir dos veces el mismo archivo no duplica nada.
+2. Las fotografías se redimensionan a los anchos de ANCHOS_VARIANTE en WebP
+   (y AVIF si pillow-avif-plugin está instalado) en un pool de procesos, para
+   no bloquear el event loop ni competir por el GIL con las peticiones.
+3. Servicio (/media/<hash>.<ext>): ETag = hash y caché inmutable, peticiones
+   de rango (HTTP 206) para que el navegador pueda saltar dentro de los videos,
+   y envío sin copia (sendfile) cuando el servidor ASGI ofrece la extensión
+   http.response.zerocopysend.
+
+Los videos se almacenan tal como se suben (sin transcodificar). Antes de escribir en
+el almacén se comprueba que la postura existe: un archivo subido para una postura
+inexistente no llega al almacén y no queda huérfano.
+"""
+import asyncio
+import functools
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import anyio
+from fastapi import APIRouter, File, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from .database import existe_postura, get_medios_posturas, reemplazar_medios_postura
+from .metricas import RutaInstrumentada, span
+from .modelos import MedioPostura, RespuestaJSON
+from .utils import verificar_token_admin
+
+logger = logging.getLogger(__name__)
+
+# Directorio raíz del almacén de medios
+MEDIA_DIR = os.getenv("THERAPOSE_MEDIA_DIR", "proyecto/media")
+# Anchos (px) de las variantes de cada fotografía; el menor sirve de miniatura
+ANCHOS_VARIANTE = tuple(int(a) for a in os.getenv("THERAPOSE_MEDIA_WIDTHS", "160,320,640,1280").split(","))
+CALIDAD = int(os.getenv("THERAPOSE_MEDIA_QUALITY", "80"))
+# Procesos dedicados a generar variantes
+PROCESOS_MEDIOS = int(os.getenv("THERAPOSE_MEDIA_WORKERS", "2"))
+# Límite de tamaño de las fotografías subidas
+MAX_FOTO_BYTES = 20 * 1024 * 1024
+# Tamaño de lectura cuando no se puede usar sendfile
+TAMANO_BLOQUE = 64 * 1024
+
+MIME_POR_FORMATO = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+}
+FORMATOS_VIDEO = ("mp4", "webm")
+_RE_NOMBRE = re.compile(r"^([0-9a-f]{64})\.([a-z0-9]+)$")
+
+# Configuración del router para los medios
+router = APIRouter(route_class=RutaInstrumentada)
+
+
+def ruta_en_almacen(hash_hex: str, formato: str, directorio: str = None) -> str:
+    return os.path.join(directorio or MEDIA_DIR, hash_hex[:2], f"{hash_hex}.{formato}")
+
+
+def url_medio(hash_hex: str, formato: str) -> str:
+    return f"/media/{hash_hex}.{formato}"
+
+
+def _guardar_bytes(datos: bytes, formato: str, directorio: str) -> tuple:
+    """
+    Guarda datos en el almacén y devuelve (hash, tamaño). Si ya existe, no se reescribe.
+    """
+    hash_hex = hashlib.sha256(datos).hexdigest()
+    destino = ruta_en_almacen(hash_hex, formato, directorio)
+    if not os.path.exists(destino):
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Escritura atómica: un lector nunca ve un archivo a medio escribir
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(destino), suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as archivo:
+            archivo.write(datos)
+        os.replace(temporal, destino)
+    return hash_hex, len(datos)
+
+
+def _guardar_flujo(origen, formato: str, directorio: str) -> tuple:
+    """
+    Copia un archivo (p. ej. un video subido) al almacén calculando el hash por bloques,
+    sin cargarlo entero en memoria. Devuelve (hash, tamaño).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    sha = hashlib.sha256()
+    tamano = 0
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            while bloque := origen.read(TAMANO_BLOQUE):
+                sha.update(bloque)
+                archivo.write(bloque)
+                tamano += len(bloque)
+        hash_hex = sha.hexdigest()
+        destino = ruta_en_almacen(hash_hex, formato, directorio)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(temporal, destino)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.unlink(temporal)
+        raise
+    return hash_hex, tamano
+
+
+@functools.lru_cache(maxsize=1)
+def formatos_variante() -> tuple:
+    """Formatos en que se generan las variantes: WebP siempre y AVIF si hay soporte"""
+    try:
+        import pillow_avif  # noqa: F401
+        return ("avif", "webp")
+    except ImportError:
+        from PIL import features
+        return ("avif", "webp") if features.check("avif") else ("webp",)
+
+
+def _generar_variante(ruta_original: str, ancho: int, formato: str, directorio: str) -> tuple:
+    """
+    Se ejecuta en el pool de procesos: redimensiona la fotografía original y guarda
+    la variante en el almacén. Devuelve (ancho, hash, tamaño).
+    """
+    from PIL import Image, ImageOps
+    if formato == "avif":
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            pass
+
+    with Image.open(ruta_original) as imagen:
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode not in ("RGB", "RGBA"):
+            imagen = imagen.convert("RGBA" if "transparency" in imagen.info else "RGB")
+        if imagen.width > ancho:
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            imagen = imagen.resize((ancho, alto), Image.LANCZOS)
+        salida = io.BytesIO()
+        opciones = {"quality": CALIDAD}
+        if formato == "webp":
+            opciones["method"] = 4
+        imagen.save(salida, format=formato.upper(), **opciones)
+        ancho_final = imagen.width
+
+    hash_hex, tamano = _guardar_bytes(salida.getvalue(), formato, directorio)
+    return ancho_final, hash_hex, tamano
+
+
+def _guardar_original_foto(datos: bytes, directorio: str) -> tuple:
+    """
+    Valida que los datos sean una imagen y guarda el original.
+    Devuelve (formato, ancho, hash, tamaño).
+    """
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with Image.open(io.BytesIO(datos)) as imagen:
+            formato = (imagen.format or "").lower()
+            ancho = imagen.width
+    except UnidentifiedImageError as e:
+        raise ValueError("El archivo no es una imagen válida.") from e
+    if formato not in ("jpeg", "png", "webp"):
+        raise ValueError(f"Formato de imagen no admitido: {formato or 'desconocido'}.")
+    hash_hex, tamano = _guardar_bytes(datos, formato, directorio)
+    return formato, ancho, hash_hex, tamano
+
+
+def anchos_para(ancho_original: int) -> list:
+    """Anchos de variante que no amplían la imagen (al menos uno, el del original si es pequeña)"""
+    anchos = [a for a in ANCHOS_VARIANTE if a < ancho_original]
+    if len(anchos) < len(ANCHOS_VARIANTE):
+        anchos.append(min(ancho_original, max(ANCHOS_VARIANTE)))
+    return sorted(set(anchos))
+
+
+_pool = None
+
+
+def _pool_procesos() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: no se hereda el estado (hilos, conexiones) del worker de la aplicación
+        _pool = ProcessPoolExecutor(max_workers=PROCESOS_MEDIOS,
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def cerrar_pool():
+    """Detiene el pool de procesos de medios (al apagar la aplicación)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def ingerir_foto(id_postura: int, datos: bytes) -> list:
+    """
+    Guarda la fotografía de una postura y genera sus variantes en el pool de procesos.
+
+    Args:
+        id_postura (int): ID de la postura
+        datos (bytes): Contenido de la imagen (JPEG, PNG o WebP)
+
+    Returns:
+        list: MedioPostura del original y de cada variante
+
+    Raises:
+        ValueError: Si la postura no existe o la imagen no es válida
+    """
+    if not await run_in_threadpool(existe_postura, id_postura):
+        raise ValueError(f"La postura {id_postura} no existe.")
+    directorio = MEDIA_DIR
+    formato, ancho, hash_hex, tamano = await run_in_threadpool(_guardar_original_foto, datos, directorio)
+    medios = [MedioPostura(id_postura, "foto", formato, 0, hash_hex, MIME_POR_FORMATO[formato], tamano)]
+
+    ruta_original = ruta_en_almacen(hash_hex, formato, directorio)
+    loop = asyncio.get_running_loop()
+    trabajos = [
+        (formato_variante, loop.run_in_executor(
+            _pool_procesos(), _generar_variante, ruta_original, ancho_variante, formato_variante, directorio
+        ))
+        for formato_variante in formatos_variante()
+        for ancho_variante in anchos_para(ancho)
+    ]
+    with span("medios.variantes"):
+        resultados = await asyncio.gather(*(futuro for _, futuro in trabajos))
+    for (formato_variante, _), (ancho_variante, hash_variante, tamano_variante) in zip(trabajos, resultados):
+        medios.append(MedioPostura(id_postura, "foto", formato_variante, ancho_variante,
+                                   hash_variante, MIME_POR_FORMATO[formato_variante], tamano_variante))
+
+    await run_in_threadpool(reemplazar_medios_postura, id_postura, "foto", medios)
+    return medios
+
+
+async def ingerir_video(id_postura: int, archivo, formato: str) -> list:
+    """
+    Guarda el video de una postura tal como se subió.
+
+    Args:
+        id_postura (int): ID de la postura
+        archivo: Archivo abierto en modo binario
+        formato (str): "mp4" o "webm"
+
+    Returns:
+        list: MedioPostura del video
+
+    Raises:
+        ValueError: Si la postura no existe
+    """
+    if not await run_in_threadpool(existe_postura, id_postura):
+        raise ValueError(f"La postura {id_postura} no existe.")
+    hash_hex, tamano = await run_in_threadpool(_guardar_flujo, archivo, formato, MEDIA_DIR)
+    medios = [MedioPostura(id_postura, "video", formato, 0, hash_hex, MIME_POR_FORMATO[formato], tamano)]
+    await run_in_threadpool(reemplazar_medios_postura, id_postura, "video", medios)
+    return medios
+
+
+def medios_por_postura(ids_postura) -> dict:
+    """
+    Agrupa los medios de las posturas en la forma que usa la página de sesión:
+    {id_postura: {"srcset": {mime: "url 320w, ..."}, "imagen": url, "video": {"src", "type"}}}
+    """
+    resultado = {}
+    for medio in get_medios_posturas(ids_postura):
+        entrada = resultado.setdefault(medio.id_postura, {})
+        url = url_medio(medio.hash, medio.formato)
+        if medio.tipo == "video":
+            entrada["video"] = {"src": url, "type": medio.mime}
+        elif medio.ancho == 0:
+            entrada["original"] = url
+        else:
+            srcset = entrada.setdefault("srcset", {})
+            srcset[medio.mime] = f"{srcset[medio.mime]}, {url} {medio.ancho}w" if medio.mime in srcset else f"{url} {medio.ancho}w"
+            # Imagen de respaldo: la variante WebP más pequeña (miniatura)
+            if medio.formato == "webp" and "imagen" not in entrada:
+                entrada["imagen"] = url
+    return resultado
+
+
+def parsear_rango(cabecera: str, tamano: int):
+    """
+    Interpreta una cabecera Range de un único rango de bytes.
+
+    Returns:
+        tuple | None: (inicio, fin) inclusivos, o None si se debe enviar el archivo completo
+
+    Raises:
+        ValueError: Si el rango no se puede satisfacer (HTTP 416)
+    """
+    unidad, _, rangos = cabecera.partition("=")
+    if unidad.strip().lower() != "bytes" or "," in rangos:
+        # Unidades desconocidas o varios rangos: se responde con el archivo completo
+        return None
+    inicio_txt, guion, fin_txt = rangos.strip().partition("-")
+    if not guion:
+        return None
+    try:
+        if not inicio_txt:
+            sufijo = int(fin_txt)
+            if sufijo <= 0:
+                raise ValueError("Rango vacío")
+            return max(0, tamano - sufijo), tamano - 1
+        inicio = int(inicio_txt)
+        fin = int(fin_txt) if fin_txt else tamano - 1
+    except ValueError:
+        raise ValueError("Rango no válido")
+    if inicio >= tamano or fin < inicio:
+        raise ValueError("Rango fuera del archivo")
+    return inicio, min(fin, tamano - 1)
+
+
+class RespuestaMedio(Response):
+    """
+    Respuesta de un archivo del almacén, completa o parcial (206), enviada con
+    sendfile cuando el servidor lo permite.
+    """
+
+    def __init__(self, ruta: str, tamano: int, etag: str, mime: str, rango: tuple = None):
+        self.ruta = ruta
+        self.inicio, fin = rango if rango else (0, tamano - 1)
+        self.longitud = fin - self.inicio + 1
+        self.completo = rango is None
+        cabeceras = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "cache-control": "public, max-age=31536000, immutable",
+            "content-length": str(self.longitud),
+        }
+        if rango:
+            cabeceras["content-range"] = f"bytes {self.inicio}-{fin}/{tamano}"
+        super().__init__(status_code=200 if self.completo else 206, headers=cabeceras, media_type=mime)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.longitud == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensiones = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensiones:
+            with open(self.ruta, "rb") as archivo:
+                await send({
+                    "type": "http.response.zerocopysend", "file": archivo,
+                    "offset": self.inicio, "count": self.longitud, "more_body": False,
+                })
+            return
+        if self.completo and "http.response.pathsend" in extensiones:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.ruta)})
+            return
+
+        async with await anyio.open_file(self.ruta, mode="rb") as archivo:
+            await archivo.seek(self.inicio)
+            restante = self.longitud
+            while restante > 0:
+                bloque = await archivo.read(min(TAMANO_BLOQUE, restante))
+                if not bloque:
+                    break
+                restante -= len(bloque)
+                await send({"type": "http.response.body", "body": bloque, "more_body": restante > 0})
+            if restante > 0:
+                # El archivo se truncó durante el envío: cerrar el cuerpo igualmente
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# Servicio de medios con ETag, caché inmutable y peticiones de rango
+@router.api_route("/media/{nombre}", methods=["GET", "HEAD"])
+def servir_medio(request: Request, nombre: str):
+    """
+    Sirve un archivo del almacén de medios.
+
+    Args:
+        request (Request): Objeto de petición HTTP (cabeceras Range, If-None-Match, If-Range)
+        nombre (str): "<sha256>.<formato>"
+
+    Returns:
+        RespuestaMedio: Archivo completo (200) o parcial (206)
+        Response: 304 si el cliente ya tiene el archivo, 416 si el rango no es válido
+        JSONResponse: Error 404 si el medio no existe
+    """
+    coincidencia = _RE_NOMBRE.match(nombre)
+    if not coincidencia or coincidencia.group(2) not in MIME_POR_FORMATO:
+        return JSONResponse(content={"error": "Medio no encontrado"}, status_code=404)
+    hash_hex, formato = coincidencia.groups()
+    ruta = ruta_en_almacen(hash_hex, formato)
+    try:
+        tamano = os.stat(ruta).st_size
+    except FileNotFoundError:
+        return JSONResponse(content={"error": "Medio no encontrado"}, status_code=404)
+
+    # El contenido nunca cambia para un mismo nombre: el hash es un ETag fuerte
+    etag = f'"{hash_hex}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [e.strip() for e in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"etag": etag, "cache-control": "public, max-age=31536000, immutable"})
+
+    rango = None
+    cabecera_rango = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if cabecera_rango and (if_range is None or if_range.strip() == etag):
+        try:
+            rango = parsear_rango(cabecera_rango, tamano)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{tamano}"})
+    return RespuestaMedio(ruta, tamano, etag, MIME_POR_FORMATO[formato], rango)
+
+
+# Ingesta de la fotografía de una postura
+@router.post("/admin/media/posturas/{id_postura}/foto")
+async def subir_foto_postura(request: Request, id_postura: int, archivo: UploadFile = File(...)):
+    """
+    Recibe la fotografía de una postura y genera sus variantes WebP/AVIF.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        id_postura (int): ID de la postura
+        archivo (UploadFile): Imagen JPEG, PNG o WebP
+
+    Returns:
+        JSONResponse: Medios generados, o error 400/401/404/413
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    datos = await archivo.read(MAX_FOTO_BYTES + 1)
+    if len(datos) > MAX_FOTO_BYTES:
+        return JSONResponse(content={"error": "La imagen supera el tamaño máximo"}, status_code=413)
+    try:
+        medios = await ingerir_foto(id_postura, datos)
+    except ValueError as e:
+        codigo = 404 if "no existe" in str(e) else 400
+        return JSONResponse(content={"error": str(e)}, status_code=codigo)
+    return RespuestaJSON(content={"medios": medios}, status_code=201)
+
+
+# Ingesta del video de una postura
+@router.post("/admin/media/posturas/{id_postura}/video")
+async def subir_video_postura(request: Request, id_postura: int, archivo: UploadFile = File(...)):
+    """
+    Recibe el video de una postura (MP4 o WebM) y lo guarda en el almacén.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        id_postura (int): ID de la postura
+        archivo (UploadFile): Video MP4 o WebM
+
+    Returns:
+        JSONResponse: Medio guardado, o error 401/404/415
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    extension = os.path.splitext(archivo.filename or "")[1].lstrip(".").lower()
+    formato = extension if extension in FORMATOS_VIDEO else (archivo.content_type or "").partition("/")[2]
+    if formato not in FORMATOS_VIDEO:
+        return JSONResponse(content={"error": "Formato de video no admitido (mp4 o webm)"}, status_code=415)
+    try:
+        medios = await ingerir_video(id_postura, archivo.file, formato)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=404)
+    return RespuestaJSON(content={"medios": medios}, status_code=201)
@@ -0,0 +1,360 @@
+# Módulo de instrumentación: tiempos por ruta, métricas Prometheus y perfilado opcional
+import cProfile
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+# Límites de los buckets de los histogramas (en segundos)
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# El perfilado por petición solo se activa si el entorno lo permite explícitamente
+PERFILADO_HABILITADO = os.getenv("PROFILING_ENABLED", "0") == "1"
+DIRECTORIO_PERFILES = os.getenv("PROFILING_DIR", tempfile.gettempdir())
+CABECERA_PERFIL = "x-profile"
+
+# Fracción de eventos informativos que se registran en el log (los errores no se muestrean)
+TASA_MUESTREO_LOG = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+# Configuración del router para el endpoint de métricas
+router = APIRouter()
+
+
+class Histograma:
+    """
+    Histograma acumulativo con buckets fijos, compatible con el formato de Prometheus.
+    """
+    __slots__ = ("conteos", "suma", "total")
+
+    def __init__(self):
+        self.conteos = [0] * len(BUCKETS_SEGUNDOS)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        for i, limite in enumerate(BUCKETS_SEGUNDOS):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+
+class RegistroMetricas:
+    """
+    Registro en memoria de histogramas y contadores indexados por nombre de métrica y etiquetas.
+    """
+
+    def __init__(self):
+        self._histogramas = {}
+        self._contadores = {}
+        self._ayuda = {}
+        self._lock = threading.Lock()
+
+    def describir(self, nombre: str, ayuda: str):
+        self._ayuda[nombre] = ayuda
+
+    def observar(self, nombre: str, valor: float, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+
+    def incrementar(self, nombre: str, valor: float = 1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def contador(self, nombre: str, **etiquetas) -> float:
+        """Valor actual de un contador (0 si no se ha incrementado)"""
+        with self._lock:
+            return self._contadores.get((nombre, tuple(sorted(etiquetas.items()))), 0)
+
+    def reiniciar(self):
+        with self._lock:
+            self._histogramas.clear()
+            self._contadores.clear()
+
+    def exportar(self) -> str:
+        """
+        Genera el texto de exposición de Prometheus (versión 0.0.4).
+        """
+        with self._lock:
+            items = sorted(
+                (clave, list(h.conteos), h.suma, h.total)
+                for clave, h in self._histogramas.items()
+            )
+
+        lineas = []
+        nombre_actual = None
+        for (nombre, etiquetas), conteos, suma, total in items:
+            if nombre != nombre_actual:
+                nombre_actual = nombre
+                if nombre in self._ayuda:
+                    lineas.append(f"# HELP {nombre} {self._ayuda[nombre]}")
+                lineas.append(f"# TYPE {nombre} histogram")
+            base = ",".join(f'{k}="{_escapar_etiqueta(v)}"' for k, v in etiquetas)
+            separador = "," if base else ""
+            acumulado = 0
+            for limite, conteo in zip(BUCKETS_SEGUNDOS, conteos):
+                acumulado += conteo
+                lineas.append(f'{nombre}_bucket{{{base}{separador}le="{limite}"}} {acumulado}')
+            lineas.append(f'{nombre}_bucket{{{base}{separador}le="+Inf"}} {total}')
+            lineas.append(f"{nombre}_sum{{{base}}} {suma}")
+            lineas.append(f"{nombre}_count{{{base}}} {total}")
+
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+        nombre_actual = None
+        for (nombre, etiquetas), valor in contadores:
+            if nombre != nombre_actual:
+                nombre_actual = nombre
+                if nombre in self._ayuda:
+                    lineas.append(f"# HELP {nombre} {self._ayuda[nombre]}")
+                lineas.append(f"# TYPE {nombre} counter")
+            base = ",".join(f'{k}="{_escapar_etiqueta(v)}"' for k, v in etiquetas)
+            lineas.append(f"{nombre}{{{base}}} {valor}")
+        return "\n".join(lineas) + "\n"
+
+
+def _escapar_etiqueta(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registro = RegistroMetricas()
+registro.describir("therapose_request_duration_seconds", "Duración total de la petición HTTP por ruta.")
+registro.describir("therapose_span_duration_seconds", "Duración de operaciones internas (Keycloak, SQLite, Jinja) por ruta.")
+
+
+class ContextoPeticion:
+    """
+    Estado de instrumentación de la petición en curso: spans acumulados y perfilador.
+    """
+    __slots__ = ("spans", "perfilador", "perfil")
+
+    def __init__(self, perfilador: str = None):
+        self.spans = []
+        self.perfilador = perfilador
+        self.perfil = None
+
+
+_contexto_peticion = contextvars.ContextVar("contexto_peticion", default=None)
+
+
+@contextmanager
+def span(nombre: str):
+    """
+    Mide el tiempo de un bloque y lo asocia a la ruta de la petición en curso.
+    Fuera de una petición (por ejemplo durante el arranque) se registra con route="-".
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        contexto = _contexto_peticion.get()
+        if contexto is None:
+            registro.observar("therapose_span_duration_seconds", duracion, route="-", span=nombre)
+        else:
+            contexto.spans.append((nombre, duracion))
+
+
+def instrumentar(prefijo: str):
+    """
+    Decorador que envuelve una función en un span llamado "<prefijo>.<nombre_funcion>".
+    """
+    def decorador(func):
+        nombre = f"{prefijo}.{func.__name__}"
+
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            with span(nombre):
+                return func(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+class PlantillasInstrumentadas(Jinja2Templates):
+    """
+    Jinja2Templates que mide el tiempo de renderizado de cada TemplateResponse.
+    """
+
+    def TemplateResponse(self, *args, **kwargs):
+        nombre = kwargs.get("name") or next((a for a in args if isinstance(a, str)), "desconocida")
+        with span(f"jinja.{nombre}"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+def _perfilable(endpoint):
+    """
+    Envuelve un endpoint para perfilarlo en el mismo hilo en que se ejecuta
+    (los endpoints síncronos corren en el threadpool, fuera del middleware).
+    """
+    def iniciar():
+        contexto = _contexto_peticion.get()
+        if contexto is None or contexto.perfilador is None:
+            return None, None
+        if contexto.perfilador == "pyinstrument":
+            from pyinstrument import Profiler
+            perfil = Profiler()
+            perfil.start()
+        else:
+            perfil = cProfile.Profile()
+            perfil.enable()
+        return contexto, perfil
+
+    def detener(contexto, perfil):
+        if perfil is None:
+            return
+        if contexto.perfilador == "pyinstrument":
+            perfil.stop()
+        else:
+            perfil.disable()
+        contexto.perfil = perfil
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envoltura_async(*args, **kwargs):
+            contexto, perfil = iniciar()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                detener(contexto, perfil)
+        return envoltura_async
+
+    @functools.wraps(endpoint)
+    def envoltura(*args, **kwargs):
+        contexto, perfil = iniciar()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            detener(contexto, perfil)
+    return envoltura
+
+
+class RutaInstrumentada(APIRoute):
+    """
+    APIRoute cuyos endpoints pueden perfilarse bajo demanda mediante la cabecera X-Profile.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _perfilable(endpoint), **kwargs)
+
+
+def _elegir_perfilador(request: Request):
+    if not PERFILADO_HABILITADO:
+        return None
+    valor = request.headers.get(CABECERA_PERFIL)
+    if not valor:
+        return None
+    if valor.lower() == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+            return "pyinstrument"
+        except ImportError:
+            logger.warning("pyinstrument no está instalado; se usa cProfile")
+    return "cprofile"
+
+
+def _guardar_perfil(contexto: ContextoPeticion, ruta: str) -> str:
+    nombre_ruta = "".join(c if c.isalnum() else "_" for c in ruta.strip("/")) or "root"
+    nombre_base = f"therapose-{nombre_ruta}-{int(time.time() * 1000)}"
+    if contexto.perfilador == "pyinstrument":
+        destino = os.path.join(DIRECTORIO_PERFILES, nombre_base + ".html")
+        with open(destino, "w", encoding="utf-8") as archivo:
+            archivo.write(contexto.perfil.output_html())
+    else:
+        destino = os.path.join(DIRECTORIO_PERFILES, nombre_base + ".prof")
+        contexto.perfil.dump_stats(destino)
+    return destino
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que:
+    1. Abre un contexto de instrumentación para la petición
+    2. Al terminar, agrega la duración total y los spans al histograma de la ruta
+    3. Si se pidió un perfil (cabecera X-Profile), lo guarda y devuelve su ruta en la respuesta
+
+    Es ASGI puro (no BaseHTTPMiddleware): los mensajes de la respuesta pasan sin
+    reencapsular, de modo que las extensiones de envío de archivos
+    (http.response.zerocopysend / pathsend) llegan intactas al servidor.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        contexto = ContextoPeticion(_elegir_perfilador(Request(scope)))
+        token = _contexto_peticion.set(contexto)
+        inicio = time.perf_counter()
+        status_code = 500
+
+        async def enviar(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Los endpoints ya terminaron cuando empieza la respuesta: el perfil está listo
+                if contexto.perfil is not None:
+                    destino = _guardar_perfil(contexto, _plantilla_ruta(scope))
+                    MutableHeaders(scope=message).append("X-Profile-Dump", destino)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            _contexto_peticion.reset(token)
+            ruta = _plantilla_ruta(scope)
+            registro.observar(
+                "therapose_request_duration_seconds", duracion,
+                route=ruta, method=scope["method"], status=str(status_code)
+            )
+            for nombre, duracion_span in contexto.spans:
+                registro.observar("therapose_span_duration_seconds", duracion_span, route=ruta, span=nombre)
+
+
+def _plantilla_ruta(scope) -> str:
+    # Se usa la plantilla de la ruta (no la URL) para acotar la cardinalidad
+    return getattr(scope.get("route"), "path", "sin_ruta")
+
+
+def log_muestreado(log: logging.Logger, evento: str, nivel: int = logging.INFO, **campos):
+    """
+    Registra un evento estructurado (JSON) solo para una fracción de las llamadas.
+    """
+    if not log.isEnabledFor(nivel) or random.random() >= TASA_MUESTREO_LOG:
+        return
+    log.log(nivel, json.dumps({"evento": evento, **campos}, default=str, ensure_ascii=False))
+
+
+# Endpoint de métricas en formato Prometheus
+@router.get("/metrics")
+def metrics():
+    """
+    Expone los histogramas de peticiones y spans (y los contadores) en formato de texto de Prometheus.
+
+    Returns:
+        PlainTextResponse: Métricas en formato de exposición 0.0.4
+    """
+    return PlainTextResponse(registro.exportar(), media_type="text/plain; version=0.0.4")
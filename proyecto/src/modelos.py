@@ -0,0 +1,238 @@
+# Tipos de registro compactos para los resultados de la capa de datos
+#
+# Cada registro es un msgspec.Struct: sin __dict__ por instancia, se construye
+# directamente desde la fila que devuelve el cursor (Registro(*fila)) y se
+# codifica a JSON en C, sin pasar por diccionarios intermedios. Los campos se
+# leen por nombre (paciente.email, serie.sesiones_completadas).
+from typing import ClassVar, List, Optional
+import msgspec
+from fastapi.responses import JSONResponse
+
+
+class Registro(msgspec.Struct, omit_defaults=True):
+    """
+    Base de los registros. Los campos de la clase definen a la vez el orden de las
+    columnas del SELECT, el constructor posicional y el esquema JSON.
+    """
+    # Campos que no vienen de la consulta (se rellenan después o se derivan)
+    derivados: ClassVar[tuple] = ()
+
+    @classmethod
+    def columnas(cls, alias: str = None) -> str:
+        """Lista de columnas en el orden del constructor, para usar en SELECT"""
+        prefijo = f"{alias}." if alias else ""
+        return ", ".join(prefijo + campo for campo in cls.__struct_fields__
+                         if campo not in cls.derivados)
+
+    def to_dict(self) -> dict:
+        return msgspec.to_builtins(self)
+
+
+class Usuario(Registro):
+    """
+    Campos comunes de instructores y pacientes (tablas instructors y patients).
+    """
+    id: str
+    username: str
+    email: str
+    first_name: str
+    last_name: str
+    fecha_nac: Optional[str] = None
+    genero: Optional[str] = None
+    celular: Optional[str] = None
+    created_at: Optional[object] = None
+
+
+class Patient(Usuario):
+    pass
+
+
+class Instructor(Usuario):
+    pass
+
+
+class Postura(Registro):
+    """
+    Postura del catálogo (para elegir posturas al crear una serie).
+    """
+    id_postura: int
+    nombre_es: str
+    nombre_sans: Optional[str]
+
+
+class PosturaRecomendada(Postura):
+    """
+    Postura sugerida para un tipo de terapia. efecto es la bajada de intensidad
+    estimada por minuto de la postura y sesiones el número de sesiones del tipo
+    que la incluyeron; ambos se omiten mientras no haya sesiones con ella.
+    """
+    efecto: Optional[float] = None
+    sesiones: Optional[int] = None
+
+
+class SeriePostura(Registro):
+    """
+    Postura dentro de una serie, con su orden, duración en minutos y sus textos
+    de ayuda (se omiten del JSON cuando están vacíos).
+    """
+    id_postura: int
+    nombre_es: str
+    nombre_sans: Optional[str]
+    orden: int
+    duracion_min: float
+    instrucciones: Optional[str] = None
+    beneficios: Optional[str] = None
+    precauciones: Optional[str] = None
+
+
+class Serie(Registro):
+    """
+    Serie terapéutica con su progreso (sesiones realizadas frente a recomendadas).
+    posturas se rellena solo cuando la vista necesita el detalle de la serie.
+    """
+    derivados: ClassVar[tuple] = ("posturas",)
+
+    id_serie: int
+    nombre: str
+    tipo_terapia: str
+    sesiones_recomendadas: int
+    sesiones_completadas: int
+    serie_completa: bool
+    posturas: Optional[List[SeriePostura]] = None
+
+    def __post_init__(self):
+        # SQLite devuelve el CASE ... THEN 1 ELSE 0 como entero
+        self.serie_completa = bool(self.serie_completa)
+
+
+class PlantillaSerie(Registro):
+    """
+    Plantilla de serie de un instructor: nombre, tipo, sesiones y secuencia de
+    posturas que se asignan de una vez a varios pacientes. posturas es la lista
+    de [id_postura, orden, duracion_min].
+    """
+    derivados: ClassVar[tuple] = ("posturas",)
+
+    id_plantilla: int
+    nombre: str
+    tipo_terapia: str
+    sesiones_recomendadas: int
+    posturas: List[list] = []
+
+
+class ResumenSerie(Registro):
+    """
+    Serie activa con su progreso y la última sesión realizada (campos ultima_*,
+    vacíos si aún no hay sesiones), para la vista general del instructor.
+    """
+    id_serie: int
+    nombre: str
+    tipo_terapia: str
+    sesiones_recomendadas: int
+    sesiones_completadas: int
+    serie_completa: bool
+    ultima_fecha: Optional[object] = None
+    ultima_intensidad_inicio: Optional[int] = None
+    ultima_intensidad_final: Optional[int] = None
+    ultima_puntuacion: Optional[float] = None
+
+    def __post_init__(self):
+        self.serie_completa = bool(self.serie_completa)
+
+
+class ResumenPaciente(Registro):
+    """
+    Paciente de un instructor con sus series activas (ResumenSerie).
+    """
+    id: str
+    first_name: str
+    last_name: str
+    series: List[ResumenSerie] = []
+
+
+def formatear_duracion(minutos_decimales: float) -> str:
+    """Duración en formato amigable, p. ej. 12.5 -> "12 min 30 seg" """
+    tiempo = minutos_decimales or 0
+    minutos = int(tiempo)
+    segundos = round((tiempo - minutos) * 60)
+    return f"{minutos} min{' ' + str(segundos) + ' seg' if segundos > 0 else ''}"
+
+
+class Sesion(Registro):
+    """
+    Sesión realizada por el paciente dentro de una serie.
+    """
+    derivados: ClassVar[tuple] = ("duracion_formateada",)
+
+    id_sesion: int
+    fecha: object
+    hora_inicio: object
+    hora_fin: object
+    intensidad_inicio: int
+    intensidad_final: int
+    comentario: Optional[str]
+    tiempo_efectivo: float
+    puntuacion: Optional[float]
+    duracion_formateada: str = ""
+
+    def __post_init__(self):
+        # Se calcula al construir la fila para que el JSON la incluya sin pasos extra
+        self.duracion_formateada = formatear_duracion(self.tiempo_efectivo)
+
+
+class AdherenciaPostura(Registro):
+    """
+    Tiempos planificados frente a medidos de una postura, agregados sobre sus
+    sesiones (medias en segundos). adherencia es el tiempo activo total dividido
+    entre el planificado total (1.0 = se cumplió el plan).
+    """
+    id_postura: int
+    nombre_es: str
+    sesiones: int
+    segundos_plan: float
+    segundos_reales: float
+    segundos_pausa: float
+    adherencia: Optional[float]
+
+
+class MedioPostura(Registro):
+    """
+    Archivo de medios de una postura. ancho es 0 para el original y los videos.
+    """
+    id_postura: int
+    tipo: str
+    formato: str
+    ancho: int
+    hash: str
+    mime: str
+    bytes: int
+
+
+class ReferenciaPostura(Registro):
+    """
+    Plantilla de keypoints de una postura (esqueleto común de 12 articulaciones,
+    normalizado) con la fiabilidad de cada articulación, ambas como listas JSON.
+    """
+    id_postura: int
+    puntos: str
+    confianza: str
+    muestras: int
+
+
+# Codificador compartido: msgspec reutiliza su búfer interno entre llamadas
+_codificador = msgspec.json.Encoder()
+
+
+def codificar_json(contenido) -> bytes:
+    """Codifica a JSON contenido que puede incluir registros"""
+    return _codificador.encode(contenido)
+
+
+class RespuestaJSON(JSONResponse):
+    """
+    JSONResponse que codifica con msgspec; acepta registros (o listas de registros)
+    directamente en el contenido, además de los tipos JSON habituales.
+    """
+
+    def render(self, content) -> bytes:
+        return _codificador.encode(content)
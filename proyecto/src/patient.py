@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from .auth import get_user_info_from_token
 from .database import get_series_by_patient, get_posturas_by_serie
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada, log_muestreado
+import logging
 
-templates = Jinja2Templates(directory="proyecto/templates")
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
+router = APIRouter(route_class=RutaInstrumentada)
 
 @router.get("/patient/dashboard", response_class=HTMLResponse)
 def patient_dashboard(request: Request):
@@ -21,25 +24,13 @@ def patient_dashboard(request: Request):
     
     # Obtener las series del paciente
     patient_id = user_info.get("sub")
-    print(f"Buscando series para el paciente: {patient_id}")  # Debug log
-    series_data = get_series_by_patient(patient_id)
-    print(f"Series encontradas: {series_data}")  # Debug log
+    series = get_series_by_patient(patient_id)
     
-    # Formatear los datos de las series
-    series = []
-    for serie in series_data:
-        serie_dict = {
-            "id_serie": serie[0],
-            "nombre": serie[1],
-            "tipo_terapia": serie[2],
-            "sesiones_recomendadas": serie[3],
-            "sesiones_completadas": serie[4],
-            "serie_completa": serie[5] == 1,  # Convert to boolean
-            "posturas": get_posturas_by_serie(serie[0])
-        }
-        series.append(serie_dict)
+    # Añadir a cada serie sus posturas ordenadas
+    for serie in series:
+        serie.posturas = get_posturas_by_serie(serie.id_serie)
     
-    print(f"Series formateadas: {series}")  # Debug log
+    log_muestreado(logger, "dashboard_paciente", patient_id=patient_id, series=len(series))
     
     return templates.TemplateResponse(
         "patient_dashboard.html", 
@@ -0,0 +1,402 @@
+"""
+Evaluación de posturas a partir de puntos clave del cuerpo (keypoints).
+
+El cliente envía lotes de frames con los keypoints que detecta su modelo de
+pose (MediaPipe Pose, 33 puntos x [x, y, z, visibilidad], o COCO, 17 puntos x
+[x, y, confianza]). Todo el cálculo está vectorizado con NumPy sobre el lote
+completo (sin bucles de Python por frame ni por articulación):
+
+1. Los keypoints se reducen a un esqueleto común de 12 articulaciones
+   (hombros, codos, muñecas, caderas, rodillas y tobillos), de modo que una
+   referencia sirve para cualquiera de los dos formatos.
+2. Se calculan 8 ángulos articulares en el plano de la imagen (codos, hombros,
+   caderas y rodillas). Los ángulos no dependen de la posición, la escala ni
+   la rotación de la persona en la imagen. La profundidad (z) de MediaPipe se
+   descarta: con una sola cámara es demasiado ruidosa.
+3. Cada ángulo se compara con el de la plantilla de referencia de la postura
+   (postura.id_postura) con una gaussiana de desviación TOLERANCIA_GRADOS, y la
+   puntuación del frame (0-100) es la media ponderada por la confianza de los
+   tres puntos de cada ángulo. Los frames sin ningún ángulo fiable no puntúan.
+
+Presupuesto de latencia: PRESUPUESTO_US_POR_FRAME microsegundos de cálculo por
+frame en lotes de 30 frames (1 s de video a 30 fps), menos de una milésima parte
+del intervalo entre frames de la cámara. Cada llamada tiene un coste fijo de
+NumPy de unas decenas de microsegundos, por eso los clientes envían lotes y no
+frames sueltos. benchmarks/bench_puntuacion.py mide el tiempo por frame para
+distintos tamaños de lote y comprueba el presupuesto.
+"""
+import json
+import os
+import time
+import warnings
+from typing import List, NamedTuple, Optional
+import msgspec
+import numpy as np
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from .auth import get_user_info_from_token
+from .database import (
+    get_posturas_by_serie,
+    get_referencia_postura,
+    get_series_by_patient,
+    guardar_referencia_postura,
+    invalidaciones,
+)
+from .metricas import RutaInstrumentada, span
+from .modelos import ReferenciaPostura, RespuestaJSON
+from .utils import verificar_token_admin
+
+# Desviación (grados) con la que la puntuación de un ángulo cae al 61 % (1 sigma)
+TOLERANCIA_GRADOS = float(os.getenv("THERAPOSE_TOLERANCIA_GRADOS", "15"))
+# Confianza mínima de un keypoint para usar los ángulos en los que participa
+UMBRAL_CONFIANZA = 0.5
+# Frames por petición (10 s a 30 fps)
+MAX_FRAMES_LOTE = 300
+# Presupuesto de cálculo por frame (lotes de 30 frames), en microsegundos
+PRESUPUESTO_US_POR_FRAME = 10
+# Segundos que una referencia leída de la base de datos se reutiliza en este proceso
+# (si se guarda una nueva en cualquier worker, el bus de invalidación la descarta antes)
+REFERENCIAS_TTL_S = 60
+
+# Esqueleto común
+ARTICULACIONES = (
+    "hombro_izq", "hombro_der", "codo_izq", "codo_der", "muneca_izq", "muneca_der",
+    "cadera_izq", "cadera_der", "rodilla_izq", "rodilla_der", "tobillo_izq", "tobillo_der",
+)
+
+
+class FormatoKeypoints(NamedTuple):
+    puntos: int        # Keypoints por frame
+    valores: int       # Valores por keypoint
+    indices: tuple     # Posición de cada articulación de ARTICULACIONES
+    confianza: int     # Columna de la visibilidad/confianza
+
+
+FORMATOS = {
+    # x, y, z, visibilidad
+    "mediapipe": FormatoKeypoints(33, 4, (11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28), 3),
+    # x, y, confianza
+    "coco": FormatoKeypoints(17, 3, (5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16), 2),
+}
+
+
+def _indice(nombre: str) -> int:
+    return ARTICULACIONES.index(nombre)
+
+
+# Ángulos articulares: (extremo, vértice, extremo) en el esqueleto común
+ANGULOS = {
+    "codo_izq": ("hombro_izq", "codo_izq", "muneca_izq"),
+    "codo_der": ("hombro_der", "codo_der", "muneca_der"),
+    "hombro_izq": ("codo_izq", "hombro_izq", "cadera_izq"),
+    "hombro_der": ("codo_der", "hombro_der", "cadera_der"),
+    "cadera_izq": ("hombro_izq", "cadera_izq", "rodilla_izq"),
+    "cadera_der": ("hombro_der", "cadera_der", "rodilla_der"),
+    "rodilla_izq": ("cadera_izq", "rodilla_izq", "tobillo_izq"),
+    "rodilla_der": ("cadera_der", "rodilla_der", "tobillo_der"),
+}
+NOMBRES_ANGULOS = tuple(ANGULOS)
+# Índices (A, B, C) de todos los ángulos, para calcularlos de una vez con indexación avanzada
+_A, _B, _C = (np.array([_indice(triple[i]) for triple in ANGULOS.values()]) for i in range(3))
+
+
+class LoteKeypoints(msgspec.Struct):
+    """Cuerpo de las peticiones de puntuación y de referencia"""
+    frames: List[List[List[float]]]
+    formato: str = "mediapipe"
+
+
+def a_esqueleto(frames, formato: str = "mediapipe") -> tuple:
+    """
+    Convierte un lote de frames al esqueleto común.
+
+    Args:
+        frames: Array o lista anidada de forma (frames, puntos, valores) según el formato
+        formato (str): "mediapipe" o "coco"
+
+    Returns:
+        tuple: (puntos (F, 12, 2) float32 con x, y; confianza (F, 12) float32)
+
+    Raises:
+        ValueError: Si el formato no existe o la forma del lote no le corresponde
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de keypoints desconocido: {formato}")
+    esquema = FORMATOS[formato]
+    lote = np.asarray(frames, dtype=np.float32)
+    if lote.ndim != 3 or lote.shape[1:] != (esquema.puntos, esquema.valores) or lote.shape[0] == 0:
+        raise ValueError(
+            f"Se esperaban frames de {esquema.puntos} puntos x {esquema.valores} valores ({formato})")
+    seleccion = lote[:, esquema.indices]
+    return seleccion[..., :2], seleccion[..., esquema.confianza]
+
+
+def angulos_articulares(puntos: np.ndarray, confianza: np.ndarray) -> tuple:
+    """
+    Calcula los ángulos articulares de todos los frames.
+
+    Args:
+        puntos (np.ndarray): (F, 12, 2) coordenadas del esqueleto común
+        confianza (np.ndarray): (F, 12) confianza de cada articulación
+
+    Returns:
+        tuple: (ángulos (F, 8) en grados, pesos (F, 8)). El peso de un ángulo es la
+        menor confianza de sus tres puntos, o 0 si alguno no supera UMBRAL_CONFIANZA.
+    """
+    ba = puntos[:, _A] - puntos[:, _B]
+    bc = puntos[:, _C] - puntos[:, _B]
+    producto = np.einsum("fad,fad->fa", ba, bc)
+    normas = np.linalg.norm(ba, axis=-1) * np.linalg.norm(bc, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coseno = np.clip(producto / normas, -1.0, 1.0)
+    angulos = np.degrees(np.arccos(coseno))
+
+    pesos = np.minimum(np.minimum(confianza[:, _A], confianza[:, _B]), confianza[:, _C])
+    # Puntos superpuestos (norma 0) no definen un ángulo
+    pesos = np.where((pesos >= UMBRAL_CONFIANZA) & (normas > 0), pesos, 0.0)
+    return np.nan_to_num(angulos), pesos
+
+
+def normalizar_pose(puntos: np.ndarray) -> np.ndarray:
+    """
+    Centra cada pose en el punto medio de las caderas y la escala por la longitud
+    del tronco (punto medio de los hombros al de las caderas).
+
+    Args:
+        puntos (np.ndarray): (F, 12, 2) coordenadas del esqueleto común
+
+    Returns:
+        np.ndarray: (F, 12, 2) poses comparables entre personas y encuadres
+    """
+    caderas = puntos[:, [_indice("cadera_izq"), _indice("cadera_der")]].mean(axis=1, keepdims=True)
+    hombros = puntos[:, [_indice("hombro_izq"), _indice("hombro_der")]].mean(axis=1, keepdims=True)
+    tronco = np.linalg.norm(hombros - caderas, axis=-1, keepdims=True)
+    return (puntos - caderas) / np.where(tronco > 0, tronco, 1.0)
+
+
+def puntuar(angulos: np.ndarray, pesos: np.ndarray,
+            angulos_ref: np.ndarray, pesos_ref: np.ndarray) -> tuple:
+    """
+    Compara los ángulos de un lote con los de la referencia.
+
+    Args:
+        angulos (np.ndarray): (F, 8) ángulos del lote
+        pesos (np.ndarray): (F, 8) pesos del lote
+        angulos_ref (np.ndarray): (8,) ángulos de la referencia
+        pesos_ref (np.ndarray): (8,) pesos de la referencia (0 = ángulo no visible en ella)
+
+    Returns:
+        tuple: (puntuación por frame (F,) de 0 a 100, NaN si el frame no tiene
+        ningún ángulo fiable; desviación con signo (F, 8) en grados)
+    """
+    desviacion = angulos - angulos_ref
+    similitud = np.exp(-0.5 * np.square(desviacion / TOLERANCIA_GRADOS))
+    w = pesos * pesos_ref
+    total = w.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        puntuaciones = 100.0 * (w * similitud).sum(axis=1) / total
+    return np.where(total > 0, puntuaciones, np.nan), np.where(w > 0, desviacion, np.nan)
+
+
+def crear_referencia(puntos: np.ndarray, confianza: np.ndarray) -> tuple:
+    """
+    Construye la plantilla de una postura a partir de frames de una ejecución correcta.
+
+    Args:
+        puntos (np.ndarray): (F, 12, 2) coordenadas del esqueleto común
+        confianza (np.ndarray): (F, 12) confianza de cada articulación
+
+    Returns:
+        tuple: (plantilla (12, 2) normalizada: mediana de las poses; confianza (12,):
+        fracción de frames en que cada articulación era fiable)
+    """
+    fiable = confianza >= UMBRAL_CONFIANZA
+    normalizados = np.where(fiable[..., None], normalizar_pose(puntos), np.nan)
+    with warnings.catch_warnings():
+        # Articulaciones nunca fiables: mediana de un vector vacío (NaN)
+        warnings.simplefilter("ignore", RuntimeWarning)
+        plantilla = np.nanmedian(normalizados, axis=0)
+    return np.nan_to_num(plantilla).astype(np.float32), fiable.mean(axis=0).astype(np.float32)
+
+
+def angulos_referencia(referencia: ReferenciaPostura) -> tuple:
+    """Ángulos (8,) y pesos (8,) de una plantilla guardada"""
+    plantilla = np.asarray(json.loads(referencia.puntos), dtype=np.float32)[None]
+    confianza = np.asarray(json.loads(referencia.confianza), dtype=np.float32)[None]
+    angulos, pesos = angulos_articulares(plantilla, confianza)
+    return angulos[0], pesos[0]
+
+
+# Caché por proceso de los ángulos de referencia: id_postura -> (ángulos, pesos, instante)
+_referencias = {}
+
+
+def _olvidar_referencia(id_postura):
+    """Descarta los ángulos de una postura (o de todas) tras una escritura en cualquier worker"""
+    if id_postura is None:
+        _referencias.clear()
+    else:
+        _referencias.pop(int(id_postura), None)
+
+
+invalidaciones.suscribir("postura", _olvidar_referencia)
+
+
+def angulos_de_postura(id_postura: int) -> Optional[tuple]:
+    """Ángulos y pesos de referencia de una postura (caché de REFERENCIAS_TTL_S), o None"""
+    invalidaciones.sincronizar()
+    guardada = _referencias.get(id_postura)
+    if guardada and time.monotonic() - guardada[2] < REFERENCIAS_TTL_S:
+        return guardada[:2]
+    referencia = get_referencia_postura(id_postura)
+    if referencia is None:
+        _referencias.pop(id_postura, None)
+        return None
+    angulos, pesos = angulos_referencia(referencia)
+    _referencias[id_postura] = (angulos, pesos, time.monotonic())
+    return angulos, pesos
+
+
+def _redondear(valores: np.ndarray) -> list:
+    # NaN -> None (null en JSON)
+    return [None if np.isnan(v) else round(float(v), 1) for v in valores]
+
+
+def evaluar_lote(id_postura: int, lote: LoteKeypoints) -> Optional[dict]:
+    """
+    Puntúa un lote de frames frente a la referencia de la postura.
+
+    Args:
+        id_postura (int): ID de la postura que está realizando el paciente
+        lote (LoteKeypoints): Frames y formato de los keypoints
+
+    Returns:
+        dict: Puntuación por frame, media del lote y desviación media por ángulo,
+        o None si la postura no tiene referencia
+
+    Raises:
+        ValueError: Si los frames no corresponden al formato
+    """
+    referencia = angulos_de_postura(id_postura)
+    if referencia is None:
+        return None
+    with span("puntuacion.lote"):
+        puntos, confianza = a_esqueleto(lote.frames, lote.formato)
+        angulos, pesos = angulos_articulares(puntos, confianza)
+        puntuaciones, desviacion = puntuar(angulos, pesos, *referencia)
+    validos = ~np.isnan(puntuaciones)
+    with warnings.catch_warnings():
+        # Ángulos sin ningún frame fiable: media de un vector vacío (NaN)
+        warnings.simplefilter("ignore", RuntimeWarning)
+        desviacion_media = np.nanmean(desviacion, axis=0)
+    return {
+        "id_postura": id_postura,
+        "puntuaciones": _redondear(puntuaciones),
+        "puntuacion": round(float(puntuaciones[validos].mean()), 1) if validos.any() else None,
+        "frames_validos": int(validos.sum()),
+        "desviaciones": dict(zip(NOMBRES_ANGULOS, _redondear(desviacion_media))),
+    }
+
+
+def registrar_referencia(id_postura: int, lote: LoteKeypoints) -> ReferenciaPostura:
+    """
+    Calcula y guarda la plantilla de referencia de una postura.
+
+    Raises:
+        ValueError: Si los frames no corresponden al formato o la postura no existe
+    """
+    puntos, confianza = a_esqueleto(lote.frames, lote.formato)
+    plantilla, fiabilidad = crear_referencia(puntos, confianza)
+    referencia = ReferenciaPostura(
+        id_postura=id_postura,
+        puntos=json.dumps(np.round(plantilla.astype(float), 4).tolist()),
+        confianza=json.dumps(np.round(fiabilidad.astype(float), 3).tolist()),
+        muestras=len(puntos),
+    )
+    guardar_referencia_postura(referencia)
+    _referencias.pop(id_postura, None)
+    return referencia
+
+
+def _postura_del_paciente(patient_id: str, id_serie: int, id_postura: int) -> bool:
+    # La serie debe ser del paciente y la postura formar parte de ella
+    if not any(serie.id_serie == id_serie for serie in get_series_by_patient(patient_id)):
+        return False
+    return any(postura.id_postura == id_postura for postura in get_posturas_by_serie(id_serie))
+
+
+async def leer_lote(request: Request):
+    """Decodifica el cuerpo JSON; devuelve (lote, None) o (None, respuesta de error)"""
+    try:
+        lote = msgspec.json.decode(await request.body(), type=LoteKeypoints)
+    except msgspec.DecodeError as e:
+        return None, JSONResponse(content={"error": f"Lote de keypoints inválido: {e}"}, status_code=400)
+    if len(lote.frames) > MAX_FRAMES_LOTE:
+        return None, JSONResponse(
+            content={"error": f"Máximo {MAX_FRAMES_LOTE} frames por petición"}, status_code=413)
+    return lote, None
+
+
+# Configuración del router para la evaluación de posturas
+router = APIRouter(route_class=RutaInstrumentada)
+
+
+# Puntuación de un lote de frames durante la sesión
+@router.post("/api/puntuacion/{id_serie}/{id_postura}")
+async def puntuar_postura(request: Request, id_serie: int, id_postura: int):
+    """
+    Puntúa los keypoints de la postura que el paciente está realizando.
+
+    Args:
+        request (Request): Petición con cuerpo JSON {"formato": "mediapipe"|"coco", "frames": [...]}
+        id_serie (int): ID de la serie en curso
+        id_postura (int): ID de la postura actual
+
+    Returns:
+        JSONResponse: Puntuación por frame y del lote, o error 400/401/404/413
+    """
+    user_info = await run_in_threadpool(get_user_info_from_token, request)
+    if not user_info or "patient" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+
+    lote, error = await leer_lote(request)
+    if error:
+        return error
+    if not await run_in_threadpool(_postura_del_paciente, user_info.get("sub"), id_serie, id_postura):
+        return JSONResponse(content={"error": "Postura no encontrada en la serie"}, status_code=404)
+
+    try:
+        resultado = await run_in_threadpool(evaluar_lote, id_postura, lote)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    if resultado is None:
+        return JSONResponse(content={"error": "La postura no tiene referencia"}, status_code=404)
+    return RespuestaJSON(content=resultado)
+
+
+# Alta de la plantilla de referencia de una postura
+@router.post("/admin/posturas/{id_postura}/referencia")
+async def subir_referencia_postura(request: Request, id_postura: int):
+    """
+    Guarda la plantilla de referencia de una postura a partir de frames de una
+    ejecución correcta (mismo cuerpo que /api/puntuacion).
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        id_postura (int): ID de la postura
+
+    Returns:
+        JSONResponse: Plantilla guardada, o error 400/401/404/413
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    lote, error = await leer_lote(request)
+    if error:
+        return error
+    try:
+        referencia = await run_in_threadpool(registrar_referencia, id_postura, lote)
+    except ValueError as e:
+        codigo = 404 if "no existe" in str(e) else 400
+        return JSONResponse(content={"error": str(e)}, status_code=codigo)
+    return RespuestaJSON(content={"referencia": referencia}, status_code=201)
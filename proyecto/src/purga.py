@@ -0,0 +1,42 @@
+"""
+Limpieza única de datos huérfanos en bases de datos existentes.
+
+Antes del borrado en cascada (delete_patient en database.py), eliminar un paciente
+dejaba sus series, las posturas de esas series y sus sesiones en la base de datos,
+y todas las consultas las seguían recorriendo. Esta orden las borra por lotes
+cortos (se puede ejecutar con la aplicación en marcha) y, en SQLite, comprueba al
+final que no queda ninguna clave ajena rota (PRAGMA foreign_key_check).
+
+Uso (desde la raíz del repositorio):
+    python -m proyecto.src.purga
+"""
+import logging
+from .database import backend, get_connection, init_db, purgar_huerfanas
+
+
+def claves_ajenas_rotas() -> list:
+    """Filas (tabla, rowid, tabla padre) que incumplen una clave ajena (solo SQLite)"""
+    if backend.nombre != "sqlite":
+        return []
+    conn = get_connection()
+    try:
+        return [fila[:3] for fila in conn.execute("PRAGMA foreign_key_check").fetchall()]
+    finally:
+        conn.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    borradas = purgar_huerfanas()
+    for tabla, filas in borradas.items():
+        print(f"{tabla}: {filas} filas borradas")
+    if not borradas:
+        print("No hay datos huérfanos")
+    rotas = claves_ajenas_rotas()
+    if rotas:
+        print(f"Quedan {len(rotas)} filas con claves ajenas rotas, p. ej.: {rotas[:5]}")
+
+
+if __name__ == "__main__":
+    main()
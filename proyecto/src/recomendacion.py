@@ -0,0 +1,258 @@
+"""
+Recomendación de posturas por tipo de terapia a partir del resultado de las sesiones.
+
+Modelo: para cada tipo de terapia, una regresión lineal con regularización ridge
+de la mejora de la sesión (intensidad_inicio - intensidad_final) sobre los
+minutos que se hizo cada postura (el tiempo medido si la sesión lo registró, si
+no el planificado), con término independiente sin penalizar. El coeficiente de
+una postura es su efecto: cuánto baja la intensidad por minuto de postura,
+descontando lo que aportan las demás posturas con las que coincidió. La
+regularización acerca a 0 el efecto de las posturas con pocas sesiones.
+
+Incremental: solo se guardan los estadísticos suficientes X'X y X'y de cada
+tipo. Cada actualización lee las sesiones nuevas (id_sesion mayor que la última
+incorporada), suma su contribución con una matriz dispersa y resuelve un sistema
+de tantas ecuaciones como posturas usadas en el tipo. Cada RECONSTRUIR_S se
+parte de cero para recoger sesiones o series eliminadas.
+
+El formulario de creación de series nunca espera a este cálculo: lee una tabla
+ya ordenada en memoria. Si la tabla tiene más de ACTUALIZAR_S segundos, la
+petición lanza la actualización en un hilo y responde con la tabla vigente.
+Los eventos del bus de invalidación adelantan ese momento: una sesión nueva en
+cualquier worker marca la tabla como desactualizada, y un cambio de series o
+del catálogo fuerza además a recalcular desde cero.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+import numpy as np
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from scipy import sparse
+from .auth import get_user_info_from_token
+from .database import (
+    POSTURAS_POR_TIPO_TERAPIA,
+    get_catalogo_posturas,
+    get_posturas_by_tipo_terapia,
+    get_resultados_sesiones,
+    invalidaciones,
+)
+from .metricas import RutaInstrumentada
+from .modelos import PosturaRecomendada, RespuestaJSON
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima (segundos) de la tabla de recomendaciones antes de incorporar sesiones nuevas
+ACTUALIZAR_S = float(os.getenv("THERAPOSE_RECOMENDACIONES_S", "30"))
+# Cada cuánto se recalcula desde cero (recoge sesiones y series eliminadas)
+RECONSTRUIR_S = 3600
+# Penalización ridge de los efectos (en unidades de minutos al cuadrado)
+REGULARIZACION = 1.0
+
+router = APIRouter(route_class=RutaInstrumentada)
+
+
+class EstadisticasTerapia:
+    """
+    Estadísticos suficientes de la regresión de un tipo de terapia. La columna 0
+    es el término independiente; cada postura usada en el tipo añade una columna.
+    """
+
+    def __init__(self):
+        self.columnas = {}  # id_postura -> columna
+        self.xtx = np.zeros((1, 1))
+        self.xty = np.zeros(1)
+        # Sesiones que incluyeron cada columna (la 0 cuenta todas las sesiones)
+        self.sesiones = np.zeros(1, dtype=np.int64)
+
+    def _ampliar(self, ids_postura):
+        nuevas = [id_postura for id_postura in dict.fromkeys(ids_postura) if id_postura not in self.columnas]
+        if not nuevas:
+            return
+        for id_postura in nuevas:
+            self.columnas[id_postura] = len(self.columnas) + 1
+        extra = len(nuevas)
+        self.xtx = np.pad(self.xtx, ((0, extra), (0, extra)))
+        self.xty = np.pad(self.xty, (0, extra))
+        self.sesiones = np.pad(self.sesiones, (0, extra))
+
+    def agregar(self, fila_sesion: np.ndarray, mejora: np.ndarray, ids_postura: np.ndarray, minutos: np.ndarray):
+        """
+        Suma la contribución de un grupo de sesiones.
+
+        Args:
+            fila_sesion: (F,) índice de la sesión (0..S-1) de cada fila postura-sesión
+            mejora: (S,) mejora de cada sesión
+            ids_postura: (F,) postura de cada fila
+            minutos: (F,) minutos de la postura en la sesión
+        """
+        self._ampliar(ids_postura.tolist())
+        n = len(mejora)
+        columna = np.fromiter((self.columnas[i] for i in ids_postura.tolist()), dtype=np.int64,
+                              count=len(ids_postura))
+        filas = np.concatenate([np.arange(n), fila_sesion])
+        columnas = np.concatenate([np.zeros(n, dtype=np.int64), columna])
+        valores = np.concatenate([np.ones(n), minutos])
+        x = sparse.csr_matrix((valores, (filas, columnas)), shape=(n, len(self.xty)))
+        self.xtx += (x.T @ x).toarray()
+        self.xty += x.T @ mejora
+        self.sesiones += np.bincount(columnas, minlength=len(self.xty))
+
+    def efectos(self) -> dict:
+        """Efecto estimado de cada postura: id_postura -> (efecto por minuto, sesiones)"""
+        if not self.columnas or self.sesiones[0] == 0:
+            return {}
+        penalizacion = np.full(len(self.xty), REGULARIZACION)
+        penalizacion[0] = 0.0
+        coeficientes = np.linalg.solve(self.xtx + np.diag(penalizacion), self.xty)
+        return {id_postura: (float(coeficientes[columna]), int(self.sesiones[columna]))
+                for id_postura, columna in self.columnas.items()}
+
+
+class MotorRecomendaciones:
+    """Estadísticas de todos los tipos de terapia y última sesión incorporada"""
+
+    def __init__(self):
+        self.terapias = {}  # tipo_terapia -> EstadisticasTerapia
+        self.ultima_sesion = 0
+        self.creado = time.monotonic()
+
+    def incorporar(self, filas: list):
+        """Añade las filas de get_resultados_sesiones (ordenadas por id_sesion)"""
+        if not filas:
+            return
+        ids_sesion, tipos, mejoras, ids_postura, minutos = zip(*filas)
+        ids_sesion = np.asarray(ids_sesion, dtype=np.int64)
+        tipos = np.asarray(tipos, dtype=object)
+        mejoras = np.asarray(mejoras, dtype=np.float64)
+        ids_postura = np.asarray(ids_postura, dtype=np.int64)
+        minutos = np.asarray(minutos, dtype=np.float64)
+        for tipo in dict.fromkeys(tipos.tolist()):
+            del_tipo = tipos == tipo
+            sesiones, primera, fila_sesion = np.unique(ids_sesion[del_tipo], return_index=True,
+                                                      return_inverse=True)
+            estadisticas = self.terapias.setdefault(tipo, EstadisticasTerapia())
+            estadisticas.agregar(fila_sesion, mejoras[del_tipo][primera], ids_postura[del_tipo],
+                                 minutos[del_tipo])
+        self.ultima_sesion = int(ids_sesion[-1])
+
+    def tablas(self, catalogo: list) -> dict:
+        """
+        Posturas recomendadas de cada tipo, de mayor a menor efecto. Las posturas de
+        partida del tipo (POSTURAS_POR_TIPO_TERAPIA) sin sesiones cuentan con efecto 0
+        y conservan su orden entre ellas.
+        """
+        por_id = {postura.id_postura: postura for postura in catalogo}
+        por_nombre = {postura.nombre_es: postura.id_postura for postura in catalogo}
+        tablas = {}
+        for tipo in dict.fromkeys([*POSTURAS_POR_TIPO_TERAPIA, *self.terapias]):
+            efectos = self.terapias[tipo].efectos() if tipo in self.terapias else {}
+            partida = [por_nombre[nombre] for nombre in POSTURAS_POR_TIPO_TERAPIA.get(tipo, [])
+                       if nombre in por_nombre]
+            candidatas = [i for i in dict.fromkeys([*partida, *efectos]) if i in por_id]
+            posicion = {id_postura: orden for orden, id_postura in enumerate(candidatas)}
+            candidatas.sort(key=lambda i: (-efectos.get(i, (0.0, 0))[0], posicion[i]))
+            tablas[tipo] = [
+                PosturaRecomendada(i, por_id[i].nombre_es, por_id[i].nombre_sans,
+                                   round(efectos[i][0], 4) if i in efectos else None,
+                                   efectos[i][1] if i in efectos else None)
+                for i in candidatas
+            ]
+        return tablas
+
+
+# Estado por proceso: el motor solo lo toca el hilo que actualiza (bajo _cerrojo);
+# las peticiones leen _tablas, que se sustituye entera en cada actualización
+_motor: Optional[MotorRecomendaciones] = None
+_tablas = {}
+_sesiones_por_tipo = {}
+_actualizada = float("-inf")
+_reconstruir = False
+_cerrojo = threading.Lock()
+
+
+def actualizar():
+    """Incorpora las sesiones nuevas (o reconstruye si toca) y publica las tablas"""
+    global _motor, _tablas, _sesiones_por_tipo, _actualizada, _reconstruir
+    with _cerrojo:
+        if _motor is None or _reconstruir or time.monotonic() - _motor.creado > RECONSTRUIR_S:
+            _reconstruir = False
+            _motor = MotorRecomendaciones()
+        # Las sesiones archivadas siguen contando: son el historial del que se aprende
+        _motor.incorporar(get_resultados_sesiones(_motor.ultima_sesion, incluir_archivo=True))
+        _tablas = _motor.tablas(get_catalogo_posturas())
+        _sesiones_por_tipo = {tipo: int(estadisticas.sesiones[0])
+                              for tipo, estadisticas in _motor.terapias.items()}
+        _actualizada = time.monotonic()
+
+
+def _sesion_registrada(_id_serie):
+    global _actualizada
+    _actualizada = float("-inf")
+
+
+def _series_o_catalogo_modificados(_clave):
+    # Las sesiones de una serie eliminada ya están sumadas: hay que partir de cero
+    global _actualizada, _reconstruir
+    _reconstruir = True
+    _actualizada = float("-inf")
+
+
+invalidaciones.suscribir("sesion", _sesion_registrada)
+invalidaciones.suscribir("serie", _series_o_catalogo_modificados)
+invalidaciones.suscribir("postura", _series_o_catalogo_modificados)
+
+
+def _actualizar_registrando():
+    try:
+        actualizar()
+    except Exception:
+        logger.exception("Error al actualizar las recomendaciones de posturas")
+
+
+def actualizar_en_segundo_plano():
+    """Lanza una actualización en un hilo, salvo que ya haya una en curso"""
+    if not _cerrojo.locked():
+        threading.Thread(target=_actualizar_registrando, name="recomendaciones", daemon=True).start()
+
+
+def recomendaciones(tipo_terapia: str) -> Optional[list]:
+    """
+    Tabla vigente de un tipo de terapia (None si aún no se ha calculado). Si está
+    desactualizada, pide una actualización sin esperarla.
+    """
+    invalidaciones.sincronizar()
+    if time.monotonic() - _actualizada > ACTUALIZAR_S:
+        actualizar_en_segundo_plano()
+    return _tablas.get(tipo_terapia)
+
+
+# Posturas sugeridas para el formulario de creación de series
+@router.get("/api/recomendaciones/{tipo_terapia}")
+def get_recomendaciones(request: Request, tipo_terapia: str):
+    """
+    Devuelve las posturas de un tipo de terapia ordenadas por su efecto estimado
+    sobre la intensidad del malestar en las sesiones realizadas.
+
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        tipo_terapia (str): Tipo de terapia (ej: "Ansiedad", "Dolor de Espalda")
+
+    Returns:
+        JSONResponse: Posturas con su efecto y número de sesiones, y sesiones usadas
+        en el cálculo; error 401 si no es un instructor o 404 si el tipo no existe
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+
+    posturas = recomendaciones(tipo_terapia)
+    if posturas is None:
+        if tipo_terapia not in POSTURAS_POR_TIPO_TERAPIA:
+            return JSONResponse(content={"error": "Tipo de terapia no encontrado"}, status_code=404)
+        # Primera actualización aún en curso: posturas de partida, sin efectos
+        posturas = get_posturas_by_tipo_terapia(tipo_terapia)
+    return RespuestaJSON(content={"posturas": posturas,
+                                  "sesiones": _sesiones_por_tipo.get(tipo_terapia, 0)})
@@ -0,0 +1,420 @@
+"""
+Copias de seguridad en caliente de la base de datos SQLite.
+
+La copia usa la API de backup de SQLite (Connection.backup), que copia el archivo
+por páginas con la aplicación en marcha. El problema es que cualquier escritura
+de otra conexión reinicia la copia desde el principio: con tráfico continuo y
+una copia troceada, la copia no llega a terminar nunca. Por eso:
+
+- En modo WAL (proceso escritor): la conexión de origen mantiene abierta una
+  transacción de lectura durante toda la copia. La copia es una foto del instante
+  en que empezó, no se reinicia, y las escrituras siguen sin esperar (van al WAL).
+  Se copia en pasos de PAGINAS_POR_PASO páginas con una pausa de PAUSA_S entre
+  pasos para no acaparar el disco.
+- Con el diario clásico (rollback, el modo por defecto): una transacción de
+  lectura abierta bloquea los COMMIT de los demás. Se intenta primero la copia por
+  pasos sin bloquear; si se reinicia MAX_REINICIOS veces, se copia de una vez
+  dentro de una transacción de lectura, sin pausas, para que las escrituras
+  esperen solo lo que dura la copia.
+
+Cada copia se comprime con gzip en RESPALDOS_DIR (therapose-AAAAMMDD-HHMMSS.db.gz),
+se verifica (integrity_check y versión del esquema) y se conservan las últimas
+RETENER. Un cerrojo de archivo (flock) en RESPALDOS_DIR impide dos copias a la vez
+entre workers. Si THERAPOSE_RESPALDO_CADA_S está definido, cada worker arranca un
+hilo que hace la copia cuando la última es más antigua que ese intervalo.
+
+Con PostgreSQL las copias se hacen con pg_dump / pg_basebackup y este módulo no aplica.
+
+Uso desde la línea de comandos (desde la raíz del repositorio):
+    python -m proyecto.src.respaldo crear
+    python -m proyecto.src.respaldo verificar RUTA
+    python -m proyecto.src.respaldo restaurar RUTA DESTINO [--forzar]
+
+Métricas: therapose_respaldo_seconds (por fase) y therapose_respaldos_total (por resultado).
+"""
+import argparse
+import fcntl
+import gzip
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from .database import DB_PATH, SCHEMA_VERSION, backend
+from .metricas import RutaInstrumentada, registro
+from .utils import verificar_token_admin
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(route_class=RutaInstrumentada)
+
+# Directorio de las copias y número de copias que se conservan
+RESPALDOS_DIR = os.getenv("THERAPOSE_RESPALDOS_DIR", "proyecto/respaldos")
+RETENER = int(os.getenv("THERAPOSE_RESPALDOS_RETENER", "14"))
+# Intervalo de las copias programadas (sin definir: no se programan)
+CADA_S = float(os.getenv("THERAPOSE_RESPALDO_CADA_S", "0"))
+# Copia por pasos: páginas por paso y pausa entre pasos
+PAGINAS_POR_PASO = 64
+PAUSA_S = 0.005
+# Reinicios de la copia por pasos (diario rollback) antes de copiar de una vez
+MAX_REINICIOS = 3
+
+PREFIJO, SUFIJO = "therapose-", ".db.gz"
+
+registro.describir("therapose_respaldo_seconds", "Duración de las copias de seguridad, por fase (copia, compresion, verificacion).")
+registro.describir("therapose_respaldos_total", "Copias de seguridad realizadas, por resultado.")
+
+
+class RespaldoEnCurso(Exception):
+    """Otra copia (de este u otro worker) no ha terminado todavía"""
+
+
+class RespaldoInvalido(Exception):
+    """La copia no supera la verificación"""
+
+
+class _Reiniciada(Exception):
+    """La copia por pasos se ha reiniciado demasiadas veces"""
+
+
+def _conectar_origen() -> sqlite3.Connection:
+    if backend.solo_lectura:
+        uri = pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, isolation_level=None)
+    return sqlite3.connect(DB_PATH, isolation_level=None)
+
+
+def _copiar_por_pasos(origen: sqlite3.Connection, destino: sqlite3.Connection, limitar_reinicios: bool) -> int:
+    """Copia en pasos de PAGINAS_POR_PASO con pausas; devuelve los reinicios observados"""
+    estado = {"restantes": None, "reinicios": 0}
+
+    def progreso(status, restantes, total):
+        if estado["restantes"] is not None and restantes > estado["restantes"]:
+            estado["reinicios"] += 1
+            if limitar_reinicios and estado["reinicios"] >= MAX_REINICIOS:
+                raise _Reiniciada()
+        estado["restantes"] = restantes
+        time.sleep(PAUSA_S)
+
+    origen.backup(destino, pages=PAGINAS_POR_PASO, progress=progreso)
+    return estado["reinicios"]
+
+
+def copiar_base_datos(ruta_destino: str) -> dict:
+    """
+    Copia la base de datos en caliente a un archivo SQLite sin comprimir.
+
+    Args:
+        ruta_destino (str): Archivo de destino (se sobrescribe)
+
+    Returns:
+        dict: Modo de diario, estrategia usada ("pasos" o "bloque") y reinicios
+    """
+    origen = _conectar_origen()
+    destino = sqlite3.connect(ruta_destino)
+    try:
+        modo = origen.execute("PRAGMA journal_mode").fetchone()[0].lower()
+        if modo == "wal":
+            # La transacción de lectura fija la foto; las escrituras siguen en el WAL
+            origen.execute("BEGIN")
+            origen.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            reinicios = _copiar_por_pasos(origen, destino, limitar_reinicios=False)
+            origen.execute("COMMIT")
+            return {"modo": modo, "estrategia": "pasos", "reinicios": reinicios}
+        try:
+            reinicios = _copiar_por_pasos(origen, destino, limitar_reinicios=True)
+            return {"modo": modo, "estrategia": "pasos", "reinicios": reinicios}
+        except _Reiniciada:
+            logger.info("Copia por pasos reiniciada %d veces; se copia de una vez", MAX_REINICIOS)
+        origen.execute("BEGIN")
+        origen.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        origen.backup(destino, pages=-1)
+        origen.execute("COMMIT")
+        return {"modo": modo, "estrategia": "bloque", "reinicios": MAX_REINICIOS}
+    finally:
+        # La copia se guarda con el diario clásico: se abre sin -wal ni -shm
+        destino.execute("PRAGMA journal_mode=DELETE")
+        destino.close()
+        origen.close()
+
+
+def verificar_respaldo(ruta: str) -> dict:
+    """
+    Comprueba que una copia comprimida se puede restaurar: la descomprime en un
+    archivo temporal, pasa PRAGMA integrity_check y compara la versión del esquema.
+
+    Args:
+        ruta (str): Archivo .db.gz
+
+    Returns:
+        dict: Versión del esquema y filas por tabla
+
+    Raises:
+        RespaldoInvalido: Si la copia está dañada o es de un esquema más nuevo
+    """
+    inicio = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directorio:
+        copia = os.path.join(directorio, "verificacion.db")
+        try:
+            with gzip.open(ruta, "rb") as entrada, open(copia, "wb") as salida:
+                shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise RespaldoInvalido(f"No se puede descomprimir {ruta}: {e}")
+        conn = sqlite3.connect(f"file:{copia}?mode=ro", uri=True)
+        try:
+            try:
+                resultado = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+            except sqlite3.DatabaseError as e:
+                raise RespaldoInvalido(f"{ruta} no es una base de datos SQLite: {e}")
+            if resultado != ["ok"]:
+                raise RespaldoInvalido(f"integrity_check: {'; '.join(resultado[:5])}")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise RespaldoInvalido(f"Esquema {version} más nuevo que el de la aplicación ({SCHEMA_VERSION})")
+            tablas = [fila[0] for fila in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+            filas = {tabla: conn.execute(f'SELECT count(*) FROM "{tabla}"').fetchone()[0] for tabla in tablas}
+        finally:
+            conn.close()
+    registro.observar("therapose_respaldo_seconds", time.perf_counter() - inicio, fase="verificacion")
+    return {"version_esquema": version, "filas": filas}
+
+
+def listar_respaldos() -> list:
+    """Copias de RESPALDOS_DIR, de la más antigua a la más reciente"""
+    if not os.path.isdir(RESPALDOS_DIR):
+        return []
+    rutas = [os.path.join(RESPALDOS_DIR, nombre) for nombre in os.listdir(RESPALDOS_DIR)
+             if nombre.startswith(PREFIJO) and nombre.endswith(SUFIJO)]
+    return sorted(rutas, key=lambda ruta: (os.stat(ruta).st_mtime_ns, ruta))
+
+
+def _rotar():
+    for ruta in listar_respaldos()[:-RETENER] if RETENER > 0 else []:
+        logger.info("Se elimina la copia antigua %s", ruta)
+        os.remove(ruta)
+
+
+def _nombre_nuevo() -> str:
+    base = PREFIJO + datetime.now().strftime("%Y%m%d-%H%M%S")
+    ruta, n = os.path.join(RESPALDOS_DIR, base + SUFIJO), 1
+    while os.path.exists(ruta):
+        ruta, n = os.path.join(RESPALDOS_DIR, f"{base}-{n}{SUFIJO}"), n + 1
+    return ruta
+
+
+def _con_cerrojo(funcion):
+    """Ejecuta funcion() con el cerrojo de copias de RESPALDOS_DIR (sin esperar)"""
+    os.makedirs(RESPALDOS_DIR, exist_ok=True)
+    with open(os.path.join(RESPALDOS_DIR, ".cerrojo"), "w") as cerrojo:
+        try:
+            fcntl.flock(cerrojo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RespaldoEnCurso("Ya hay una copia de seguridad en curso")
+        try:
+            return funcion()
+        finally:
+            fcntl.flock(cerrojo, fcntl.LOCK_UN)
+
+
+def _crear() -> dict:
+    """Copia, comprime, verifica y rota; quien llama tiene el cerrojo"""
+    try:
+        with tempfile.TemporaryDirectory(dir=RESPALDOS_DIR) as directorio:
+            copia = os.path.join(directorio, "copia.db")
+            inicio = time.perf_counter()
+            detalles = copiar_base_datos(copia)
+            registro.observar("therapose_respaldo_seconds", time.perf_counter() - inicio, fase="copia")
+
+            # La compresión trabaja sobre la copia: no toca la base de datos en uso
+            inicio = time.perf_counter()
+            ruta = _nombre_nuevo()
+            with open(copia, "rb") as entrada, gzip.open(ruta + ".tmp", "wb", compresslevel=6) as salida:
+                shutil.copyfileobj(entrada, salida, 1024 * 1024)
+            registro.observar("therapose_respaldo_seconds", time.perf_counter() - inicio, fase="compresion")
+        try:
+            detalles.update(verificar_respaldo(ruta + ".tmp"))
+        except RespaldoInvalido:
+            os.remove(ruta + ".tmp")
+            raise
+        os.replace(ruta + ".tmp", ruta)
+        _rotar()
+    except Exception:
+        registro.incrementar("therapose_respaldos_total", resultado="error")
+        raise
+    registro.incrementar("therapose_respaldos_total", resultado="ok")
+    detalles.update(nombre=os.path.basename(ruta), bytes=os.path.getsize(ruta))
+    logger.info("Copia de seguridad %s (%s, %d reinicios)", detalles["nombre"], detalles["estrategia"],
+                detalles["reinicios"])
+    return detalles
+
+
+def crear_respaldo() -> dict:
+    """
+    Hace una copia de seguridad comprimida y verificada de la base de datos y
+    elimina las más antiguas.
+
+    Returns:
+        dict: Nombre y tamaño de la copia, estrategia de copia, reinicios y filas por tabla
+
+    Raises:
+        RespaldoEnCurso: Si otra copia no ha terminado
+        RespaldoInvalido: Si la copia recién hecha no supera la verificación
+    """
+    if backend.nombre != "sqlite":
+        raise RuntimeError("Las copias de PostgreSQL se hacen con pg_dump")
+    return _con_cerrojo(_crear)
+
+
+def restaurar_respaldo(ruta: str, destino: str, forzar: bool = False):
+    """
+    Verifica una copia y la descomprime en destino. La aplicación debe estar parada.
+
+    Args:
+        ruta (str): Archivo .db.gz
+        destino (str): Archivo de base de datos a crear
+        forzar (bool): Sobrescribir destino si existe (también borra sus -wal y -shm)
+    """
+    verificar_respaldo(ruta)
+    if os.path.exists(destino) and not forzar:
+        raise FileExistsError(f"{destino} ya existe (usa --forzar para sobrescribirlo)")
+    with gzip.open(ruta, "rb") as entrada, open(destino + ".tmp", "wb") as salida:
+        shutil.copyfileobj(entrada, salida, 1024 * 1024)
+    for sufijo in ("-wal", "-shm"):
+        if os.path.exists(destino + sufijo):
+            os.remove(destino + sufijo)
+    os.replace(destino + ".tmp", destino)
+
+
+def _antiguedad_ultima_s() -> float:
+    """Segundos desde la copia más reciente (infinito si no hay ninguna)"""
+    copias = listar_respaldos()
+    return time.time() - os.path.getmtime(copias[-1]) if copias else float("inf")
+
+
+def _programada():
+    # Otro worker puede haber hecho la copia mientras se esperaba el turno
+    if _antiguedad_ultima_s() >= CADA_S:
+        _crear()
+
+
+def _programadas():
+    while True:
+        if _antiguedad_ultima_s() >= CADA_S:
+            try:
+                _con_cerrojo(_programada)
+            except RespaldoEnCurso:
+                pass
+            except Exception:
+                logger.exception("Error en la copia de seguridad programada")
+        time.sleep(min(CADA_S, max(1.0, CADA_S - _antiguedad_ultima_s())))
+
+
+def programar_respaldos():
+    """Arranca el hilo de copias programadas si THERAPOSE_RESPALDO_CADA_S está definido"""
+    if CADA_S > 0 and backend.nombre == "sqlite":
+        threading.Thread(target=_programadas, name="respaldos", daemon=True).start()
+
+
+# Endpoints de administración
+@router.get("/admin/respaldos")
+def get_respaldos(request: Request):
+    """
+    Lista las copias de seguridad disponibles.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+
+    Returns:
+        JSONResponse: Nombre, tamaño y fecha de cada copia (la más reciente primero)
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    return JSONResponse(content={"respaldos": [
+        {"nombre": os.path.basename(ruta), "bytes": os.path.getsize(ruta),
+         "fecha": datetime.fromtimestamp(os.path.getmtime(ruta)).isoformat(timespec="seconds")}
+        for ruta in reversed(listar_respaldos())
+    ]})
+
+
+@router.post("/admin/respaldos")
+def post_respaldo(request: Request):
+    """
+    Hace una copia de seguridad en caliente de la base de datos.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+
+    Returns:
+        JSONResponse: Detalles de la copia, o error si no se puede hacer
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    if backend.nombre != "sqlite":
+        return JSONResponse(content={"error": "Las copias de PostgreSQL se hacen con pg_dump"}, status_code=400)
+    try:
+        return JSONResponse(content=crear_respaldo(), status_code=201)
+    except RespaldoEnCurso as e:
+        return JSONResponse(content={"error": str(e)}, status_code=409)
+    except RespaldoInvalido as e:
+        return JSONResponse(content={"error": f"La copia no supera la verificación: {e}"}, status_code=500)
+
+
+@router.post("/admin/respaldos/{nombre}/verificar")
+def post_verificar_respaldo(request: Request, nombre: str):
+    """
+    Verifica que una copia de seguridad se puede restaurar.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        nombre (str): Nombre del archivo de la copia
+
+    Returns:
+        JSONResponse: Versión del esquema y filas por tabla, o el motivo del fallo
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    ruta = os.path.join(RESPALDOS_DIR, os.path.basename(nombre))
+    if ruta not in listar_respaldos():
+        return JSONResponse(content={"error": "Copia no encontrada"}, status_code=404)
+    try:
+        return JSONResponse(content={"nombre": nombre, "valida": True, **verificar_respaldo(ruta)})
+    except RespaldoInvalido as e:
+        return JSONResponse(content={"nombre": nombre, "valida": False, "error": str(e)}, status_code=422)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copias de seguridad de la base de datos SQLite")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+    ordenes.add_parser("crear", help="Hace una copia en caliente en RESPALDOS_DIR")
+    verificar = ordenes.add_parser("verificar", help="Comprueba que una copia se puede restaurar")
+    verificar.add_argument("ruta")
+    restaurar = ordenes.add_parser("restaurar", help="Restaura una copia (con la aplicación parada)")
+    restaurar.add_argument("ruta")
+    restaurar.add_argument("destino")
+    restaurar.add_argument("--forzar", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.orden == "crear":
+            print(crear_respaldo())
+        elif args.orden == "verificar":
+            print(verificar_respaldo(args.ruta))
+        else:
+            restaurar_respaldo(args.ruta, args.destino, args.forzar)
+            print(f"Restaurada {args.ruta} en {args.destino}")
+    except (RespaldoEnCurso, RespaldoInvalido, FileExistsError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
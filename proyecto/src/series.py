@@ -1,21 +1,52 @@
 # Importaciones necesarias para el módulo de gestión de series terapéuticas
-from fastapi import APIRouter, Request, Form, status
+from fastapi import APIRouter, Request, Form, Query, status
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+import msgspec
 from .auth import get_user_info_from_token  # Función para validar autenticación
 from .database import (  # Funciones de base de datos para series y posturas
+    POSTURAS_POR_TIPO_TERAPIA,
     get_posturas_by_tipo_terapia,
     create_serie_terapeutica,
     get_series_by_patient,
     get_instructor_patients,
     get_sesiones_by_serie,
-    delete_serie
+    get_adherencia_posturas,
+    get_resumen_series_instructor,
+    delete_serie,
+    create_plantilla_serie,
+    get_plantillas_instructor,
+    delete_plantilla_serie,
+    asignar_plantilla_serie
 )
 
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada  # Instrumentación de tiempos
+from .modelos import RespuestaJSON  # Serialización JSON con msgspec
+
 # Configuración del router para las rutas de series terapéuticas
-router = APIRouter()
+router = APIRouter(route_class=RutaInstrumentada)
 # Configuración de plantillas para renderizar páginas HTML
-templates = Jinja2Templates(directory="proyecto/templates")
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
+
+# Pacientes por petición en la vista general de series
+MAX_PACIENTES_RESUMEN = 500
+# Pacientes por petición en la asignación de una plantilla
+MAX_PACIENTES_ASIGNACION = 500
+
+
+class CuerpoPlantilla(msgspec.Struct):
+    """Cuerpo de la creación de una plantilla; posturas es [[id_postura, orden, duracion], ...]"""
+    nombre: str
+    tipo_terapia: str
+    sesiones_recomendadas: int
+    posturas: List[Tuple[int, int, float]]
+
+
+class CuerpoAsignacion(msgspec.Struct):
+    """Cuerpo de la asignación de una plantilla: IDs de los pacientes"""
+    pacientes: List[str]
+
 
 # Página de creación de serie terapéutica - Vista GET
 @router.get("/instructor/create-serie", response_class=HTMLResponse)
@@ -63,7 +94,7 @@ def get_posturas(tipo_terapia: str):
     """
     # Obtener posturas desde la base de datos filtradas por tipo de terapia
     posturas = get_posturas_by_tipo_terapia(tipo_terapia)
-    return JSONResponse(content={"posturas": posturas})
+    return RespuestaJSON(content={"posturas": posturas})
 
 # Creación de nueva serie terapéutica - Vista POST
 @router.post("/instructor/create-serie")
@@ -176,24 +207,42 @@ def get_series_paciente(request: Request, patient_id: str):
     
     # Obtener series del paciente desde la base de datos
     series = get_series_by_patient(patient_id)
-    series_data = []
-    
-    # Formatear datos de series para respuesta JSON
-    for serie in series:
-        series_data.append({
-            'id_serie': serie[0],
-            'nombre': serie[1],
-            'tipo_terapia': serie[2],
-            'sesiones_recomendadas': serie[3],
-            'sesiones_completadas': serie[4] if len(serie) > 4 else 0,  # Valor por defecto si no existe
-            'serie_completa': serie[5] if len(serie) > 5 else 0         # Valor por defecto si no existe
-        })
     
-    return JSONResponse(content={"series": series_data})
+    return RespuestaJSON(content={"series": series})
+
+# API de vista general: series de varios pacientes del instructor en una sola petición
+@router.get("/api/resumen-series")
+def get_resumen_series(request: Request, paciente: Optional[List[str]] = Query(None)):
+    """
+    API endpoint que devuelve, de una vez, las series activas de los pacientes del
+    instructor con su progreso y un resumen de la última sesión de cada serie.
+    Sustituye a una llamada a /api/series-paciente por paciente (y a /api/sesiones-serie
+    por serie) cuando solo se necesita el estado general.
+    
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        paciente (list, optional): IDs de pacientes (parámetro repetido: ?paciente=a&paciente=b);
+            sin él, todos los pacientes del instructor
+        
+    Returns:
+        JSONResponse: Pacientes con sus series en formato JSON, o error 400 si se piden
+        más de MAX_PACIENTES_RESUMEN pacientes o 401 si no es un instructor
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    if paciente is not None and len(paciente) > MAX_PACIENTES_RESUMEN:
+        return JSONResponse(content={"error": f"Máximo {MAX_PACIENTES_RESUMEN} pacientes por petición"},
+                            status_code=400)
+    
+    # Solo se incluyen pacientes del propio instructor
+    pacientes = get_resumen_series_instructor(user_info.get("sub"), paciente)
+    return RespuestaJSON(content={"pacientes": pacientes})
 
 # API para obtener sesiones de una serie específica
 @router.get("/api/sesiones-serie/{id_serie}")
-def get_sesiones(request: Request, id_serie: int):
+def get_sesiones(request: Request, id_serie: int, archivo: bool = False):
     """
     API endpoint para obtener todas las sesiones completadas de una serie terapéutica.
     Incluye información detallada de cada sesión y duración formateada.
@@ -201,6 +250,7 @@ def get_sesiones(request: Request, id_serie: int):
     Args:
         request (Request): Objeto de petición HTTP para verificar autenticación
         id_serie (int): ID único de la serie terapéutica
+        archivo (bool): Incluir las sesiones archivadas (series inactivas antiguas)
         
     Returns:
         JSONResponse: Lista de sesiones con duración formateada en formato JSON
@@ -211,17 +261,51 @@ def get_sesiones(request: Request, id_serie: int):
         return JSONResponse(content={"error": "No autorizado"}, status_code=401)
     
     # Obtener sesiones de la serie desde la base de datos
-    sesiones = get_sesiones_by_serie(id_serie)
+    # Cada sesión ya trae su duración formateada (calculada al leer la fila)
+    sesiones = get_sesiones_by_serie(id_serie, incluir_archivo=archivo)
+    
+    return RespuestaJSON(content={"sesiones": sesiones})
+
+# API de adherencia: tiempo planificado frente a tiempo medido por postura
+@router.get("/api/adherencia-serie/{id_serie}")
+def get_adherencia_serie(request: Request, id_serie: int, archivo: bool = False):
+    """
+    API endpoint para comparar, postura por postura, el tiempo planificado en una serie
+    con el tiempo que el paciente realmente mantuvo cada postura y el que pasó en pausa.
     
-    # Formatear la duración de cada sesión para presentación amigable
-    for sesion in sesiones:
-        # Convertir tiempo decimal a minutos y segundos
-        minutos = int(sesion['tiempo_efectivo'])
-        segundos = round((sesion['tiempo_efectivo'] - minutos) * 60)
-        # Crear string formateado de duración
-        sesion['duracion_formateada'] = f"{minutos} min{' ' + str(segundos) + ' seg' if segundos > 0 else ''}"
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        id_serie (int): ID único de la serie terapéutica
+        archivo (bool): Incluir las sesiones archivadas
+        
+    Returns:
+        JSONResponse: Medias por postura (segundos planificados, reales y en pausa) y adherencia
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    return RespuestaJSON(content={"posturas": get_adherencia_posturas(id_serie, incluir_archivo=archivo)})
+
+# API de adherencia agregada sobre todo el historial de sesiones
+@router.get("/api/adherencia-posturas")
+def get_adherencia_historial(request: Request, archivo: bool = False):
+    """
+    API endpoint con la misma comparación que /api/adherencia-serie, agregada sobre todas
+    las sesiones registradas (qué posturas se acortan o se alargan de forma habitual).
     
-    return JSONResponse(content={"sesiones": sesiones})
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        archivo (bool): Incluir las sesiones archivadas
+        
+    Returns:
+        JSONResponse: Medias por postura (segundos planificados, reales y en pausa) y adherencia
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    return RespuestaJSON(content={"posturas": get_adherencia_posturas(incluir_archivo=archivo)})
 
 # API para eliminar una serie terapéutica
 @router.delete("/api/eliminar-serie/{id_serie}")
@@ -246,4 +330,112 @@ def eliminar_serie(request: Request, id_serie: int):
     if delete_serie(id_serie):
         return JSONResponse(content={"message": "Serie eliminada correctamente"})
     else:
-        return JSONResponse(content={"error": "Error al eliminar la serie"}, status_code=500) 
\ No newline at end of file
+        return JSONResponse(content={"error": "Error al eliminar la serie"}, status_code=500)
+
+# API de plantillas de series: la misma serie para muchos pacientes
+@router.get("/api/plantillas-serie")
+def get_plantillas(request: Request):
+    """
+    API endpoint que lista las plantillas de series del instructor con sus posturas.
+    
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        
+    Returns:
+        JSONResponse: Plantillas en formato JSON, o error 401 si no es un instructor
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    return RespuestaJSON(content={"plantillas": get_plantillas_instructor(user_info.get("sub"))})
+
+@router.post("/api/plantillas-serie")
+async def crear_plantilla(request: Request):
+    """
+    API endpoint para crear una plantilla de serie a partir de un cuerpo JSON con
+    nombre, tipo_terapia, sesiones_recomendadas y posturas ([id_postura, orden, duracion]).
+    
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        
+    Returns:
+        JSONResponse: ID de la plantilla creada (201), o error 400 si el cuerpo no es válido
+        o el tipo de terapia no existe
+    """
+    user_info = await run_in_threadpool(get_user_info_from_token, request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    try:
+        cuerpo = msgspec.json.decode(await request.body(), type=CuerpoPlantilla)
+    except msgspec.DecodeError as e:
+        return JSONResponse(content={"error": f"Plantilla inválida: {e}"}, status_code=400)
+    if not cuerpo.nombre.strip() or cuerpo.sesiones_recomendadas < 1:
+        return JSONResponse(content={"error": "La plantilla necesita un nombre y al menos una sesión"},
+                            status_code=400)
+    if cuerpo.tipo_terapia not in POSTURAS_POR_TIPO_TERAPIA:
+        return JSONResponse(content={"error": "Tipo de terapia no encontrado"}, status_code=400)
+    
+    try:
+        id_plantilla = await run_in_threadpool(
+            create_plantilla_serie, user_info.get("sub"), cuerpo.nombre.strip(), cuerpo.tipo_terapia,
+            cuerpo.sesiones_recomendadas, cuerpo.posturas)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    return JSONResponse(content={"id_plantilla": id_plantilla}, status_code=201)
+
+@router.delete("/api/plantillas-serie/{id_plantilla}")
+def eliminar_plantilla(request: Request, id_plantilla: int):
+    """
+    API endpoint para eliminar una plantilla del instructor. Las series ya creadas
+    a partir de ella no se modifican.
+    
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        id_plantilla (int): ID de la plantilla
+        
+    Returns:
+        JSONResponse: Mensaje de confirmación, o error 404 si no es una plantilla del instructor
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    if delete_plantilla_serie(user_info.get("sub"), id_plantilla):
+        return JSONResponse(content={"message": "Plantilla eliminada correctamente"})
+    return JSONResponse(content={"error": "Plantilla no encontrada"}, status_code=404)
+
+@router.post("/api/plantillas-serie/{id_plantilla}/asignar")
+async def asignar_plantilla(request: Request, id_plantilla: int):
+    """
+    API endpoint que crea, en una sola transacción, una serie a partir de la plantilla
+    para cada paciente del cuerpo JSON ({"pacientes": [...]}). Se omiten los pacientes
+    que no son del instructor y los que ya tienen una serie activa (se devuelven aparte).
+    
+    Args:
+        request (Request): Objeto de petición HTTP para verificar autenticación
+        id_plantilla (int): ID de la plantilla
+        
+    Returns:
+        JSONResponse: creadas (paciente -> id_serie), con_serie_activa y no_asignados,
+        o error 400 si el cuerpo no es válido o supera MAX_PACIENTES_ASIGNACION
+        pacientes y 404 si la plantilla no es del instructor
+    """
+    user_info = await run_in_threadpool(get_user_info_from_token, request)
+    if not user_info or "instructor" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    try:
+        cuerpo = msgspec.json.decode(await request.body(), type=CuerpoAsignacion)
+    except msgspec.DecodeError as e:
+        return JSONResponse(content={"error": f"Asignación inválida: {e}"}, status_code=400)
+    if len(cuerpo.pacientes) > MAX_PACIENTES_ASIGNACION:
+        return JSONResponse(content={"error": f"Máximo {MAX_PACIENTES_ASIGNACION} pacientes por petición"},
+                            status_code=400)
+    
+    resultado = await run_in_threadpool(asignar_plantilla_serie, user_info.get("sub"), id_plantilla,
+                                        cuerpo.pacientes)
+    if resultado is None:
+        return JSONResponse(content={"error": "Plantilla no encontrada"}, status_code=404)
+    return JSONResponse(content=resultado)
@@ -1,8 +1,10 @@
 # Importaciones necesarias para el módulo de gestión de sesiones de yoga terapéutico
 from fastapi import APIRouter, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, Response
 from datetime import datetime
+import hashlib
+import json
+import math
 from .auth import get_user_info_from_token  # Función para validar autenticación
 from typing import Optional
 from .database import (  # Funciones de base de datos para sesiones y series
@@ -12,10 +14,17 @@ from .database import (  # Funciones de base de datos para sesiones y series
     get_series_by_patient
 )
 
+from .metricas import PlantillasInstrumentadas, RutaInstrumentada  # Instrumentación de tiempos
+from .modelos import RespuestaJSON, codificar_json  # Serialización JSON con msgspec
+from .medios import medios_por_postura  # URLs de fotografías y videos de las posturas
+import logging
+
+logger = logging.getLogger(__name__)
+
 # Configuración del router para las rutas de sesiones
-router = APIRouter()
+router = APIRouter(route_class=RutaInstrumentada)
 # Configuración de plantillas para renderizar páginas HTML
-templates = Jinja2Templates(directory="proyecto/templates")
+templates = PlantillasInstrumentadas(directory="proyecto/templates")
 
 # Niveles de intensidad de dolor/malestar para evaluación del paciente
 NIVELES_INTENSIDAD = [
@@ -26,6 +35,79 @@ NIVELES_INTENSIDAD = [
     "Máximo dolor"   # Nivel 4
 ]
 
+# Límites de los tiempos por postura que envía el navegador al finalizar la sesión
+MAX_POSTURAS_SESION = 200
+MAX_SEGUNDOS_POSTURA = 4 * 3600
+
+# Service worker de la sesión (precarga del bundle y cola de sesiones sin conexión)
+RUTA_SERVICE_WORKER = "proyecto/static/js/sw.js"
+
+
+def construir_bundle(serie, posturas) -> tuple:
+    """
+    Construye el bundle de una sesión: serie, posturas ordenadas (con duraciones e
+    instrucciones) y URLs de sus medios, en un único documento JSON versionado.
+    
+    Args:
+        serie (Serie): Serie terapéutica (None si no se encontró entre las del paciente)
+        posturas (list): Posturas de la serie (SeriePostura)
+        
+    Returns:
+        tuple: (contenido JSON en bytes, versión). La versión es un hash del contenido,
+        por lo que cambia en cuanto cambia cualquier postura, duración o medio.
+    """
+    datos = {
+        "serie": serie,
+        "posturas": posturas,
+        "medios": medios_por_postura(postura.id_postura for postura in posturas),
+    }
+    version = hashlib.sha256(codificar_json(datos)).hexdigest()[:16]
+    datos["version"] = version
+    return codificar_json(datos), version
+
+
+def _leer_tiempos_posturas(texto: Optional[str]) -> Optional[list]:
+    """
+    Valida los tiempos por postura enviados al finalizar la sesión.
+    
+    Args:
+        texto (str): Lista JSON de [id_postura, segundos_reales, segundos_pausa] en el
+            orden en que se hicieron las posturas (vacío si el navegador no los midió)
+        
+    Returns:
+        list: Tuplas (id_postura, segundos_reales, segundos_pausa), o None si no hay tiempos
+        
+    Raises:
+        ValueError: Si el JSON no tiene esa forma o algún tiempo está fuera de rango
+    """
+    if not texto:
+        return None
+    try:
+        filas = json.loads(texto)
+    except ValueError:
+        raise ValueError("Tiempos por postura inválidos") from None
+    if not isinstance(filas, list) or len(filas) > MAX_POSTURAS_SESION:
+        raise ValueError("Tiempos por postura inválidos")
+    tiempos = []
+    for fila in filas:
+        if (not isinstance(fila, list) or len(fila) != 3 or not isinstance(fila[0], int)
+                or not all(isinstance(valor, (int, float)) and not isinstance(valor, bool) for valor in fila[1:])):
+            raise ValueError("Tiempos por postura inválidos")
+        id_postura, segundos, pausa = fila
+        if not all(math.isfinite(valor) and 0 <= valor <= MAX_SEGUNDOS_POSTURA for valor in (segundos, pausa)):
+            raise ValueError("Tiempo de postura fuera de rango")
+        tiempos.append((id_postura, float(segundos), float(pausa)))
+    return tiempos or None
+
+
+def _buscar_serie(series, id_serie):
+    return next((serie for serie in series if serie.id_serie == id_serie), None)
+
+
+def _espera_json(request: Request) -> bool:
+    # La cola sin conexión del service worker pide respuestas JSON en lugar de redirecciones
+    return "application/json" in request.headers.get("accept", "")
+
 # Página de inicio de sesión terapéutica - Vista GET
 @router.get("/patient/iniciar-sesion/{id_serie}", response_class=HTMLResponse)
 def iniciar_sesion_page(request: Request, id_serie: int):
@@ -52,8 +134,8 @@ def iniciar_sesion_page(request: Request, id_serie: int):
     series = get_series_by_patient(patient_id)
     
     for serie in series:
-        if serie[0] == id_serie:  # Encontrar la serie por ID
-            if serie[5] == 1:  # Verificar si serie_completa es True
+        if serie.id_serie == id_serie:  # Encontrar la serie por ID
+            if serie.serie_completa:
                 return templates.TemplateResponse("error.html", {
                     "request": request,
                     "error": "Esta serie ya ha sido completada. No se pueden iniciar más sesiones."
@@ -93,8 +175,8 @@ def iniciar_sesion(request: Request, id_serie: int, intensidad_inicio: int = For
     patient_id = user_info.get("sub")
     series = get_series_by_patient(patient_id)
     for serie in series:
-        if serie[0] == id_serie:  # Encontrar la serie por ID
-            if serie[5] == 1:  # Verificar si serie_completa es True
+        if serie.id_serie == id_serie:  # Encontrar la serie por ID
+            if serie.serie_completa:
                 return templates.TemplateResponse("error.html", {
                     "request": request,
                     "error": "Esta serie ya ha sido completada. No se pueden iniciar más sesiones."
@@ -102,6 +184,8 @@ def iniciar_sesion(request: Request, id_serie: int, intensidad_inicio: int = For
     
     # Obtener todas las posturas de la serie ordenadas según la configuración
     posturas = get_posturas_by_serie(id_serie)
+    # El bundle va incrustado en la página: la sesión arranca sin otra petición al servidor
+    bundle, version = construir_bundle(_buscar_serie(series, id_serie), posturas)
     
     # Renderizar página de sesión en curso con toda la información necesaria
     return templates.TemplateResponse("sesion_en_curso.html", {
@@ -109,10 +193,54 @@ def iniciar_sesion(request: Request, id_serie: int, intensidad_inicio: int = For
         "user": user_info,
         "id_serie": id_serie,
         "posturas": posturas,  # Lista ordenada de posturas con duraciones
+        # "</" se escapa para que el JSON no pueda cerrar la etiqueta <script> que lo contiene
+        "bundle_json": bundle.decode("utf-8").replace("</", "<\\/"),
+        "bundle_version": version,
         "intensidad_inicio": intensidad_inicio,
         "niveles_intensidad": NIVELES_INTENSIDAD
     })
 
+# Bundle de la sesión (consultable y cacheable por el service worker)
+@router.get("/api/sesion-bundle/{id_serie}")
+def get_sesion_bundle(request: Request, id_serie: int):
+    """
+    Devuelve en un único documento la serie, sus posturas ordenadas con duraciones e
+    instrucciones y las URLs de sus medios. La versión del bundle se usa como ETag.
+    
+    Args:
+        request (Request): Objeto de petición HTTP (admite If-None-Match)
+        id_serie (int): ID único de la serie terapéutica
+        
+    Returns:
+        Response: Bundle JSON con cabecera ETag, o 304 si el cliente tiene la versión vigente
+        JSONResponse: Error 401 si no está autenticado o 404 si la serie no es del paciente
+    """
+    user_info = get_user_info_from_token(request)
+    if not user_info or "patient" not in user_info.get("realm_access", {}).get("roles", []):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    
+    serie = _buscar_serie(get_series_by_patient(user_info.get("sub")), id_serie)
+    if serie is None:
+        return JSONResponse(content={"error": "Serie no encontrada"}, status_code=404)
+    
+    bundle, version = construir_bundle(serie, get_posturas_by_serie(id_serie))
+    cabeceras = {"etag": f'"{version}"', "cache-control": "private, no-cache"}
+    if request.headers.get("if-none-match") == cabeceras["etag"]:
+        return Response(status_code=304, headers=cabeceras)
+    return Response(content=bundle, media_type="application/json", headers=cabeceras)
+
+# Service worker servido desde la raíz para que su alcance cubra las páginas del paciente
+@router.get("/sw.js")
+def service_worker():
+    """
+    Entrega el service worker de las sesiones.
+    
+    Returns:
+        FileResponse: Script del service worker (sin caché HTTP, para que las actualizaciones se apliquen)
+    """
+    return FileResponse(RUTA_SERVICE_WORKER, media_type="application/javascript",
+                        headers={"cache-control": "no-cache"})
+
 # API para obtener posturas de una sesión (uso interno)
 @router.get("/api/posturas-sesion/{id_serie}")
 def get_posturas_sesion(id_serie: int):
@@ -124,11 +252,13 @@ def get_posturas_sesion(id_serie: int):
         id_serie (int): ID único de la serie terapéutica
         
     Returns:
-        JSONResponse: Lista de posturas con orden y duración en formato JSON
+        JSONResponse: Lista de posturas con orden y duración, y sus medios, en formato JSON
     """
     # Obtener posturas de la serie ordenadas según configuración
     posturas = get_posturas_by_serie(id_serie)
-    return JSONResponse(content={"posturas": posturas})
+    # Fotografías (variantes responsivas) y videos propios de cada postura, si existen
+    medios = medios_por_postura(postura.id_postura for postura in posturas)
+    return RespuestaJSON(content={"posturas": posturas, "medios": medios})
 
 # Finalización de sesión terapéutica - Vista POST
 @router.post("/patient/finalizar-sesion/{id_serie}")
@@ -139,7 +269,11 @@ def finalizar_sesion(
     intensidad_final: int = Form(...),
     comentario: str = Form(...),
     hora_inicio: Optional[str] = Form(None),
-    hora_fin: Optional[str] = Form(None)
+    hora_fin: Optional[str] = Form(None),
+    fecha: Optional[str] = Form(None),
+    id_cliente: Optional[str] = Form(None),
+    puntuacion: Optional[float] = Form(None),
+    tiempos_posturas: Optional[str] = Form(None)
 ):
     """
     Procesa la finalización de una sesión de yoga terapéutico y guarda los resultados.
@@ -153,15 +287,27 @@ def finalizar_sesion(
         comentario (str): Comentarios del paciente sobre la sesión
         hora_inicio (str, optional): Hora de inicio en formato HH:MM:SS
         hora_fin (str, optional): Hora de finalización en formato HH:MM:SS
+        fecha (str, optional): Fecha de la sesión (YYYY-MM-DD); las sesiones enviadas
+            desde la cola sin conexión llegan después del día en que se hicieron
+        id_cliente (str, optional): Identificador generado en el navegador; evita
+            registrar dos veces una sesión reenviada
+        puntuacion (float, optional): Puntuación media (0-100) de las posturas evaluadas
+            durante la sesión (/api/puntuacion); se guarda junto a intensidad_final
+        tiempos_posturas (str, optional): Lista JSON de [id_postura, segundos_reales,
+            segundos_pausa] medidos por el temporizador de la sesión, en orden
         
     Returns:
         RedirectResponse: Redirección al dashboard del paciente si es exitoso
         TemplateResponse: Página de error si ocurre algún problema
+        JSONResponse: Resultado en JSON si la petición lo pide (cabecera Accept)
     """
+    respuesta_json = _espera_json(request)
     try:
         # Verificar autenticación del paciente
         user_info = get_user_info_from_token(request)
         if not user_info or "patient" not in user_info.get("realm_access", {}).get("roles", []):
+            if respuesta_json:
+                return JSONResponse(content={"error": "No autorizado"}, status_code=401)
             return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
         
         # Convertir strings a enteros para validación
@@ -172,31 +318,62 @@ def finalizar_sesion(
         try:
             datetime.strptime(hora_inicio, '%H:%M:%S')
             datetime.strptime(hora_fin, '%H:%M:%S')
-        except ValueError:
+            fecha_sesion = datetime.strptime(fecha, '%Y-%m-%d').date() if fecha else datetime.now().date()
+        except (TypeError, ValueError):
+            if respuesta_json:
+                return JSONResponse(content={"error": "Formato de fecha u hora inválido"}, status_code=400)
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error": "Formato de hora inválido. Use HH:MM:SS"
             })
         
+        if puntuacion is not None and not 0 <= puntuacion <= 100:
+            if respuesta_json:
+                return JSONResponse(content={"error": "Puntuación fuera de rango (0-100)"}, status_code=400)
+            return templates.TemplateResponse("error.html", {
+                "request": request,
+                "error": "Puntuación fuera de rango (0-100)"
+            })
+        
+        # Tiempos medidos por el temporizador de la sesión (lista JSON del formulario)
+        try:
+            tiempos = _leer_tiempos_posturas(tiempos_posturas)
+        except ValueError as e:
+            if respuesta_json:
+                return JSONResponse(content={"error": str(e)}, status_code=400)
+            return templates.TemplateResponse("error.html", {"request": request, "error": str(e)})
+        
         # Crear registro de la sesión completada en la base de datos
-        create_sesion(
-            id_serie=id_serie,
-            fecha=datetime.now().date(),           # Fecha actual
-            hora_inicio=hora_inicio,               # Hora registrada por JavaScript
-            hora_fin=hora_fin,                     # Hora registrada por JavaScript
-            intensidad_inicio=intensidad_inicio,   # Evaluación inicial del paciente
-            intensidad_final=intensidad_final,     # Evaluación final del paciente
-            comentario=comentario                  # Reflexiones del paciente
-        )
+        try:
+            creada = create_sesion(
+                id_serie=id_serie,
+                fecha=fecha_sesion,                    # Fecha en que se realizó la sesión
+                hora_inicio=hora_inicio,               # Hora registrada por JavaScript
+                hora_fin=hora_fin,                     # Hora registrada por JavaScript
+                intensidad_inicio=intensidad_inicio,   # Evaluación inicial del paciente
+                intensidad_final=intensidad_final,     # Evaluación final del paciente
+                comentario=comentario,                 # Reflexiones del paciente
+                id_cliente=id_cliente or None,
+                puntuacion=puntuacion,                 # Media de las puntuaciones de postura
+                tiempos_posturas=tiempos               # Tiempo activo y en pausa de cada postura
+            )
+        except ValueError as e:
+            # Tiempos de posturas que no son de la serie
+            if respuesta_json:
+                return JSONResponse(content={"error": str(e)}, status_code=400)
+            return templates.TemplateResponse("error.html", {"request": request, "error": str(e)})
         
+        if respuesta_json:
+            mensaje = "Sesión registrada" if creada else "Sesión ya registrada"
+            return JSONResponse(content={"message": mensaje}, status_code=201 if creada else 200)
         # Redireccionar al dashboard tras completar la sesión exitosamente
         return RedirectResponse(url="/patient/dashboard", status_code=status.HTTP_302_FOUND)
         
     except Exception as e:
-        # Logging detallado para debugging de errores
-        import traceback
-        print("Error en finalizar_sesion:", str(e))
-        print(traceback.format_exc())
+        # Logging detallado (con traceback) para debugging de errores
+        logger.exception("Error en finalizar_sesion (id_serie=%s)", id_serie)
+        if respuesta_json:
+            return JSONResponse(content={"error": f"Error al finalizar la sesión: {str(e)}"}, status_code=500)
         
         # Mostrar página de error con información específica
         return templates.TemplateResponse("error.html", {
@@ -0,0 +1,294 @@
+"""
+Transmisión de keypoints en tiempo real durante la sesión (WebSocket).
+
+Enviar cada frame como una petición HTTP cuesta más que puntuarlo, por eso el
+navegador abre una sola conexión por sesión (/ws/sesion/{id_serie}) y envía por
+ella los frames empaquetados en binario. El servidor puntúa con el motor de
+puntuacion.py y devuelve puntuaciones suavizadas a frecuencia fija.
+
+Protocolo:
+- Texto del cliente, al empezar cada postura:
+  {"tipo": "postura", "id_postura": 3, "formato": "mediapipe"}
+- Binario del cliente: uno o más frames float32 little-endian seguidos. Cada frame
+  es [instante en ms desde el inicio de la sesión, valores de los keypoints del
+  formato (33x4 en MediaPipe, 17x3 en COCO)].
+- Texto del servidor, hasta FRECUENCIA_HZ veces por segundo si llegaron frames:
+  {"tipo": "puntuacion", "id_postura", "puntuacion" (suavizada), "instantanea",
+   "frames", "descartados", "media_sesion", "frames_sesion", "postura_detectada"}
+  postura_detectada es la postura que reconoce la biblioteca de referencia
+  (biblioteca.py) en la mayoría de los últimos FRAMES_CLASIFICACION frames del
+  tick, o null.
+- Errores recuperables: {"tipo": "error", "error": "..."}. Si el paciente no está
+  autenticado o la serie no es suya, se rechaza la conexión (código 1008).
+
+Memoria constante por conexión: los frames se guardan ya reducidos al esqueleto
+común en un búfer circular de CAPACIDAD_BUFFER frames. Si el cliente envía más
+rápido de lo que se puntúa, los frames más antiguos se sobrescriben, y en cada
+tick solo se puntúan los de los últimos EDAD_MAXIMA_MS: los frames atrasados se
+descartan (y se cuentan) en lugar de acumular retraso. La puntuación de un tick
+(ángulos y comparación con la referencia) es vectorial y se hace en el event loop;
+la clasificación con la biblioteca (consulta al cKDTree y reordenación de
+candidatos) cuesta bastante más, así que se hace en el threadpool y solo con los
+últimos FRAMES_CLASIFICACION frames, copiados del búfer antes de salir del loop.
+
+benchmarks/carga_websocket.py simula pacientes concurrentes contra un worker.
+"""
+import json
+import math
+import os
+import anyio
+import numpy as np
+from fastapi import APIRouter, WebSocket
+from starlette.concurrency import run_in_threadpool
+from .auth import get_user_info_from_token
+from .biblioteca import biblioteca_actual, postura_mayoritaria
+from .database import get_posturas_by_serie, get_series_by_patient
+from .modelos import codificar_json
+from .puntuacion import ARTICULACIONES, FORMATOS, a_esqueleto, angulos_articulares, angulos_de_postura, puntuar
+
+# Puntuaciones enviadas por segundo (como máximo)
+FRECUENCIA_HZ = float(os.getenv("THERAPOSE_WS_HZ", "5"))
+# Frames que caben en el búfer de cada conexión (2 s a 30 fps)
+CAPACIDAD_BUFFER = 64
+# Antigüedad máxima de un frame, respecto al más reciente, para puntuarlo
+EDAD_MAXIMA_MS = 500
+# Frames más recientes de cada tick que se clasifican con la biblioteca de referencia
+FRAMES_CLASIFICACION = 8
+# Constante de tiempo del suavizado exponencial de la puntuación
+SUAVIZADO_S = 1.0
+# Tamaño máximo de un mensaje binario (CAPACIDAD_BUFFER frames de MediaPipe)
+MAX_BYTES_MENSAJE = CAPACIDAD_BUFFER * (1 + 33 * 4) * 4
+
+# Configuración del router (las rutas WebSocket no pasan por RutaInstrumentada)
+router = APIRouter()
+
+
+class BufferKeypoints:
+    """
+    Búfer circular de tamaño fijo con los frames (esqueleto común) de una conexión.
+    escritos y leidos son contadores absolutos: su diferencia son los frames pendientes.
+    """
+    __slots__ = ("capacidad", "puntos", "confianza", "tiempos", "escritos", "leidos")
+
+    def __init__(self, capacidad: int = CAPACIDAD_BUFFER):
+        self.capacidad = capacidad
+        self.puntos = np.zeros((capacidad, len(ARTICULACIONES), 2), dtype=np.float32)
+        self.confianza = np.zeros((capacidad, len(ARTICULACIONES)), dtype=np.float32)
+        self.tiempos = np.zeros(capacidad, dtype=np.float64)
+        self.escritos = 0
+        self.leidos = 0
+
+    def escribir(self, tiempos: np.ndarray, puntos: np.ndarray, confianza: np.ndarray):
+        """Añade frames; si no caben, sobrescriben a los más antiguos"""
+        n = len(tiempos)
+        omitidos = max(0, n - self.capacidad)
+        indices = (self.escritos + omitidos + np.arange(n - omitidos)) % self.capacidad
+        self.tiempos[indices] = tiempos[omitidos:]
+        self.puntos[indices] = puntos[omitidos:]
+        self.confianza[indices] = confianza[omitidos:]
+        self.escritos += n
+
+    def leer_nuevos(self, edad_maxima_ms: float = EDAD_MAXIMA_MS) -> tuple:
+        """
+        Devuelve los frames pendientes recientes y los marca como leídos.
+
+        Returns:
+            tuple: (puntos, confianza, descartados): frames sobrescritos antes de
+            leerse más los que superan edad_maxima_ms respecto al más reciente
+        """
+        pendientes = self.escritos - self.leidos
+        n = min(pendientes, self.capacidad)
+        descartados = pendientes - n
+        self.leidos = self.escritos
+        if n == 0:
+            return None, None, descartados
+        indices = (self.escritos - n + np.arange(n)) % self.capacidad
+        tiempos = self.tiempos[indices]
+        vigentes = tiempos >= tiempos[-1] - edad_maxima_ms
+        descartados += int(n - vigentes.sum())
+        indices = indices[vigentes]
+        return self.puntos[indices], self.confianza[indices], descartados
+
+    def vaciar(self):
+        self.leidos = self.escritos
+
+
+class EstadoTransmision:
+    """Estado de una conexión: postura actual, búfer y puntuaciones acumuladas"""
+    __slots__ = ("posturas_serie", "buffer", "id_postura", "formato", "referencia",
+                 "suavizada", "descartados", "suma_sesion", "frames_sesion")
+
+    def __init__(self, posturas_serie: set):
+        self.posturas_serie = posturas_serie
+        self.buffer = BufferKeypoints()
+        self.id_postura = None
+        self.formato = None
+        self.referencia = None
+        self.suavizada = None
+        self.descartados = 0
+        self.suma_sesion = 0.0
+        self.frames_sesion = 0
+
+    def cambiar_postura(self, id_postura: int, formato: str, referencia):
+        self.id_postura = id_postura
+        self.formato = formato
+        self.referencia = referencia
+        self.suavizada = None
+        self.buffer.vaciar()
+
+    def recibir_frames(self, datos: bytes):
+        """
+        Decodifica un mensaje binario y guarda sus frames en el búfer.
+
+        Raises:
+            ValueError: Si no hay postura activa o el tamaño no corresponde al formato
+        """
+        if self.formato is None:
+            raise ValueError("Indique la postura antes de enviar frames")
+        esquema = FORMATOS[self.formato]
+        valores_frame = 1 + esquema.puntos * esquema.valores
+        if len(datos) % (4 * valores_frame):
+            raise ValueError(f"Cada frame debe tener {valores_frame} valores float32 ({self.formato})")
+        frames = np.frombuffer(datos, dtype="<f4").reshape(-1, valores_frame)
+        puntos, confianza = a_esqueleto(frames[:, 1:].reshape(-1, esquema.puntos, esquema.valores), self.formato)
+        self.buffer.escribir(frames[:, 0].astype(np.float64), puntos, confianza)
+
+    def evaluar(self, alfa: float) -> tuple:
+        """
+        Puntúa los frames nuevos y actualiza la puntuación suavizada.
+
+        Returns:
+            tuple: (mensaje para el cliente sin postura_detectada, (puntos, confianza) de
+                los últimos FRAMES_CLASIFICACION frames para reconocer la postura), o
+                (None, None) si no llegaron frames puntuables
+        """
+        puntos, confianza, descartados = self.buffer.leer_nuevos()
+        self.descartados += descartados
+        if puntos is None or self.referencia is None:
+            return None, None
+        angulos, pesos = angulos_articulares(puntos, confianza)
+        puntuaciones = puntuar(angulos, pesos, *self.referencia)[0]
+        validas = puntuaciones[~np.isnan(puntuaciones)]
+        if len(validas) == 0:
+            return None, None
+        instantanea = float(validas.mean())
+        self.suavizada = instantanea if self.suavizada is None else \
+            self.suavizada + alfa * (instantanea - self.suavizada)
+        self.suma_sesion += float(validas.sum())
+        self.frames_sesion += len(validas)
+        mensaje = {
+            "tipo": "puntuacion",
+            "id_postura": self.id_postura,
+            "puntuacion": round(self.suavizada, 1),
+            "instantanea": round(instantanea, 1),
+            "frames": len(validas),
+            "descartados": self.descartados,
+            "media_sesion": round(self.suma_sesion / self.frames_sesion, 1),
+            "frames_sesion": self.frames_sesion,
+        }
+        return mensaje, (puntos[-FRAMES_CLASIFICACION:], confianza[-FRAMES_CLASIFICACION:])
+
+
+def _postura_detectada(puntos: np.ndarray, confianza: np.ndarray):
+    biblioteca = biblioteca_actual()
+    if biblioteca is None:
+        return None
+    return postura_mayoritaria(biblioteca.clasificar(puntos, confianza)[0])
+
+
+def _posturas_del_paciente(patient_id: str, id_serie: int):
+    """IDs de las posturas de la serie, o None si la serie no es del paciente"""
+    if not any(serie.id_serie == id_serie for serie in get_series_by_patient(patient_id)):
+        return None
+    return {postura.id_postura for postura in get_posturas_by_serie(id_serie)}
+
+
+async def _enviar(websocket: WebSocket, mensaje: dict) -> bool:
+    try:
+        await websocket.send_text(codificar_json(mensaje).decode())
+    except (OSError, RuntimeError):
+        # El cliente se desconectó mientras se enviaba; _recibir recibirá el aviso de cierre
+        return False
+    return True
+
+
+async def _recibir(websocket: WebSocket, estado: EstadoTransmision):
+    """Lee mensajes hasta que el cliente se desconecta"""
+    while True:
+        mensaje = await websocket.receive()
+        if mensaje["type"] == "websocket.disconnect":
+            return
+        try:
+            if mensaje.get("bytes") is not None:
+                if len(mensaje["bytes"]) > MAX_BYTES_MENSAJE:
+                    raise ValueError("Mensaje demasiado grande")
+                estado.recibir_frames(mensaje["bytes"])
+            elif mensaje.get("text") is not None:
+                await _control(websocket, estado, mensaje["text"])
+        except (ValueError, TypeError, KeyError) as e:
+            await _enviar(websocket, {"tipo": "error", "error": str(e)})
+
+
+async def _control(websocket: WebSocket, estado: EstadoTransmision, texto: str):
+    try:
+        datos = json.loads(texto)
+    except ValueError:
+        raise ValueError("Mensaje de control inválido")
+    if not isinstance(datos, dict) or datos.get("tipo") != "postura":
+        raise ValueError("Mensaje de control desconocido")
+    id_postura = int(datos["id_postura"])
+    formato = datos.get("formato", "mediapipe")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de keypoints desconocido: {formato}")
+    if id_postura not in estado.posturas_serie:
+        raise ValueError("Postura no encontrada en la serie")
+    referencia = await run_in_threadpool(angulos_de_postura, id_postura)
+    estado.cambiar_postura(id_postura, formato, referencia)
+    if referencia is None:
+        await _enviar(websocket, {"tipo": "error", "error": "La postura no tiene referencia"})
+
+
+async def _emitir(websocket: WebSocket, estado: EstadoTransmision):
+    """Envía la puntuación a frecuencia fija; si se retrasa, no recupera los ticks perdidos"""
+    periodo = 1 / FRECUENCIA_HZ
+    alfa = 1 - math.exp(-periodo / SUAVIZADO_S)
+    siguiente = anyio.current_time()
+    while True:
+        siguiente += periodo
+        ahora = anyio.current_time()
+        if siguiente < ahora:
+            siguiente = ahora
+        await anyio.sleep(siguiente - ahora)
+        mensaje, recientes = estado.evaluar(alfa)
+        if mensaje is None:
+            continue
+        mensaje["postura_detectada"] = await run_in_threadpool(_postura_detectada, *recientes)
+        if not await _enviar(websocket, mensaje):
+            return
+
+
+# Flujo de keypoints de una sesión en curso
+@router.websocket("/ws/sesion/{id_serie}")
+async def transmitir_keypoints(websocket: WebSocket, id_serie: int):
+    """
+    Recibe los keypoints de la sesión en curso y devuelve puntuaciones suavizadas.
+
+    Args:
+        websocket (WebSocket): Conexión (cookie access_token del paciente)
+        id_serie (int): ID de la serie en curso
+    """
+    user_info = await run_in_threadpool(get_user_info_from_token, websocket)
+    if not user_info or "patient" not in user_info.get("realm_access", {}).get("roles", []):
+        await websocket.close(code=1008)
+        return
+    posturas = await run_in_threadpool(_posturas_del_paciente, user_info.get("sub"), id_serie)
+    if posturas is None:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    estado = EstadoTransmision(posturas)
+    async with anyio.create_task_group() as tareas:
+        tareas.start_soon(_emitir, websocket, estado)
+        await _recibir(websocket, estado)
+        tareas.cancel_scope.cancel()
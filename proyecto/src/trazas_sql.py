@@ -0,0 +1,228 @@
+# Módulo de trazado de consultas SQL: estadísticas por sentencia y log de consultas lentas
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from .utils import verificar_token_admin
+
+logger = logging.getLogger(__name__)
+
+# Umbral (en milisegundos) a partir del cual una consulta se considera lenta
+UMBRAL_LENTA_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+# Permite desactivar el trazado por completo (p. ej. en pruebas de rendimiento)
+TRAZADO_HABILITADO = os.getenv("SQL_TRACING_ENABLED", "1") == "1"
+
+# Sentencias sobre las que tiene sentido pedir EXPLAIN QUERY PLAN
+_SENTENCIAS_CON_PLAN = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+_RE_CADENAS = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMEROS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+# Configuración del router para el endpoint de administración
+router = APIRouter()
+
+
+def normalizar_sql(sql: str) -> str:
+    """
+    Normaliza una sentencia SQL para agrupar ejecuciones equivalentes:
+    literales -> ?, listas IN (?, ?, ...) -> (...), espacios colapsados.
+    """
+    sql = _RE_CADENAS.sub("?", sql)
+    sql = _RE_NUMEROS.sub("?", sql)
+    sql = _RE_ESPACIOS.sub(" ", sql).strip()
+    return _RE_LISTA_IN.sub("(...)", sql)
+
+
+class EstadisticaConsulta:
+    """
+    Acumulado de ejecuciones de una sentencia normalizada.
+    """
+    __slots__ = ("sql", "ejecuciones", "tiempo_total", "tiempo_max", "filas")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.ejecuciones = 0
+        self.tiempo_total = 0.0
+        self.tiempo_max = 0.0
+        self.filas = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "sql": self.sql,
+            "ejecuciones": self.ejecuciones,
+            "total_ms": round(self.tiempo_total * 1000, 3),
+            "media_ms": round(self.tiempo_total * 1000 / self.ejecuciones, 3) if self.ejecuciones else 0.0,
+            "max_ms": round(self.tiempo_max * 1000, 3),
+            "filas": self.filas,
+        }
+
+
+_estadisticas = {}
+_lock = threading.Lock()
+
+
+def _registrar_ejecucion(sql: str, duracion: float, filas: int) -> EstadisticaConsulta:
+    with _lock:
+        estadistica = _estadisticas.get(sql)
+        if estadistica is None:
+            estadistica = _estadisticas[sql] = EstadisticaConsulta(sql)
+        estadistica.ejecuciones += 1
+        estadistica.tiempo_total += duracion
+        if duracion > estadistica.tiempo_max:
+            estadistica.tiempo_max = duracion
+        if filas > 0:
+            estadistica.filas += filas
+    return estadistica
+
+
+def _registrar_filas(estadistica: EstadisticaConsulta, filas: int):
+    if estadistica is not None and filas:
+        with _lock:
+            estadistica.filas += filas
+
+
+def obtener_top_consultas(n: int = 20, orden: str = "total_ms") -> list:
+    """
+    Devuelve las n sentencias más costosas según el criterio indicado
+    (total_ms, media_ms, max_ms, ejecuciones o filas).
+    """
+    with _lock:
+        filas = [e.to_dict() for e in _estadisticas.values()]
+    if orden not in ("total_ms", "media_ms", "max_ms", "ejecuciones", "filas"):
+        orden = "total_ms"
+    filas.sort(key=lambda e: e[orden], reverse=True)
+    return filas[:n]
+
+
+def reiniciar_estadisticas():
+    with _lock:
+        _estadisticas.clear()
+
+
+def _plan_de_consulta(conexion: sqlite3.Connection, sql: str, parametros) -> str:
+    if not sql.lstrip().upper().startswith(_SENTENCIAS_CON_PLAN):
+        return ""
+    try:
+        # Cursor sin trazar para que el EXPLAIN no contamine las estadísticas
+        cursor = sqlite3.Cursor(conexion)
+        plan = cursor.execute("EXPLAIN QUERY PLAN " + sql, parametros).fetchall()
+        cursor.close()
+        return " | ".join(str(fila[-1]) for fila in plan)
+    except sqlite3.Error as e:
+        return f"(plan no disponible: {e})"
+
+
+class CursorTrazado(sqlite3.Cursor):
+    """
+    Cursor que mide cada execute/executemany y contabiliza las filas leídas o afectadas.
+    """
+
+    _estadistica = None
+
+    def _trazar(self, metodo, sql, parametros):
+        inicio = time.perf_counter()
+        resultado = metodo(sql, parametros)
+        duracion = time.perf_counter() - inicio
+        self._estadistica = _registrar_ejecucion(normalizar_sql(sql), duracion, self.rowcount)
+        if duracion * 1000 >= UMBRAL_LENTA_MS:
+            plan = _plan_de_consulta(self.connection, sql, parametros) if metodo.__name__ == "execute" else ""
+            logger.warning(
+                "Consulta lenta (%.1f ms): %s -- plan: %s",
+                duracion * 1000, self._estadistica.sql, plan or "-"
+            )
+        return resultado
+
+    def execute(self, sql, parameters=()):
+        return self._trazar(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._trazar(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        # El guion completo cuenta como una sola sentencia (sin plan)
+        inicio = time.perf_counter()
+        resultado = super().executescript(sql_script)
+        self._estadistica = _registrar_ejecucion(normalizar_sql(sql_script), time.perf_counter() - inicio, -1)
+        return resultado
+
+    def fetchone(self):
+        fila = super().fetchone()
+        if fila is not None:
+            _registrar_filas(self._estadistica, 1)
+        return fila
+
+    def fetchmany(self, size=None):
+        filas = super().fetchmany(size if size is not None else self.arraysize)
+        _registrar_filas(self._estadistica, len(filas))
+        return filas
+
+    def fetchall(self):
+        filas = super().fetchall()
+        _registrar_filas(self._estadistica, len(filas))
+        return filas
+
+
+class ConexionTrazada(sqlite3.Connection):
+    """
+    Conexión SQLite cuyos cursores son CursorTrazado. sqlite3.Connection.execute y
+    executemany crean su cursor sin pasar por cursor(), así que se redefinen aquí
+    para que las sentencias de conn.execute también se contabilicen.
+    """
+
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory if TRAZADO_HABILITADO else sqlite3.Cursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# Endpoint de administración con las sentencias más costosas
+@router.get("/admin/sql-stats")
+def sql_stats(request: Request, top: int = 20, orden: str = "total_ms"):
+    """
+    Devuelve la tabla de las sentencias SQL más costosas desde el arranque del proceso.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+        top (int): Número de sentencias a devolver
+        orden (str): Criterio de ordenación (total_ms, media_ms, max_ms, ejecuciones, filas)
+
+    Returns:
+        JSONResponse: Lista de sentencias con ejecuciones, tiempos y filas
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    return JSONResponse(content={
+        "umbral_lenta_ms": UMBRAL_LENTA_MS,
+        "consultas": obtener_top_consultas(top, orden)
+    })
+
+
+# Endpoint para reiniciar las estadísticas acumuladas
+@router.delete("/admin/sql-stats")
+def reset_sql_stats(request: Request):
+    """
+    Reinicia las estadísticas de consultas acumuladas en este proceso.
+
+    Args:
+        request (Request): Objeto de petición HTTP (requiere cabecera X-Admin-Token)
+
+    Returns:
+        JSONResponse: Mensaje de confirmación
+    """
+    if not verificar_token_admin(request):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+    reiniciar_estadisticas()
+    return JSONResponse(content={"message": "Estadísticas reiniciadas"})
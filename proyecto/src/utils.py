@@ -1 +1,23 @@
- 
\ No newline at end of file
+# Utilidades compartidas entre los routers de la aplicación
+import hmac
+import os
+from fastapi import Request
+
+# Token para los endpoints de administración (si no está definido, quedan deshabilitados)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+
+def verificar_token_admin(request: Request) -> bool:
+    """
+    Valida la cabecera X-Admin-Token contra la variable de entorno ADMIN_API_TOKEN.
+
+    Args:
+        request (Request): Objeto de petición HTTP
+
+    Returns:
+        bool: True si el token es válido, False en caso contrario
+    """
+    if not ADMIN_API_TOKEN:
+        return False
+    token = request.headers.get("x-admin-token", "")
+    return hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
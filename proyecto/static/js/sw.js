@@ -0,0 +1,165 @@
+// Service worker de TheraPose
+// 1. Precarga el bundle de la sesión y sus imágenes para que la sesión funcione con mala conexión
+// 2. Sirve las imágenes de /media desde caché (su contenido nunca cambia para una misma URL)
+// 3. Guarda en una cola (IndexedDB) las sesiones finalizadas sin conexión y las envía al volver la red
+
+const CACHE_SESIONES = 'therapose-sesiones-v1';
+const CACHE_MEDIOS = 'therapose-medios-v1';
+const CACHES_VIGENTES = [CACHE_SESIONES, CACHE_MEDIOS];
+const ETIQUETA_SYNC = 'finalizar-sesiones';
+const BD_NOMBRE = 'therapose';
+const BD_ALMACEN = 'sesiones_pendientes';
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        const nombres = await caches.keys();
+        await Promise.all(nombres
+            .filter(nombre => nombre.startsWith('therapose-') && !CACHES_VIGENTES.includes(nombre))
+            .map(nombre => caches.delete(nombre)));
+        await self.clients.claim();
+        // Un fallo de red deja la cola intacta hasta el próximo aviso
+        await enviarPendientes().catch(() => {});
+    })());
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/api/sesion-bundle/')) {
+        event.respondWith(redPrimero(request, CACHE_SESIONES));
+    } else if (url.pathname.startsWith('/media/') && !request.headers.has('range')
+               && !/\.(mp4|webm)$/.test(url.pathname)) {
+        // Los videos se piden por rangos: se dejan pasar a la red
+        event.respondWith(cachePrimero(request, CACHE_MEDIOS));
+    }
+});
+
+self.addEventListener('message', event => {
+    const datos = event.data || {};
+    if (datos.tipo === 'precargar') {
+        event.waitUntil(precargar(datos.bundle, datos.medios || []));
+    } else if (datos.tipo === 'encolar') {
+        event.waitUntil(encolar(datos.url, datos.campos));
+    } else if (datos.tipo === 'reintentar') {
+        event.waitUntil(enviarPendientes().catch(() => {}));
+    }
+});
+
+self.addEventListener('sync', event => {
+    if (event.tag === ETIQUETA_SYNC) {
+        // Si falla, el navegador vuelve a lanzar el evento sync más tarde
+        event.waitUntil(enviarPendientes());
+    }
+});
+
+async function redPrimero(request, nombreCache) {
+    const cache = await caches.open(nombreCache);
+    try {
+        const respuesta = await fetch(request);
+        if (respuesta.ok) {
+            await cache.put(request, respuesta.clone());
+        }
+        return respuesta;
+    } catch (error) {
+        const guardada = await cache.match(request);
+        if (guardada) return guardada;
+        throw error;
+    }
+}
+
+async function cachePrimero(request, nombreCache) {
+    const cache = await caches.open(nombreCache);
+    const guardada = await cache.match(request);
+    if (guardada) return guardada;
+    const respuesta = await fetch(request);
+    if (respuesta.ok) {
+        await cache.put(request, respuesta.clone());
+    }
+    return respuesta;
+}
+
+async function precargar(urlBundle, urlsMedios) {
+    if (urlBundle) {
+        const cacheSesiones = await caches.open(CACHE_SESIONES);
+        try {
+            await cacheSesiones.add(new Request(urlBundle, {credentials: 'same-origin'}));
+        } catch (error) {
+            // Sin conexión: se conserva la versión anterior del bundle, si existe
+        }
+    }
+    const cacheMedios = await caches.open(CACHE_MEDIOS);
+    await Promise.all(urlsMedios.map(async url => {
+        if (!(await cacheMedios.match(url))) {
+            try {
+                await cacheMedios.add(url);
+            } catch (error) {
+                // Se reintentará la próxima vez que se precargue la sesión
+            }
+        }
+    }));
+}
+
+// Cola de sesiones pendientes en IndexedDB
+function abrirBD() {
+    return new Promise((resolve, reject) => {
+        const peticion = indexedDB.open(BD_NOMBRE, 1);
+        peticion.onupgradeneeded = () => {
+            peticion.result.createObjectStore(BD_ALMACEN, {keyPath: 'id', autoIncrement: true});
+        };
+        peticion.onsuccess = () => resolve(peticion.result);
+        peticion.onerror = () => reject(peticion.error);
+    });
+}
+
+async function operarCola(modo, operacion) {
+    const bd = await abrirBD();
+    return new Promise((resolve, reject) => {
+        const transaccion = bd.transaction(BD_ALMACEN, modo);
+        const peticion = operacion(transaccion.objectStore(BD_ALMACEN));
+        transaccion.oncomplete = () => { bd.close(); resolve(peticion && peticion.result); };
+        transaccion.onerror = () => { bd.close(); reject(transaccion.error); };
+    });
+}
+
+async function encolar(url, campos) {
+    await operarCola('readwrite', almacen => almacen.add({url, campos, encolada: Date.now()}));
+    // Sin Background Sync, la página pide el reintento al recuperar la conexión (evento online)
+    if (self.registration.sync) {
+        await self.registration.sync.register(ETIQUETA_SYNC).catch(() => {});
+    }
+}
+
+let envioEnCurso = null;
+
+function enviarPendientes() {
+    // Un solo envío a la vez, aunque lleguen varios avisos (sync, online, activación)
+    if (!envioEnCurso) {
+        envioEnCurso = enviarCola().finally(() => { envioEnCurso = null; });
+    }
+    return envioEnCurso;
+}
+
+async function enviarCola() {
+    const pendientes = await operarCola('readonly', almacen => almacen.getAll());
+    for (const pendiente of pendientes || []) {
+        const respuesta = await fetch(pendiente.url, {
+            method: 'POST',
+            body: new URLSearchParams(pendiente.campos),
+            headers: {'Accept': 'application/json'},
+            credentials: 'same-origin'
+        });
+        if (respuesta.status === 401 || respuesta.status >= 500) {
+            // Sesión de usuario caducada o error del servidor: se conserva para reintentar
+            continue;
+        }
+        // Registrada (o rechazada de forma definitiva por datos inválidos): se saca de la cola
+        await operarCola('readwrite', almacen => almacen.delete(pendiente.id));
+        const clientes = await self.clients.matchAll({type: 'window'});
+        clientes.forEach(cliente => cliente.postMessage({tipo: 'sesion-enviada', ok: respuesta.ok}));
+    }
+}
@@ -0,0 +1,21 @@
+"""
+Configuración común de las pruebas (desde la raíz del repositorio: python -m pytest).
+
+database.py elige el backend y la ruta de la base de datos al importarse, así que
+antes de importar nada del proyecto se apunta THERAPOSE_DB_PATH a un archivo
+temporal (nunca se usa la base de datos del repositorio) y se quita
+THERAPOSE_DB_URL: las pruebas en el proceso usan SQLite. Las pruebas de paridad
+leen la URL de PostgreSQL de POSTGRES_URL.
+"""
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# URL de PostgreSQL para las pruebas de paridad (THERAPOSE_TEST_DB_URL o THERAPOSE_DB_URL)
+POSTGRES_URL = os.environ.pop("THERAPOSE_TEST_DB_URL", None) or os.environ.pop("THERAPOSE_DB_URL", None)
+for variable in ("THERAPOSE_DB_WRITER_SOCKET", "THERAPOSE_DB_WRITER_AUTHKEY"):
+    os.environ.pop(variable, None)
+os.environ["THERAPOSE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "pruebas.db")
@@ -0,0 +1,170 @@
+"""
+Escenario de las pruebas de paridad entre backends (test_paridad_backends.py).
+
+Siembra los mismos datos con las funciones de escritura de database.py (usuarios,
+series, sesiones, plantillas, referencias, archivo y borrado en cascada) y guarda
+el resultado de cada función de lectura en cada etapa. Se ejecuta en un
+subproceso por backend, porque database.py elige el backend al importarse:
+
+    python -m tests.escenario_paridad
+
+Escribe en la salida estándar un JSON con el backend usado, los resultados de las
+escrituras y los de las lecturas, por nombre (LECTURAS).
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+# Lecturas que se comparan entre backends, en el orden del escenario
+LECTURAS = [
+    "get_instructor",
+    "get_patient",
+    "get_instructor_patients",
+    "get_catalogo_posturas",
+    "get_posturas_by_tipo_terapia",
+    "buscar_posturas",
+    "buscar_posturas prefijo",
+    "buscar_posturas sin acentos",
+    "existe_postura",
+    "get_serie_activa",
+    "get_posturas_by_serie",
+    "get_sesiones_by_serie",
+    "get_tiempo_efectivo_serie",
+    "get_series_by_patient",
+    "get_resumen_series_instructor",
+    "get_adherencia_posturas serie",
+    "get_adherencia_posturas",
+    "get_resultados_sesiones",
+    "get_plantillas_instructor",
+    "get_resumen_series_instructor tras asignar",
+    "get_referencia_postura",
+    "get_medios_posturas",
+    "get_sesiones_by_serie tras archivar",
+    "get_sesiones_by_serie con archivo",
+    "get_adherencia_posturas con archivo",
+    "get_resultados_sesiones con archivo",
+    "get_instructor_patients tras borrar",
+    "get_series_by_patient tras borrar",
+]
+
+
+def _sin_created_at(valor):
+    if isinstance(valor, dict):
+        return {clave: _sin_created_at(v) for clave, v in valor.items() if clave != "created_at"}
+    if isinstance(valor, list):
+        return [_sin_created_at(v) for v in valor]
+    return valor
+
+
+def escenario() -> dict:
+    """Backend configurado en el entorno y resultados de escrituras y lecturas sobre él"""
+    import msgspec
+    from proyecto.src import database as db
+    from proyecto.src.modelos import ReferenciaPostura
+
+    escrituras, lecturas = {}, {}
+
+    def a_json(resultado, sin_orden=False):
+        valor = _sin_created_at(json.loads(msgspec.json.encode(resultado)))
+        # La búsqueda se compara como conjunto: el orden por relevancia depende del
+        # motor (bm25 en FTS5, ts_rank en PostgreSQL)
+        return sorted(valor, key=json.dumps) if sin_orden else valor
+
+    def escribir_sin_guardar(funcion, *args, **kwargs):
+        try:
+            return funcion(*args, **kwargs)
+        except Exception as e:
+            # Los errores se comparan por su clase común (UniqueViolation de psycopg es un IntegrityError)
+            clases = [clase.__name__ for clase in type(e).__mro__]
+            return {"excepcion": "IntegrityError" if "IntegrityError" in clases else clases[0]}
+
+    def escribir(nombre, funcion, *args, **kwargs):
+        resultado = escribir_sin_guardar(funcion, *args, **kwargs)
+        escrituras[nombre] = a_json(resultado)
+        return resultado
+
+    def leer(nombre, funcion, *args, sin_orden=False, **kwargs):
+        assert nombre in LECTURAS, nombre
+        resultado = funcion(*args, **kwargs)
+        lecturas[nombre] = a_json(resultado, sin_orden)
+        return resultado
+
+    db.init_db()
+    escribir("add_instructor", db.add_instructor, "inst-1", "inst", "inst@example.com", "Ins", "Tructor",
+             "1980-05-01", "F", "600000000")
+    for k, (nombre, apellido) in enumerate([("Ana", "Zeta"), ("Beto", "Alfa"), ("Cris", "Mora")]):
+        escribir(f"add_patient p{k}", db.add_patient, f"p{k}", f"pac{k}", f"p{k}@example.com", nombre, apellido,
+                 "2000-01-01", "M", "600000001")
+        escribir(f"add_patient_to_instructor p{k}", db.add_patient_to_instructor, "inst-1", f"p{k}")
+    escribir("add_patient duplicado", db.add_patient, "p0", "pac0", "p0@example.com", "Ana", "Zeta")
+    escribir("update_patient", db.update_patient, "p1", first_name="Roberto", celular="611111111")
+    leer("get_instructor", db.get_instructor, "inst-1")
+    leer("get_patient", db.get_patient, "p1")
+    leer("get_instructor_patients", db.get_instructor_patients, "inst-1")
+
+    leer("get_catalogo_posturas", db.get_catalogo_posturas)
+    posturas = [p.id_postura for p in leer("get_posturas_by_tipo_terapia", db.get_posturas_by_tipo_terapia,
+                                           "Ansiedad")]
+    leer("buscar_posturas", db.buscar_posturas, ["pose"], 100, sin_orden=True)
+    leer("buscar_posturas prefijo", db.buscar_posturas, ["cob"], 100, sin_orden=True)
+    leer("buscar_posturas sin acentos", db.buscar_posturas, ["savasana"], 100, sin_orden=True)
+    leer("existe_postura", db.existe_postura, posturas[0])
+
+    serie = escribir("create_serie_terapeutica", db.create_serie_terapeutica, "Serie 1", "Ansiedad", 4, "p0",
+                     [(posturas[0], 1, 1.5), (posturas[1], 2, 0.5), (posturas[2], 3, 2.0)])
+    escribir("create_serie_terapeutica con serie activa", db.create_serie_terapeutica, "Serie 2", "Ansiedad",
+             4, "p0", [(posturas[0], 1, 1.0)])
+    leer("get_serie_activa", db.get_serie_activa, "p0")
+    leer("get_posturas_by_serie", db.get_posturas_by_serie, serie)
+    for dia, intensidades in enumerate([(8, 5), (7, 3), (6, 2)], start=1):
+        escribir(f"create_sesion {dia}", db.create_sesion, serie, date(2024, 1, dia), "10:00", "10:30",
+                 *intensidades, f"sesión {dia}", id_cliente=f"cliente-{dia}", puntuacion=70.0 + dia,
+                 tiempos_posturas=[(posturas[0], 80.0, 5.0), (posturas[1], 30.0, 0.0),
+                                   (posturas[2], 115.0, 10.0)])
+    escribir("create_sesion repetida", db.create_sesion, serie, date(2024, 1, 1), "10:00", "10:30", 8, 5,
+             "sesión 1", id_cliente="cliente-1")
+    # Reenvíos simultáneos de la misma sesión: se registra una vez y el resto devuelve False sin error
+    with ThreadPoolExecutor(max_workers=8) as hilos:
+        reenvios = list(hilos.map(lambda _: escribir_sin_guardar(
+            db.create_sesion, serie, date(2024, 1, 4), "10:00", "10:30", 5, 1, "sesión 4",
+            id_cliente="cliente-4"), range(8)))
+    escrituras["create_sesion concurrente"] = sorted(reenvios, key=json.dumps)
+    escribir("create_sesion postura ajena", db.create_sesion, serie, date(2024, 1, 9), "10:00", "10:30", 8, 5,
+             "", tiempos_posturas=[(posturas[5], 10.0, 0.0)])
+    leer("get_sesiones_by_serie", db.get_sesiones_by_serie, serie)
+    leer("get_tiempo_efectivo_serie", db.get_tiempo_efectivo_serie, serie)
+    leer("get_series_by_patient", db.get_series_by_patient, "p0")
+    leer("get_resumen_series_instructor", db.get_resumen_series_instructor, "inst-1")
+    leer("get_adherencia_posturas serie", db.get_adherencia_posturas, serie)
+    leer("get_adherencia_posturas", db.get_adherencia_posturas)
+    leer("get_resultados_sesiones", db.get_resultados_sesiones, 0)
+
+    plantilla = escribir("create_plantilla_serie", db.create_plantilla_serie, "inst-1", "Plantilla",
+                         "Insomnio", 6, [(posturas[3], 1, 2.0), (posturas[4], 2, 1.0)])
+    leer("get_plantillas_instructor", db.get_plantillas_instructor, "inst-1")
+    escribir("asignar_plantilla_serie", db.asignar_plantilla_serie, "inst-1", plantilla,
+             ["p0", "p1", "p2", "otro"])
+    leer("get_resumen_series_instructor tras asignar", db.get_resumen_series_instructor, "inst-1")
+
+    referencia = ReferenciaPostura(posturas[0], "[[0.1, 0.2]]", "[0.9]", 3)
+    escribir("guardar_referencia_postura", db.guardar_referencia_postura, referencia)
+    leer("get_referencia_postura", db.get_referencia_postura, posturas[0])
+    leer("get_medios_posturas", db.get_medios_posturas, posturas[:3])
+
+    db.desactivar_series_anteriores("p0")
+    escribir("archivar_sesiones", db.archivar_sesiones, "2024-06-01", 100)
+    leer("get_sesiones_by_serie tras archivar", db.get_sesiones_by_serie, serie)
+    leer("get_sesiones_by_serie con archivo", db.get_sesiones_by_serie, serie, incluir_archivo=True)
+    leer("get_adherencia_posturas con archivo", db.get_adherencia_posturas, serie, incluir_archivo=True)
+    leer("get_resultados_sesiones con archivo", db.get_resultados_sesiones, 0, incluir_archivo=True)
+
+    escribir("delete_serie", db.delete_serie, serie)
+    escribir("delete_patient", db.delete_patient, "p1")
+    leer("get_instructor_patients tras borrar", db.get_instructor_patients, "inst-1")
+    leer("get_series_by_patient tras borrar", db.get_series_by_patient, "p1")
+    escribir("purgar_huerfanas", db.purgar_huerfanas)
+    return {"backend": db.backend.nombre, "escrituras": escrituras, "lecturas": lecturas}
+
+
+if __name__ == "__main__":
+    print(json.dumps(escenario()))
@@ -0,0 +1,99 @@
+"""Transiciones del cortacircuitos (proyecto/src/circuito.py)"""
+import threading
+import pytest
+from proyecto.src import circuito
+from proyecto.src.circuito import ABIERTO, CERRADO, SEMIABIERTO, Circuito, CircuitoAbierto
+
+
+def caer():
+    raise ConnectionError("servicio caído")
+
+
+def abrir(c: Circuito):
+    for _ in range(circuito.FALLOS_CONSECUTIVOS):
+        with pytest.raises(ConnectionError):
+            c.llamar(caer)
+    assert c.estado == ABIERTO
+
+
+class LlamadaEnCurso:
+    """Llamada a través del circuito en otro hilo, que no termina hasta que se libera"""
+
+    def __init__(self, c: Circuito, error: BaseException = None):
+        self.error = error
+        self.empezada = threading.Event()
+        self.liberar = threading.Event()
+        self.hilo = threading.Thread(target=lambda: self._llamar(c))
+        self.hilo.start()
+        assert self.empezada.wait(5)
+
+    def _funcion(self):
+        self.empezada.set()
+        assert self.liberar.wait(5)
+        if self.error is not None:
+            raise self.error
+
+    def _llamar(self, c: Circuito):
+        try:
+            c.llamar(self._funcion)
+        except (ConnectionError, CircuitoAbierto):
+            pass
+
+    def terminar(self):
+        self.liberar.set()
+        self.hilo.join(5)
+
+
+@pytest.fixture
+def sin_espera(monkeypatch):
+    monkeypatch.setattr(circuito, "ESPERA_S", 0.0)
+
+
+def test_abierto_rechaza_al_instante():
+    c = Circuito("prueba")
+    abrir(c)
+    with pytest.raises(CircuitoAbierto):
+        c.llamar(lambda: None)
+
+
+def test_sonda_correcta_cierra(sin_espera):
+    c = Circuito("prueba")
+    abrir(c)
+    assert c.llamar(lambda: "ok") == "ok"
+    assert c.estado == CERRADO
+
+
+def test_sonda_caida_vuelve_a_abrir(sin_espera):
+    c = Circuito("prueba")
+    abrir(c)
+    with pytest.raises(ConnectionError):
+        c.llamar(caer)
+    assert c.estado == ABIERTO
+
+
+def test_una_sola_sonda_en_semiabierto(sin_espera):
+    c = Circuito("prueba")
+    abrir(c)
+    sonda = LlamadaEnCurso(c)
+    assert c.estado == SEMIABIERTO
+    with pytest.raises(CircuitoAbierto):
+        c.llamar(lambda: None)
+    sonda.terminar()
+    assert c.estado == CERRADO
+
+
+@pytest.mark.parametrize("error", [None, ConnectionError("servicio caído")])
+def test_llamada_anterior_no_decide_en_semiabierto(sin_espera, error):
+    c = Circuito("prueba")
+    # Admitida con el circuito cerrado; termina cuando ya está semiabierto con la sonda en curso
+    rezagada = LlamadaEnCurso(c, error)
+    abrir(c)
+    sonda = LlamadaEnCurso(c, ConnectionError("servicio caído"))
+    assert c.estado == SEMIABIERTO
+    rezagada.terminar()
+    assert c.estado == SEMIABIERTO
+    with pytest.raises(CircuitoAbierto):
+        c.llamar(lambda: None)
+    # Decide la sonda
+    sonda.terminar()
+    assert c.estado == ABIERTO
@@ -0,0 +1,146 @@
+"""Avalanchas de llamadas idénticas concurrentes (proyecto/src/coalescencia.py)"""
+import threading
+import time
+import pytest
+from proyecto.src import coalescencia
+from proyecto.src.coalescencia import GrupoCoalescencia
+
+HILOS = 16
+
+
+def esperar(condicion, limite_s: float = 5.0):
+    fin = time.monotonic() + limite_s
+    while not condicion():
+        assert time.monotonic() < fin, "tiempo de espera agotado"
+        time.sleep(0.001)
+
+
+class FuncionLenta:
+    """Función de prueba que no termina hasta que se libera; cuenta sus ejecuciones"""
+
+    def __init__(self, resultado=None, error=None):
+        self.resultado = resultado
+        self.error = error
+        self.ejecuciones = 0
+        self.liberar = threading.Event()
+
+    def __call__(self, *args):
+        self.ejecuciones += 1
+        assert self.liberar.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.resultado
+
+
+def avalancha(grupo: GrupoCoalescencia, clave, funcion: FuncionLenta, hilos: int = HILOS) -> tuple:
+    """
+    Lanza `hilos` llamadas con la misma clave y libera la función cuando todas
+    esperan a la primera; devuelve (resultados, errores) por hilo.
+    """
+    resultados, errores = [None] * hilos, [None] * hilos
+
+    def llamada(i):
+        try:
+            resultados[i] = grupo.ejecutar(clave, funcion)
+        except Exception as e:
+            errores[i] = e
+
+    trabajadores = [threading.Thread(target=llamada, args=(i,)) for i in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    esperar(lambda: clave in grupo._vuelos and grupo._vuelos[clave].compartidas == hilos - 1)
+    funcion.liberar.set()
+    for trabajador in trabajadores:
+        trabajador.join(5)
+    return resultados, errores
+
+
+def test_avalancha_ejecuta_una_vez():
+    grupo = GrupoCoalescencia("prueba_una_vez")
+    funcion = FuncionLenta(resultado={"valor": 42})
+    resultados, errores = avalancha(grupo, "clave", funcion)
+    assert funcion.ejecuciones == 1
+    assert errores == [None] * HILOS
+    assert resultados == [{"valor": 42}] * HILOS
+    assert grupo.en_curso() == 0
+
+
+def test_error_llega_a_todas_las_llamadas():
+    grupo = GrupoCoalescencia("prueba_error")
+    error = RuntimeError("consulta fallida")
+    funcion = FuncionLenta(error=error)
+    resultados, errores = avalancha(grupo, "clave", funcion)
+    assert funcion.ejecuciones == 1
+    assert all(e is error for e in errores)
+    assert resultados == [None] * HILOS
+    assert grupo.en_curso() == 0
+
+
+def test_cada_llamada_recibe_su_copia():
+    grupo = GrupoCoalescencia("prueba_copias")
+    funcion = FuncionLenta(resultado=[{"id": 1}, {"id": 2}])
+    resultados, _ = avalancha(grupo, "clave", funcion)
+    # Ni la lista ni sus elementos se comparten entre llamadas (ni con el original)
+    listas = {id(resultado) for resultado in resultados} | {id(funcion.resultado)}
+    elementos = {id(elemento) for resultado in resultados for elemento in resultado}
+    assert len(listas) == HILOS + 1
+    assert len(elementos) == 2 * HILOS
+    resultados[0][0]["id"] = 99
+    assert all(resultado[0] == {"id": 1} for resultado in resultados[1:])
+    assert funcion.resultado[0] == {"id": 1}
+
+
+def test_claves_distintas_no_se_unen():
+    grupo = GrupoCoalescencia("prueba_claves")
+    funcion = FuncionLenta(resultado=1)
+    funcion.liberar.set()
+    assert grupo.ejecutar("a", funcion) == 1
+    assert grupo.ejecutar("a", funcion) == 1
+    assert funcion.ejecuciones == 2
+
+
+def test_lectura_tras_escritura_no_se_une_a_la_anterior():
+    ejecuciones, liberar = [], threading.Event()
+
+    @coalescencia.coalescer
+    def lectura_prueba_generacion(id_serie):
+        ejecuciones.append(id_serie)
+        assert liberar.wait(5)
+        return len(ejecuciones)
+
+    vuelos = coalescencia.grupo("lectura_prueba_generacion")._vuelos
+    resultados = {}
+
+    def llamada(nombre):
+        resultados[nombre] = lectura_prueba_generacion(7)
+
+    anterior = threading.Thread(target=llamada, args=("anterior",))
+    anterior.start()
+    esperar(lambda: len(ejecuciones) == 1)
+    # Antes de la escritura: se une a la lectura en curso
+    unida = threading.Thread(target=llamada, args=("unida",))
+    unida.start()
+    esperar(lambda: any(vuelo.compartidas == 1 for vuelo in vuelos.values()))
+
+    # Después de una escritura: ejecuta de nuevo aunque la anterior siga en curso
+    coalescencia.nueva_generacion()
+    posterior = threading.Thread(target=llamada, args=("posterior",))
+    posterior.start()
+    esperar(lambda: len(ejecuciones) == 2)
+    assert len(vuelos) == 2
+
+    liberar.set()
+    for hilo in (anterior, unida, posterior):
+        hilo.join(5)
+    assert ejecuciones == [7, 7]
+    assert resultados["anterior"] == resultados["unida"]
+    assert not vuelos
+
+
+@pytest.mark.parametrize("hilos", [2, 64])
+def test_avalancha_de_distintos_tamanos(hilos):
+    grupo = GrupoCoalescencia(f"prueba_{hilos}")
+    funcion = FuncionLenta(resultado="ok")
+    resultados, errores = avalancha(grupo, ("serie", 1), funcion, hilos)
+    assert funcion.ejecuciones == 1
+    assert resultados == ["ok"] * hilos
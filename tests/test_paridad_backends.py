@@ -0,0 +1,83 @@
+"""
+Paridad de la capa de datos entre SQLite y PostgreSQL (proyecto/src/almacenamiento.py).
+
+El escenario de escenario_paridad.py se ejecuta sobre una base de datos SQLite
+temporal y, si hay una URL de PostgreSQL (THERAPOSE_TEST_DB_URL o
+THERAPOSE_DB_URL, ver conftest.py), sobre una base de datos temporal creada en ese
+servidor y eliminada al terminar (el usuario necesita CREATEDB, y psycopg se instala
+con requirements-postgres.txt). Cada lectura de database.py debe devolver lo mismo
+en los dos backends.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from urllib.parse import urlsplit
+import pytest
+from .conftest import POSTGRES_URL, RAIZ
+from .escenario_paridad import LECTURAS
+
+sin_postgres = pytest.mark.skipif(not POSTGRES_URL, reason="sin URL de PostgreSQL (THERAPOSE_TEST_DB_URL)")
+
+
+def ejecutar_escenario(backend: str, url: str = None) -> dict:
+    """Ejecuta el escenario en un subproceso con el backend indicado"""
+    entorno = {clave: valor for clave, valor in os.environ.items() if not clave.startswith("THERAPOSE_DB_")}
+    # Base de datos SQLite temporal también con PostgreSQL: nunca se toca la del repositorio
+    entorno["THERAPOSE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "paridad.db")
+    if url:
+        entorno["THERAPOSE_DB_URL"] = url
+    salida = subprocess.run([sys.executable, "-m", "tests.escenario_paridad"], env=entorno, cwd=RAIZ,
+                            capture_output=True, text=True)
+    assert salida.returncode == 0, salida.stderr
+    resultado = json.loads(salida.stdout)
+    assert resultado["backend"] == backend
+    return resultado
+
+
+@pytest.fixture(scope="module")
+def en_sqlite() -> dict:
+    return ejecutar_escenario("sqlite")
+
+
+@pytest.fixture(scope="module")
+def en_postgres() -> dict:
+    psycopg = pytest.importorskip("psycopg")
+    nombre = f"therapose_paridad_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(POSTGRES_URL, autocommit=True) as conn:
+        conn.execute(f"CREATE DATABASE {nombre}")
+    try:
+        yield ejecutar_escenario("postgres", urlsplit(POSTGRES_URL)._replace(path=f"/{nombre}").geturl())
+    finally:
+        with psycopg.connect(POSTGRES_URL, autocommit=True) as conn:
+            conn.execute(f"DROP DATABASE IF EXISTS {nombre}")
+
+
+def test_escenario_en_sqlite(en_sqlite):
+    lecturas, escrituras = en_sqlite["lecturas"], en_sqlite["escrituras"]
+    assert sorted(lecturas) == sorted(LECTURAS)
+    # Pacientes en el orden en que se asignaron, no en el del índice
+    assert [p["id"] for p in lecturas["get_instructor_patients"]] == ["p0", "p1", "p2"]
+    assert escrituras["add_patient duplicado"] == {"excepcion": "IntegrityError"}
+    assert escrituras["create_serie_terapeutica con serie activa"] == {"excepcion": "ValueError"}
+    assert escrituras["create_sesion repetida"] is False
+    assert escrituras["create_sesion concurrente"] == [False] * 7 + [True]
+    assert escrituras["asignar_plantilla_serie"]["con_serie_activa"] == ["p0"]
+    assert escrituras["asignar_plantilla_serie"]["no_asignados"] == ["otro"]
+    assert len(lecturas["get_sesiones_by_serie"]) == 4
+    assert lecturas["get_sesiones_by_serie tras archivar"] == []
+    assert lecturas["get_sesiones_by_serie con archivo"] == lecturas["get_sesiones_by_serie"]
+    assert lecturas["get_series_by_patient tras borrar"] == []
+
+
+@sin_postgres
+@pytest.mark.parametrize("lectura", LECTURAS)
+def test_lectura_igual_en_ambos_backends(en_sqlite, en_postgres, lectura):
+    assert en_postgres["lecturas"][lectura] == en_sqlite["lecturas"][lectura]
+
+
+@sin_postgres
+def test_escrituras_iguales_en_ambos_backends(en_sqlite, en_postgres):
+    assert en_postgres["escrituras"] == en_sqlite["escrituras"]
@@ -0,0 +1,51 @@
+"""Puntuación por ticks de la transmisión de keypoints (proyecto/src/transmision.py)"""
+import numpy as np
+from proyecto.src import transmision
+from proyecto.src.puntuacion import FORMATOS, angulos_articulares
+from proyecto.src.transmision import FRAMES_CLASIFICACION, EstadoTransmision
+
+
+def mensaje_mediapipe(frames: int, inicio_ms: float = 0.0) -> bytes:
+    """Frames de MediaPipe con el mismo esqueleto, a 30 fps"""
+    esquema = FORMATOS["mediapipe"]
+    rng = np.random.default_rng(0)
+    puntos = np.concatenate([rng.random((esquema.puntos, 2)), np.ones((esquema.puntos, 2))], axis=1)
+    datos = np.empty((frames, 1 + esquema.puntos * esquema.valores), dtype="<f4")
+    datos[:, 0] = inicio_ms + np.arange(frames) * 1000 / 30
+    datos[:, 1:] = puntos.reshape(-1)
+    return datos.tobytes()
+
+
+def estado_con_referencia() -> EstadoTransmision:
+    estado = EstadoTransmision({1})
+    estado.cambiar_postura(1, "mediapipe", None)
+    # Referencia: los ángulos del propio esqueleto de prueba (puntuación máxima)
+    estado.recibir_frames(mensaje_mediapipe(1))
+    puntos, confianza, _ = estado.buffer.leer_nuevos()
+    angulos, pesos = angulos_articulares(puntos, confianza)
+    estado.referencia = (angulos[0], pesos[0])
+    return estado
+
+
+def test_sin_frames_no_hay_mensaje():
+    assert estado_con_referencia().evaluar(0.5) == (None, None)
+
+
+def test_solo_se_clasifican_los_frames_recientes():
+    estado = estado_con_referencia()
+    estado.recibir_frames(mensaje_mediapipe(12))
+    mensaje, (puntos, confianza) = estado.evaluar(0.5)
+    assert mensaje["frames"] == 12
+    assert "postura_detectada" not in mensaje
+    assert len(puntos) == len(confianza) == FRAMES_CLASIFICACION
+
+
+def test_frames_a_clasificar_son_copias_del_buffer():
+    estado = estado_con_referencia()
+    estado.recibir_frames(mensaje_mediapipe(4))
+    _, (puntos, _) = estado.evaluar(0.5)
+    copia = puntos.copy()
+    # Frames nuevos mientras el threadpool clasifica: no cambian los ya leídos
+    estado.recibir_frames(mensaje_mediapipe(transmision.CAPACIDAD_BUFFER, 1000.0))
+    estado.buffer.puntos[:] = 0
+    np.testing.assert_array_equal(puntos, copia)
@@ -0,0 +1,49 @@
+"""Estadísticas por sentencia de las conexiones SQLite trazadas (proyecto/src/trazas_sql.py)"""
+import sqlite3
+import pytest
+from proyecto.src import trazas_sql
+from proyecto.src.trazas_sql import ConexionTrazada, normalizar_sql
+
+
+@pytest.fixture
+def conexion():
+    trazas_sql.reiniciar_estadisticas()
+    conn = sqlite3.connect(":memory:", factory=ConexionTrazada)
+    yield conn
+    conn.close()
+    trazas_sql.reiniciar_estadisticas()
+
+
+def estadistica(sql: str) -> dict:
+    return {e["sql"]: e for e in trazas_sql.obtener_top_consultas(100)}.get(normalizar_sql(sql))
+
+
+def test_conn_execute_se_registra(conexion):
+    conexion.execute("CREATE TABLE t (x INTEGER)")
+    filas = conexion.execute("SELECT 1").fetchall()
+    assert filas == [(1,)]
+    assert estadistica("SELECT 1")["ejecuciones"] == 1
+    assert estadistica("SELECT 1")["filas"] == 1
+    assert estadistica("CREATE TABLE t (x INTEGER)")["ejecuciones"] == 1
+
+
+def test_conn_executemany_cuenta_filas_afectadas(conexion):
+    conexion.execute("CREATE TABLE t (x INTEGER)")
+    conexion.executemany("INSERT INTO t (x) VALUES (?)", [(i,) for i in range(5)])
+    assert estadistica("INSERT INTO t (x) VALUES (?)") == {**estadistica("INSERT INTO t (x) VALUES (?)"),
+                                                           "ejecuciones": 1, "filas": 5}
+    assert conexion.execute("SELECT COUNT(*) FROM t").fetchone() == (5,)
+
+
+def test_conn_executescript_se_registra(conexion):
+    guion = "CREATE TABLE a (x); CREATE TABLE b (y);"
+    conexion.executescript(guion)
+    assert estadistica(guion)["ejecuciones"] == 1
+    assert {fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master")} == {"a", "b"}
+
+
+def test_cursor_y_conn_execute_se_agrupan(conexion):
+    conexion.execute("CREATE TABLE t (x INTEGER)")
+    conexion.execute("SELECT x FROM t WHERE x = 1").fetchall()
+    conexion.cursor().execute("SELECT x FROM t WHERE x = 2").fetchall()
+    assert estadistica("SELECT x FROM t WHERE x = ?")["ejecuciones"] == 2